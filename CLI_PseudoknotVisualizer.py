@@ -1,142 +1,145 @@
 from coloring import CLI_coloring_canonical, load_colors_from_json, get_color_for_depth
 from argparser import argparser, args_validation
 from analysis.parsers import raw_df_processing, filter_abnormal_pairs
-from config import RNAVIEW_DIR, RNAVIEW_EXEC, PseudoKnotVisualizer_DIR, INTERMEDIATE_DIR, DSSR_EXEC
+from config import RNAVIEW_DIR, RNAVIEW_EXEC, PseudoKnotVisualizer_DIR, DSSR_EXEC
 from rna import PKextractor
 from addressRNAviewOutput import load_rnaview_data #, extract_base_pairs_from_rnaview,
 from addressDSSROutput import load_dssr_data #, extract_base_pairs_from_dssr,
-from Bio.PDB import PDBParser, PDBIO, Select
-from Bio.PDB.MMCIFParser import MMCIFParser
+from structure_io import export_chain, export_table, restore_chain_id, structure_stem
+from atom_table import read_atom_table
+from workdir import annotator_workdir, annotator_input
+from limits import time_limit
+from log_config import configure_logging, get_logger
+from instrumentation import count, stage, timed
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import subprocess
 import os
+import sys
 import pathlib
-import shutil
+import contextvars
+import logging
+import time
 
+logger = get_logger("cli")
 colors = load_colors_from_json(PseudoKnotVisualizer_DIR / "colors.json")
 # rnaview_exec = RNAVIEW_EXEC
 
-class _ChainSelect(Select):
-    def __init__(self, chain_id):
-        self.chain_id = chain_id
-    def accept_model(self, model):
-        return True
-    def accept_chain(self, chain):
-        return chain.id == self.chain_id
-    def accept_residue(self, residue):
-        return True
-    def accept_atom(self, atom):
-        return True
+# --annotator both で同時に実行するアノテーター
+JOINT_ANNOTATORS = ("DSSR", "RNAView")
+# 同じ塩基対リストの layer 分解を使い回す件数（長時間動くプロセス (serve, batch のワーカー) で効く）
+DECOMPOSITION_CACHE_SIZE = 1024
 
 
 def get_chain_ids(struct_file):
     """Parse the input structure and return a sorted list of chain IDs in the first model.
 
-    Supports .pdb, .cif/.mmcif. Raises ValueError for unsupported extensions.
+    Supports .pdb, .cif/.mmcif and their gzip-compressed variants (.gz).
+    Raises ValueError for unsupported extensions.
     """
-    ext = os.path.splitext(struct_file)[1].lower()
-    if ext in (".cif", ".mmcif"):
-        parser = MMCIFParser(QUIET=True)
-    elif ext == ".pdb":
-        parser = PDBParser(QUIET=True)
-    else:
-        raise ValueError("Input file should be .cif or .pdb")
-
-    structure = parser.get_structure("structure", struct_file)
-    model0 = next(structure.get_models())
-    chains = sorted({chain.id for chain in model0})
-    return chains
-
-
-def CLI_rnaview(struct_file, chain_id):
-    # 入力ファイルが .cif か .pdb かを拡張子で判定
-    ext = os.path.splitext(struct_file)[1].lower()
-    file_type = None
-    if ext == ".cif" or ext == ".mmcif":
-        parser = MMCIFParser(QUIET=True)
-        file_type = "cif"
-    elif ext == ".pdb":
-        parser = PDBParser(QUIET=True)
-        file_type = "pdb"
-    else:
-        raise ValueError("Input file should be .cif or .pdb")
-
-    structure = parser.get_structure("structure", struct_file)
+    return read_atom_table(struct_file).chain_ids()
 
-    chain_structure = structure[0]
-    selected_chain = None
-    for chain in chain_structure:
-        if chain.id == chain_id:
-            selected_chain = chain
-            break
 
-    if selected_chain is None:
+def read_chain_table(struct_file, chain_id):
+    """入力構造の最初のモデルから chain_id の AtomTable を切り出す（複数のアノテーターで使い回す用）"""
+    table = read_atom_table(struct_file)
+    chain_table = table.select(chain=chain_id, model=table.first_model())
+    if len(chain_table) == 0:
         raise ValueError(f"Chain ID {chain_id} not found in {struct_file}")
+    return chain_table
+
 
+def _export_for(struct_file, chain_id, out_stem, annotator, chain_table=None, out_path=None):
+    """chain_table があれば構造ファイルを読み直さずに書き出す"""
+    with stage("export"):
+        if chain_table is not None:
+            return export_table(chain_table, chain_id, out_stem, annotator=annotator, out_path=out_path)
+        return export_chain(struct_file, chain_id, out_stem, annotator=annotator, out_path=out_path)
+
+
+def rnaview_command(input_path):
+    """RNAView の起動コマンド（作業ディレクトリで実行し、結果は <input_path>.out に書かれる）"""
+    return [str(RNAVIEW_EXEC), "-p", "--pdb", str(input_path)]
+
+def dssr_command(input_path, json_output_path):
+    """DSSR の起動コマンド（結果は json_output_path に JSON で書かれる）"""
+    return [str(DSSR_EXEC), f"-i={str(input_path)}", "--json", f"-o={str(json_output_path)}"]
+
+def CLI_rnaview(struct_file, chain_id, workdir=None, timeout=None, chain_table=None):
+    """
+    CLI version of RNAView wrapper.
+    workdir を省略した場合は専用の作業ディレクトリを作り、終了時に削除する。
+    timeout 秒を超えると RNAView を kill して subprocess.TimeoutExpired を送出する（None なら無制限）。
+    chain_table (read_chain_table の結果) を渡すと構造ファイルを読み直さない。
+    """
+    if workdir is None:
+        with annotator_workdir("rnaview") as workdir:
+            return CLI_rnaview(struct_file, chain_id, workdir, timeout, chain_table)
+    workdir = pathlib.Path(workdir)
     # チェーン限定のPDBを書き出して RNAView に渡す（チェーン混入を避ける）
+    # .gz 入力もここでストリーム展開され、書き出されるのはチェーン限定ファイルのみ
     arg = "--pdb"
-    print(f"rnaview starts with {struct_file} and chain {chain_id}, output type is {arg} (chain-scoped PDB)")
-    copied_file = pathlib.Path(INTERMEDIATE_DIR) / f"{pathlib.Path(struct_file).stem}_chain_{chain_id}.pdb"
-    io = PDBIO()
-    io.set_structure(structure)
-    io.save(str(copied_file), _ChainSelect(chain_id))
-
-    subprocess.run(
-        [RNAVIEW_EXEC, "-p", arg, str(copied_file)],
-        env={"RNAVIEW": RNAVIEW_DIR},
-        cwd=INTERMEDIATE_DIR,
-        check=True
-        )
-
-    print("rnaview done.")
-    result_file = pathlib.Path(INTERMEDIATE_DIR) / (copied_file.name + ".out")
-    df = load_rnaview_data(str(result_file))
-    return df
-
-def CLI_dssr(struct_file, chain_id):
-    """CLI version of DSSR wrapper"""
-    # intermediate 以下に複製する
-    copied_file = pathlib.Path(INTERMEDIATE_DIR) / pathlib.Path(struct_file).name
-    shutil.copy2(struct_file, copied_file)
-
-    print(f"DSSR starts with {struct_file}")
-    
-    # DSSR実行（JSONフォーマットで出力）
-    json_output_path = pathlib.Path(INTERMEDIATE_DIR) / (pathlib.Path(struct_file).name + ".dssr.json")
-    result = subprocess.run(
-        [str(DSSR_EXEC), f"-i={str(copied_file)}", "--json", f"-o={str(json_output_path)}"],
-        cwd=INTERMEDIATE_DIR,
-        check=True,
-        capture_output=True,
-        text=True
+    logger.debug("rnaview starts with %s and chain %s, output type is %s (chain-scoped PDB)", struct_file, chain_id, arg)
+    export = _export_for(
+        struct_file, chain_id,
+        workdir / f"{structure_stem(struct_file)}_chain_{chain_id}",
+        "RNAView", chain_table,
     )
-    print(f"command: \n {str(DSSR_EXEC)} -i={str(copied_file)} --json -o={str(json_output_path)}")
-    if result.returncode != 0 or not json_output_path.exists():
-        print(f"DSSR failed with return code: {result.returncode}")
-        print(f"stdout: {result.stdout}")
-        print(f"stderr: {result.stderr}")
-    return load_dssr_data(str(json_output_path))
 
-def CLI_PseudoKnotVisualizer(pdb_file, chain_id, format, output_file, model_id, annotator="RNAView", include_all=False):
-    # 事前にチェーン存在確認（存在しなければ候補を表示して終了）
-    try:
-        chains = get_chain_ids(pdb_file)
-    except Exception as e:
-        print(f"[CLI] Failed to read structure '{pdb_file}': {e}")
-        return False
+    with stage("annotator"):
+        subprocess.run(
+            rnaview_command(export.path),
+            env={"RNAVIEW": RNAVIEW_DIR},
+            cwd=workdir,
+            check=True,
+            timeout=timeout
+            )
 
-    if chain_id not in chains:
-        printable = ", ".join(chains) if chains else "(none found)"
-        print(f"[CLI] Chain '{chain_id}' not found in input '{pdb_file}'.")
-        print(f"[CLI] Available chains: {printable}")
-        print("[CLI] Aborting. Please specify one of the listed chain IDs.")
-        return False
+    logger.debug("rnaview done.")
+    result_file = workdir / (export.path.name + ".out")
+    df = load_rnaview_data(str(result_file))
+    return restore_chain_id(df, export, chain_id)
 
-    # パーサーの選択に応じてベースペアを抽出
-    if annotator.upper() == "DSSR":
-        raw_df = CLI_dssr(pdb_file, chain_id)
-    
-    elif annotator.upper() == "RNAVIEW":
-        raw_df = CLI_rnaview(pdb_file, chain_id)
+def CLI_dssr(struct_file, chain_id, workdir=None, timeout=None, chain_table=None):
+    """
+    CLI version of DSSR wrapper.
+    workdir を省略した場合は専用の作業ディレクトリを作り、終了時に削除する。
+    timeout 秒を超えると DSSR を kill して subprocess.TimeoutExpired を送出する（None なら無制限）。
+    chain_table (read_chain_table の結果) を渡すと構造ファイルを読み直さない。
+    """
+    if workdir is None:
+        with annotator_workdir("dssr") as workdir:
+            return CLI_dssr(struct_file, chain_id, workdir, timeout, chain_table)
+    workdir = pathlib.Path(workdir)
+    # 作業ディレクトリにチェーン限定の mmCIF を書き出す
+    # （PDB 形式の原子数・チェーンID長の上限に引っかからない。.gz 入力もそのまま読める）
+    # SCRATCH_BACKEND="memfd" の場合は入力を匿名メモリファイルに書いて渡す
+    stem = f"{structure_stem(struct_file)}_chain_{chain_id}"
+    with annotator_input(workdir, "DSSR") as (input_path, pass_fds):
+        export = _export_for(struct_file, chain_id, workdir / stem, "DSSR", chain_table, out_path=input_path)
+        copied_file = export.path
+
+        logger.debug("DSSR starts with %s (chain-scoped %s)", struct_file, export.fmt)
+        
+        # DSSR実行（JSONフォーマットで出力）
+        json_output_path = workdir / f"{stem}.cif.dssr.json"
+        with stage("annotator"):
+            result = subprocess.run(
+                dssr_command(copied_file, json_output_path),
+                cwd=workdir,
+                check=True,
+                capture_output=True,
+                text=True,
+                pass_fds=pass_fds,
+                timeout=timeout
+            )
+    logger.debug("command: %s", " ".join(dssr_command(copied_file, json_output_path)))
+    if result.returncode != 0 or not json_output_path.exists():
+        logger.warning("DSSR failed with return code: %s\nstdout: %s\nstderr: %s",
+                       result.returncode, result.stdout, result.stderr)
+    return restore_chain_id(load_dssr_data(str(json_output_path)), export, chain_id)
+
+def filter_chain_pairs(raw_df, chain_id):
     # チェーンフィルタ（対象チェーン内のペアのみ残す）
     try:
         if not raw_df.empty and "chain1" in raw_df.columns and "chain2" in raw_df.columns:
@@ -144,77 +147,367 @@ def CLI_PseudoKnotVisualizer(pdb_file, chain_id, format, output_file, model_id,
             filtered = raw_df[(raw_df["chain1"] == chain_id) & (raw_df["chain2"] == chain_id)].copy()
             if len(filtered) == 0 and before > 0:
                 # フィルタで全て消えた場合は未フィルタのまま進める（チェーン限定PDBを使っているため）
-                print(f"[CLI] Chain filter '{chain_id}' removed all pairs; keeping unfiltered {before} pairs")
+                logger.info("[CLI] Chain filter '%s' removed all pairs; keeping unfiltered %d pairs", chain_id, before)
             else:
                 raw_df = filtered
-                print(f"[CLI] Filtered by chain '{chain_id}': {len(raw_df)}/{before} pairs")
+                logger.debug("[CLI] Filtered by chain '%s': %d/%d pairs", chain_id, len(raw_df), before)
     except Exception as e:
-        print(f"[CLI] Chain filtering skipped due to error: {e}")
-    processed_df = raw_df_processing(raw_df, annotator)
-    # remove abnormal pairs
-    processed_df, abnormal_pairs, dup_canonical_pairs = filter_abnormal_pairs(processed_df)
+        logger.warning("[CLI] Chain filtering skipped due to error: %s", e)
+    return raw_df
+
+def annotate_chain(pdb_file, chain_id, annotator="RNAView", timeout=None, chain_table=None):
+    """アノテーターを実行し、対象チェーン内の塩基対 (raw_df) を返す"""
+    # パーサーの選択に応じてベースペアを抽出
+    if annotator.upper() == "DSSR":
+        raw_df = CLI_dssr(pdb_file, chain_id, timeout=timeout, chain_table=chain_table)
+    elif annotator.upper() == "RNAVIEW":
+        raw_df = CLI_rnaview(pdb_file, chain_id, timeout=timeout, chain_table=chain_table)
+    else:
+        raise ValueError(f"Unsupported annotator: {annotator}. Use 'DSSR', 'RNAView' or 'both'.")
+    return filter_chain_pairs(raw_df, chain_id)
+
+def annotate_chain_joint(pdb_file, chain_id, annotators=JOINT_ANNOTATORS, timeout=None):
+    """
+    構造ファイルを 1 回だけ読み、複数のアノテーターを同じチェーンに対して同時に実行する。
+    アノテーターは別プロセスなので、スレッドから起動すれば実行が重なり、
+    所要時間は合計ではなく最も遅いアノテーター程度になる。
+
+    Returns:
+        tuple: ({annotator: raw_df}, {annotator: 実行時間[秒]})
+    """
+    chain_table = read_chain_table(pdb_file, chain_id)
+
+    def run(annotator):
+        start = time.perf_counter()
+        raw_df = annotate_chain(pdb_file, chain_id, annotator, timeout=timeout, chain_table=chain_table)
+        return raw_df, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(annotators)) as executor:
+        # 呼び出し元の task_stats に各アノテーターの段階の時間が入るよう、context を引き継いで実行する
+        futures = {annotator: executor.submit(contextvars.copy_context().run, run, annotator) for annotator in annotators}
+        # 1 つでも失敗したら例外をそのまま送出する（もう一方の終了は with を抜ける時に待つ）
+        results = {annotator: future.result() for annotator, future in futures.items()}
+    elapsed = {annotator: round(sec, 4) for annotator, (_, sec) in results.items()}
+    elapsed["wall"] = round(time.perf_counter() - start, 4)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("[CLI] Joint annotation: " + ", ".join(f"{name} {sec:.2f}s" for name, sec in elapsed.items()))
+    return {annotator: raw_df for annotator, (raw_df, _) in results.items()}, elapsed
+
+def select_variant_pairs(processed_df, include_all=False):
+    """filter_abnormal_pairs 済みの processed_df から、include_all に応じて使う塩基対を選ぶ"""
     # Canonical-only by default unless include_all=True
     if not include_all:
         before_cnt = len(processed_df)
-        processed_df = processed_df[processed_df["is_canonical"]].copy()
-        print(f"[CLI] Using canonical base pairs only: {len(processed_df)}/{before_cnt}")
+        selected = processed_df[processed_df["is_canonical"]].copy()
+        logger.debug("[CLI] Using canonical base pairs only: %d/%d", len(selected), before_cnt)
     else:
-        canon_cnt = len(processed_df[processed_df["is_canonical"]])
-        noncanon_cnt = len(processed_df) - canon_cnt
-        print(f"[CLI] Using all base pairs: {len(processed_df)} total ({canon_cnt} canonical, {noncanon_cnt} non-canonical)")
-
-    # print(f"Processed DataFrame:\n{processed_df.head()}")
-    # Orientation normalization: ensure (i < j)
-    BPL = []
-    for _, row in processed_df.iterrows():
-        i, j = row["position"]
-        BPL.append((i, j) if i < j else (j, i))
-    pdb_id = os.path.splitext(os.path.basename(pdb_file))[0]
-    PKlayers = PKextractor(BPL)
+        selected = processed_df
+        if logger.isEnabledFor(logging.DEBUG):
+            canon_cnt = int(processed_df["is_canonical"].sum())
+            logger.debug("[CLI] Using all base pairs: %d total (%d canonical, %d non-canonical)",
+                         len(processed_df), canon_cnt, len(processed_df) - canon_cnt)
+    return selected
+
+@lru_cache(maxsize=DECOMPOSITION_CACHE_SIZE)
+def _cached_pk_layers(BPL):
+    return tuple(tuple(PKlayer) for PKlayer in PKextractor(list(BPL)))
+
+def pk_layers(BPL):
+    """PKextractor の結果を塩基対リストごとにキャッシュする（呼び出し側には新しいリストを返す）"""
+    hits = _cached_pk_layers.cache_info().hits
+    layers = [list(PKlayer) for PKlayer in _cached_pk_layers(tuple(BPL))]
+    count("decomposition_cache_hits" if _cached_pk_layers.cache_info().hits > hits else "decomposition_cache_misses")
+    return layers
+
+def decompose_variants(raw_df, annotator="RNAView", variants=(False, True), timeout=None):
+    """
+    1 回のアノテーター出力 raw_df から、include_all の値ごとに pseudoknot layer に分解する。
+    共通フォーマットへの変換と異常ペアの除外は 1 回だけ行い、canonical の選択と DP だけを variant ごとに行う。
+
+    Args:
+        variants (tuple[bool]): include_all の値のリスト（既定: canonical-only と include-all の両方）
+
+    Returns:
+        dict: include_all -> (processed_df, PKlayers, abnormal_pairs, dup_canonical_pairs)
+    """
+    processed_df = raw_df_processing(raw_df, annotator)
+    # remove abnormal pairs
+    processed_df, abnormal_pairs, dup_canonical_pairs = filter_abnormal_pairs(processed_df)
+
+    decomposed = {}
+    for include_all in variants:
+        selected = select_variant_pairs(processed_df, include_all)
+        # print(f"Processed DataFrame:\n{selected.head()}")
+        # Orientation normalization: ensure (i < j)
+        BPL = []
+        for _, row in selected.iterrows():
+            i, j = row["position"]
+            BPL.append((i, j) if i < j else (j, i))
+        with time_limit(timeout, f"PKextractor ({len(BPL)} base pairs)"):
+            PKlayers = pk_layers(BPL)
+        count("pairs", len(BPL))
+        count("layers", len(PKlayers))
+        decomposed[include_all] = (selected, PKlayers, abnormal_pairs, dup_canonical_pairs)
+    return decomposed
+
+def decompose_pairs(raw_df, annotator="RNAView", include_all=False, timeout=None):
+    """
+    raw_df を共通フォーマットに変換・異常ペアを除外し、pseudoknot layer に分解する。
+    layer 分解 (DP) が timeout 秒を超えた場合は limits.TaskTimeout を送出する。
+
+    Returns:
+        tuple: (processed_df, PKlayers, abnormal_pairs, dup_canonical_pairs)
+    """
+    return decompose_variants(raw_df, annotator, (include_all,), timeout=timeout)[include_all]
+
+def chain_result(pdb_file, chain_id, annotator, include_all, processed_df, PKlayers, abnormal_pairs, dup_canonical_pairs):
+    """分解結果を analyze_chain の dict 形式にまとめる"""
+    return {
+        "pdb_id": structure_stem(pdb_file),
+        "input": str(pdb_file),
+        "chain_id": chain_id,
+        "annotator": annotator,
+        "include_all": include_all,
+        "base_pair_count": len(processed_df),
+        "pseudoknot_layer_count": len(PKlayers),
+        "layers": [[[int(i), int(j)] for i, j in PKlayer] for PKlayer in PKlayers],
+        "abnormal_pairs": [list(map(int, bp)) for bp in abnormal_pairs],
+        "dup_canonical_pairs": sorted([list(map(int, bp)) for bp in dup_canonical_pairs]),
+    }
+
+def analyze_chain_variants(pdb_file, chain_id, annotator="RNAView", variants=(False, True),
+                           annotator_timeout=None, dp_timeout=None):
+    """
+    アノテーターを 1 回だけ実行し、include_all の値ごとの結果 dict を variants の順に返す。
+    """
+    raw_df = annotate_chain(pdb_file, chain_id, annotator, timeout=annotator_timeout)
+    decomposed = decompose_variants(raw_df, annotator, variants, timeout=dp_timeout)
+    return [chain_result(pdb_file, chain_id, annotator, include_all, *decomposed[include_all])
+            for include_all in variants]
+
+def pair_agreement(results):
+    """
+    アノテーターごとの結果 dict (chain_result) の間で、塩基対と layer の一致を数える。
+
+    Args:
+        results (dict): annotator -> chain_result（2 つ）
+
+    Returns:
+        dict: shared_pairs, union_pairs, jaccard, same_layer_pairs, "<annotator>_only" (各アノテーターだけの塩基対)
+    """
+    (name_a, result_a), (name_b, result_b) = results.items()
+    layer_of = [
+        {(i, j): depth for depth, layer in enumerate(result["layers"]) for i, j in layer}
+        for result in (result_a, result_b)
+    ]
+    shared = layer_of[0].keys() & layer_of[1].keys()
+    union = layer_of[0].keys() | layer_of[1].keys()
+    return {
+        "shared_pairs": len(shared),
+        "union_pairs": len(union),
+        "jaccard": round(len(shared) / len(union), 4) if union else 1.0,
+        "same_layer_pairs": sum(layer_of[0][bp] == layer_of[1][bp] for bp in shared),
+        f"{name_a}_only": sorted(list(bp) for bp in layer_of[0].keys() - shared),
+        f"{name_b}_only": sorted(list(bp) for bp in layer_of[1].keys() - shared),
+    }
+
+def analyze_chain_joint(pdb_file, chain_id, variants=(False,), annotators=JOINT_ANNOTATORS,
+                        annotator_timeout=None, dp_timeout=None):
+    """
+    両方のアノテーターを同時に実行し、それぞれ同じフィルタと layer 分解を通して、
+    include_all の値ごとに 1 つの結果 dict（両方の layer と一致度）を variants の順に返す。
+
+    Returns:
+        list[dict]: pdb_id, input, chain_id, annotator ("both"), include_all,
+                    annotators ({annotator: chain_result}), agreement (pair_agreement), annotator_elapsed_sec
+    """
+    raw_dfs, elapsed = annotate_chain_joint(pdb_file, chain_id, annotators, timeout=annotator_timeout)
+    decomposed = {
+        annotator: decompose_variants(raw_df, annotator, variants, timeout=dp_timeout)
+        for annotator, raw_df in raw_dfs.items()
+    }
+    joint = []
+    for include_all in variants:
+        per_annotator = {
+            annotator: chain_result(pdb_file, chain_id, annotator, include_all, *decomposed[annotator][include_all])
+            for annotator in annotators
+        }
+        joint.append({
+            "pdb_id": structure_stem(pdb_file),
+            "input": str(pdb_file),
+            "chain_id": chain_id,
+            "annotator": "both",
+            "include_all": include_all,
+            "annotators": per_annotator,
+            "agreement": pair_agreement(per_annotator),
+            "annotator_elapsed_sec": elapsed,
+        })
+    return joint
+
+def analyze_chain(pdb_file, chain_id, annotator="RNAView", include_all=False,
+                  annotator_timeout=None, dp_timeout=None):
+    """
+    1 本のチェーンについて annotate → filter → decompose を行い、結果を dict で返す。
+    annotator_timeout / dp_timeout はそれぞれアノテーター実行と layer 分解の時間上限（秒、None なら無制限）。
+    batch / watch / serve のワーカーは config.py の ANNOTATOR_TIMEOUT / PKEXTRACTOR_TIMEOUT を渡す。
+
+    Returns:
+        dict: pdb_id, input, chain_id, annotator, include_all, base_pair_count,
+              pseudoknot_layer_count, layers ([[i, j], ...] のリストを layer ごとに), 
+              abnormal_pairs, dup_canonical_pairs
+              annotator="both" の場合は analyze_chain_joint の形式
+    """
+    if annotator.lower() == "both":
+        return analyze_chain_joint(pdb_file, chain_id, (include_all,),
+                                   annotator_timeout=annotator_timeout, dp_timeout=dp_timeout)[0]
+    return analyze_chain_variants(pdb_file, chain_id, annotator, (include_all,),
+                                  annotator_timeout=annotator_timeout, dp_timeout=dp_timeout)[0]
+
+def variant_output_path(output_file, include_all):
+    """
+    両 variant を書き出すときの出力パス（拡張子の前に variant 名を入れる）
+    例: coloring_1KPD.A.pymol.txt -> coloring_1KPD.A.pymol.canonical_only.txt / coloring_1KPD.A.pymol.all.txt
+    """
+    output_file = pathlib.Path(output_file)
+    variant = "all" if include_all else "canonical_only"
+    return output_file.with_name(f"{output_file.stem}.{variant}{output_file.suffix}")
+
+def annotator_output_path(output_file, annotator):
+    """
+    --annotator both でアノテーターごとのスクリプトを書き出すときの出力パス
+    例: out.txt -> out.dssr.txt / out.rnaview.txt
+    """
+    output_file = pathlib.Path(output_file)
+    return output_file.with_name(f"{output_file.stem}.{annotator.lower()}{output_file.suffix}")
 
+def write_coloring_script(pdb_id, chain_id, PKlayers, format, output_file, model_id):
+    """PKlayers を PyMOL / Chimera のカラーリングスクリプトとして書き出す"""
     with open(output_file, "w") as f:
-        # 1) Precoloring (whiten target first)
+        f.write(coloring_script(pdb_id, chain_id, PKlayers, format, model_id))
+    return output_file
+
+@timed("coloring")
+def coloring_script(pdb_id, chain_id, PKlayers, format, model_id):
+    """PKlayers を PyMOL / Chimera のカラーリングスクリプトの文字列にする"""
+    lines = []
+    # 1) Precoloring (whiten target first)
+    if format.lower() == "pymol":
+        lines.append(f"color white, {pdb_id} and chain {chain_id}\n")
+    elif format.lower() == "chimera":
+        # Chimera chain-wide whitening (model required)
+        if model_id is None:
+            logger.warning("[CLI] Chimera format requested but model_id is None; skipping whitening.")
+        else:
+            lines.append(f"color white #{model_id}:.{chain_id}\n")
+
+    # 2) Layer coloring + selection commands
+    for depth, PKlayer in enumerate(PKlayers):
+        color = get_color_for_depth(depth + 1, colors)
+        lines.append(CLI_coloring_canonical(pdb_id, model_id, chain_id, PKlayer, color, format))
+
+        # Add paper-friendly selections for PyMOL output
         if format.lower() == "pymol":
-            f.write(f"color white, {pdb_id} and chain {chain_id}\n")
-        elif format.lower() == "chimera":
-            # Chimera chain-wide whitening (model required)
-            if model_id is None:
-                print("[CLI] Warning: Chimera format requested but model_id is None; skipping whitening.")
-            else:
-                f.write(f"color white #{model_id}:.{chain_id}\n")
-
-        # 2) Layer coloring + selection commands
-        for depth, PKlayer in enumerate(PKlayers):
-            color = get_color_for_depth(depth + 1, colors)
-            script = CLI_coloring_canonical(pdb_id, model_id, chain_id, PKlayer, color, format)
-            f.write(script)
-
-            # Add paper-friendly selections for PyMOL output
-            if format.lower() == "pymol":
-                all_res = []
-                for i, j in PKlayer:
-                    all_res.extend([str(i), str(j)])
-                if all_res:
-                    res_expr = "+".join(all_res)
-                    paper_name = "core" if depth == 0 else f"pk{depth}"
-                    paper_name = f"{str(pathlib.Path(pdb_file).stem)}_{chain_id}_{paper_name}"
-                    f.write(f"select {paper_name}, {pdb_id} and chain {chain_id} and resi {res_expr}\n")
-
-    print("Coloring done.")
-    print(f"Depth is {len(PKlayers)}")
-    print(f"Output script is saved as {output_file}")
+            all_res = []
+            for i, j in PKlayer:
+                all_res.extend([str(i), str(j)])
+            if all_res:
+                res_expr = "+".join(all_res)
+                paper_name = "core" if depth == 0 else f"pk{depth}"
+                paper_name = f"{pdb_id}_{chain_id}_{paper_name}"
+                lines.append(f"select {paper_name}, {pdb_id} and chain {chain_id} and resi {res_expr}\n")
+    return "".join(lines)
+
+def CLI_PseudoKnotVisualizer(pdb_file, chain_id, format, output_file, model_id, annotator="RNAView", include_all=False,
+                             both_variants=False):
+    """
+    both_variants=True の場合はアノテーターを 1 回だけ実行し、canonical-only と include-all の
+    両方のスクリプトを variant_output_path の名前で書き出す（include_all は無視される）。
+    """
+    # 事前にチェーン存在確認（存在しなければ候補を表示して終了）
+    try:
+        chains = get_chain_ids(pdb_file)
+    except Exception as e:
+        logger.error("[CLI] Failed to read structure '%s': %s", pdb_file, e)
+        return False
+
+    if chain_id not in chains:
+        printable = ", ".join(chains) if chains else "(none found)"
+        logger.error("[CLI] Chain '%s' not found in input '%s'.", chain_id, pdb_file)
+        logger.error("[CLI] Available chains: %s", printable)
+        logger.error("[CLI] Aborting. Please specify one of the listed chain IDs.")
+        return False
+
+    if annotator.lower() == "both":
+        # DSSR と RNAView を同時に実行し、アノテーターごと（と variant ごと）にスクリプトを書き出す
+        variants = (False, True) if both_variants else (include_all,)
+        for result in analyze_chain_joint(pdb_file, chain_id, variants):
+            for name, sub in result["annotators"].items():
+                script_file = annotator_output_path(output_file, name)
+                if both_variants:
+                    script_file = variant_output_path(script_file, result["include_all"])
+                write_coloring_script(sub["pdb_id"], chain_id, sub["layers"], format, script_file, model_id)
+                logger.info("[CLI] %s: Depth is %d, script saved as %s", name, sub["pseudoknot_layer_count"], script_file)
+            agreement = result["agreement"]
+            logger.info("[CLI] Agreement (%s): %d/%d pairs shared (Jaccard %s), %d in the same layer",
+                        "include-all" if result["include_all"] else "canonical-only",
+                        agreement["shared_pairs"], agreement["union_pairs"], agreement["jaccard"],
+                        agreement["same_layer_pairs"])
+        logger.info("Coloring done.")
+        return True
+
+    if both_variants:
+        # アノテーターは 1 回だけ実行し、canonical-only と include-all の両方を書き出す
+        for result in analyze_chain_variants(pdb_file, chain_id, annotator, (False, True)):
+            variant_file = variant_output_path(output_file, result["include_all"])
+            write_coloring_script(result["pdb_id"], chain_id, result["layers"], format, variant_file, model_id)
+            logger.info("[CLI] %s: Depth is %d, script saved as %s",
+                        "include-all" if result["include_all"] else "canonical-only",
+                        result["pseudoknot_layer_count"], variant_file)
+        logger.info("Coloring done.")
+        return True
+
+    result = analyze_chain(pdb_file, chain_id, annotator, include_all)
+    write_coloring_script(result["pdb_id"], chain_id, result["layers"], format, output_file, model_id)
+
+    logger.info("Coloring done.")
+    logger.info("Depth is %d", result["pseudoknot_layer_count"])
+    logger.info("Output script is saved as %s", output_file)
     return True
 
 def main():
+    # サブコマンド: manifest に列挙された全チェーンをプロセスプールで処理する
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        from batch import batch_main
+        batch_main(sys.argv[2:])
+        return
+    # サブコマンド: ディレクトリに置かれた構造ファイルを検出して処理し続ける
+    if len(sys.argv) > 1 and sys.argv[1] == "watch":
+        from watch import watch_main
+        watch_main(sys.argv[2:])
+        return
+    # サブコマンド: batch --queue で複数ノードに分散した結果をまとめる
+    if len(sys.argv) > 1 and sys.argv[1] == "merge":
+        from work_queue import merge_main
+        merge_main(sys.argv[2:])
+        return
+    # サブコマンド: 常駐して解析リクエストを受け付ける
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        from service import serve_main
+        serve_main(sys.argv[2:])
+        return
+
     args = argparser()
     args_validation(args)
+    configure_logging(args.log_level)
 
-    print("PseudoKnotVisualizer started.")
+    logger.info("PseudoKnotVisualizer started.")
     # Backward compatibility: accept legacy --parser if present
     annotator = getattr(args, 'annotator', None) or getattr(args, 'parser', 'RNAView')
-    ok = CLI_PseudoKnotVisualizer(args.input, args.chain, args.format, args.output, args.model, annotator, include_all=getattr(args, 'include_all', False))
+    ok = CLI_PseudoKnotVisualizer(args.input, args.chain, args.format, args.output, args.model, annotator, include_all=getattr(args, 'include_all', False),
+                                  both_variants=getattr(args, 'both_variants', False))
     if ok:
-        print("PseudoKnotVisualizer finished: " + args.output)
+        logger.info("PseudoKnotVisualizer finished: %s", args.output)
 
 if __name__ == "__main__":
     main()
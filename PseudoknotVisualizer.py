@@ -1,23 +1,35 @@
-from config import RNAVIEW_DIR, RNAVIEW_EXEC, PseudoKnotVisualizer_DIR, INTERMEDIATE_DIR, DSSR_EXEC
+from config import PseudoKnotVisualizer_DIR, INTERMEDIATE_DIR
 from coloring import coloring_canonical, load_colors_from_json, get_color_for_depth
-from analysis.parsers import raw_df_processing, filter_abnormal_pairs
-from rna import PKextractor
+from atom_table import parse_atom_table_text
+from pkv_core import (CANCEL_POLL_SEC, AnnotationCancelled, annotate_table, decompose_annotation,
+                      decompose_annotation_task, dssr_table, rnaview_table)
+from dedup import group_by_fingerprint, table_fingerprints
+from log_config import configure_logging, get_logger
+from instrumentation import PROCESS_STATS, format_summary, stage, timed, write_stats
 import os
 from pymol import cmd
-import tempfile
-import subprocess
-
-from addressRNAviewOutput import load_rnaview_data
-from addressDSSROutput import load_dssr_data
 import pathlib
+import itertools
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 # DEBUG = True
 DEBUG = False
 
+logger = get_logger("pymol")
+# PyMOL のコンソールに要約 (INFO) を表示する。詳細は pkv_log_level DEBUG で表示する
+configure_logging("INFO")
+
 colors = load_colors_from_json(PseudoKnotVisualizer_DIR / "colors.json")
 
 def clear_intermediate_files(except_files=None):
-    # intermediate dir には他のゴミのファイルがあるので消しておく
+    # intermediate dir 直下に残った古いファイルを手動で掃除するための関数。
+    # 各アノテーター実行は専用の作業ディレクトリ (workdir.annotator_workdir) を使い、
+    # 自分の作業ディレクトリだけを削除するので、実行のたびに呼ぶ必要はない
+    # （同時実行中の他プロセスのファイルを消さないよう、自動では呼ばない）。
     if except_files is None:
         except_files = []
     for f in os.listdir(INTERMEDIATE_DIR):
@@ -30,6 +42,18 @@ def clear_intermediate_files(except_files=None):
                 os.remove(pathlib.Path(INTERMEDIATE_DIR) / f)
     return
 
+def selection_atom_table(selection):
+    """
+    PyMOL の selection を AtomTable として取得する。
+    cmd.get_model による原子ごとのオブジェクト生成を避け、mmCIF 文字列を列単位で読み込む。
+    """
+    return parse_atom_table_text(cmd.get_str("cif", selection), "cif")
+
+def _integer_residue_numbers(pdb_object, chain):
+    # 挿入コード付きなどの非整数 resi は PyMOL の cif 出力でも整数部のみになるため、そのまま扱う
+    table = selection_atom_table(f"{pdb_object} and chain {chain}")
+    return [int(r) for r in table.residue_numbers()]
+
 def is_pure_rna(pdb_object, chain=None):
     """
     指定した pdb_object( + chain) が
@@ -53,36 +77,22 @@ def is_pure_rna(pdb_object, chain=None):
     if chain:
         selection = f"{pdb_object} and chain {chain}"
 
-    # PyMOLの model を取得
-    model = cmd.get_model(selection)
-
-    for atom in model.atom:
-        # アトムの持つ残基名 (resn) をチェック
-        resn_upper = atom.resn.upper()  # 大文字にしておく
-        if resn_upper in ignore_resn:
-            # 水やイオンなどはスキップ
-            continue
-        if resn_upper not in rna_bases:
-            # RNA 塩基以外が見つかった場合は False
-            return False
+    # PyMOLの原子テーブルを取得
+    table = selection_atom_table(selection)
+    # 残基名 (resn) をまとめてチェック（大文字にしておく）
+    resn_upper = set(str(r).upper() for r in set(table.res_name.tolist()))
+    # 水やイオンなどは無視し、RNA 塩基以外が見つかった場合は False
+    if resn_upper - ignore_resn - rna_bases:
+        return False
     
-    # ループを抜けた = 問題ある残基が見つからなかった場合
+    # 問題ある残基が見つからなかった場合
     return True
 
 def check_residues_start_from_one(pdb_object, chain):
     """
     指定したpdb_objectの chain のレジデュー番号が1から始まっているかをチェックする。
     """
-    model = cmd.get_model(f"{pdb_object} and chain {chain}")
-    resi_list = []
-    for atom in model.atom:
-        try:
-            r = int(atom.resi)
-            if r not in resi_list:
-                resi_list.append(r)
-        except ValueError:
-            # 挿入コード付きなどの非整数 resi は無視して判定する
-            continue
+    resi_list = _integer_residue_numbers(pdb_object, chain)
     
     if not resi_list:
         return False
@@ -95,24 +105,13 @@ def auto_renumber_residues(pdb_object, chain):
     レジデュー番号の最小値が1でない場合に、自動で 1 から始まるように再番号付けする。
     例: min_resiが100の場合、 100 -> 1, 101 -> 2, ... のようにalterする。
     """
-    # pdb_object and chain のアトム情報を取得
-    model = cmd.get_model(f"{pdb_object} and chain {chain}")
-
-    # ユニークな整数レジデュー番号のみを収集 (insertion codeなどは一旦無視)
-    resi_list = []
-    for atom in model.atom:
-        try:
-            r = int(atom.resi)
-            if r not in resi_list:
-                resi_list.append(r)
-        except ValueError:
-            # resi が変な文字付き(例: 101A 等)の場合、スキップ or 追加処理要検討
-            pass
+    # pdb_object and chain のユニークな整数レジデュー番号を収集
+    resi_list = _integer_residue_numbers(pdb_object, chain)
 
     if not resi_list:
         # 見つからなかった場合はスキップ
         # print(f"[auto_renumber_residues] {pdb_object}, chain {chain} でレジデュー番号が見つかりませんでした。")
-        print(f"[auto_renumber_residues] {pdb_object}, chain {chain} has not been found.")
+        logger.warning("[auto_renumber_residues] %s, chain %s has not been found.", pdb_object, chain)
         return
 
     min_resi = min(resi_list)
@@ -123,7 +122,7 @@ def auto_renumber_residues(pdb_object, chain):
     # (min_resi - 1) を引くことによって、最小値を1に合わせる
     offset = min_resi - 1
     
-    print(f"[auto_renumber_residues] renumbering chain {chain} by offset={offset} (min_resi was {min_resi})")
+    logger.info("[auto_renumber_residues] renumbering chain %s by offset=%s (min_resi was %s)", chain, offset, min_resi)
     
     # alter で一括変更 (resv を用いて安全に再番号付け)
     cmd.alter(
@@ -134,66 +133,19 @@ def auto_renumber_residues(pdb_object, chain):
     # チェーン間の干渉を避けるため、全体のソートは削除
     # cmd.sort(pdb_object)
 
+def chain_atom_table(pdb_object, chain):
+    """PyMOL のオブジェクトの 1 チェーン分の AtomTable"""
+    with stage("export"):
+        return selection_atom_table(f"{pdb_object} and chain {chain}")
+
+
 def rnaview_wrapper(pdb_object, chain):
-    try:
-        # Check RNAView binary existence and guide user
-        if not pathlib.Path(RNAVIEW_EXEC).exists():
-            raise FileNotFoundError(
-                "RNAView binary not found. Expected at:\n"
-                f"  - {RNAVIEW_EXEC}\n\n"
-                "How to fix:\n"
-                "  1) Place the built 'rnaview' binary under 'RNAView/bin/rnaview' in this repository, or\n"
-                "  2) Edit 'config.py' and set RNAVIEW_EXEC to your installation (e.g., '/opt/RNAView/bin/rnaview').\n"
-                f"Also verify RNAVIEW_DIR points to: {RNAVIEW_DIR}"
-            )
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdb", dir=INTERMEDIATE_DIR) as tmp_pdb:
-            pdb_path = tmp_pdb.name # tmp.pdb is created and deleted automatically after the block.
-            cmd.save(pdb_path, f"{pdb_object} and chain {chain}", format="pdb")
-
-            subprocess.run(
-                [RNAVIEW_EXEC, "-p", "--pdb", pdb_path],
-                env={"RNAVIEW": RNAVIEW_DIR},
-                cwd=INTERMEDIATE_DIR,
-                check=True
-            )
-    except Exception as e:
-        raise Exception("RNAVIEW failed or Exporting PDB failed: " + str(e))
-    result_file = pathlib.Path(INTERMEDIATE_DIR) / (pathlib.Path(pdb_path).name + ".out")
-    raw_df = load_rnaview_data(str(result_file))
-    return raw_df
+    return rnaview_table(chain_atom_table(pdb_object, chain), chain)
 
 
 def dssr_wrapper(pdb_object, chain):
     """DSSR wrapper function to extract base pairs"""
-    try:
-        # Check DSSR binary existence and guide user
-        if not pathlib.Path(DSSR_EXEC).exists():
-            raise FileNotFoundError(
-                "DSSR binary not found. Expected at:\n"
-                f"  - {DSSR_EXEC}\n\n"
-                "How to fix:\n"
-                "  1) Download 'x3dna-dssr' and place it under 'DSSR/x3dna-dssr' in this repository, or\n"
-                "  2) Edit 'config.py' and set DSSR_EXEC to your installation (e.g., '/usr/local/bin/x3dna-dssr').\n"
-                "On macOS, you may need: 'chmod +x x3dna-dssr' and allow it in System Settings > Privacy & Security."
-            )
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdb", dir=INTERMEDIATE_DIR) as tmp_pdb:
-            pdb_path = tmp_pdb.name
-            cmd.save(pdb_path, f"{pdb_object} and chain {chain}", format="pdb")
-
-            # DSSR実行（JSONフォーマットで出力）
-            json_output_path = pathlib.Path(INTERMEDIATE_DIR) / (pathlib.Path(pdb_path).name + ".dssr.json")
-            subprocess.run(
-                [str(DSSR_EXEC), f"-i={pdb_path}", "--json", f"-o={json_output_path}"],
-                cwd=INTERMEDIATE_DIR,
-                check=True,
-                capture_output=True,
-                text=True
-            )
-    except Exception as e:
-        raise Exception("DSSR failed or Exporting PDB failed: " + str(e))
-
-    raw_df = load_dssr_data(str(json_output_path))
-    return raw_df
+    return dssr_table(chain_atom_table(pdb_object, chain), chain)
 
 
 def PseudoKnotVisualizer(
@@ -206,12 +158,13 @@ def PseudoKnotVisualizer(
     selection=True,
     parser=None,  # deprecated: backward-compatible alias for annotator
     include_all=False,
+    dedup="coords",
 ):
     """
     PseudoKnotVisualizer: Visualize pseudoknot layers in RNA structures.
 
     PyMOL command:
-        pkv object [,chain] [,annotator] [,auto_renumber] [,only_pure_rna] [,skip_precoloring] [,selection] [,include_all]
+        pkv object [,chain] [,annotator] [,auto_renumber] [,only_pure_rna] [,skip_precoloring] [,selection] [,include_all] [,dedup]
 
     Parameters
     ----------
@@ -231,6 +184,9 @@ def PseudoKnotVisualizer(
         If True, create selections per layer: "<obj>_c<chain>_l<depth>".
     include_all : bool
         If False (default), use canonical base pairs only (Watson-Crick + wobble). If True, include all pairs.
+    dedup : {"coords", "sequence", "off"}
+        Only used when chain is omitted. Chains with the same numbered sequence (and, for "coords", the same
+        geometry) are annotated once and the layers are applied to every copy. Default: "coords".
 
     Notes
     -----
@@ -248,7 +204,7 @@ def PseudoKnotVisualizer(
 
     # Backward compatibility: allow 'parser' keyword
     if parser is not None:
-        print("[deprecated] 'parser' is deprecated. Use 'annotator' (\"RNAView\" or \"DSSR\").")
+        logger.warning("[deprecated] 'parser' is deprecated. Use 'annotator' (\"RNAView\" or \"DSSR\").")
         annotator = parser
     # PyMOL からの引数が文字列の場合にも正しく解釈できるよう、bool へ正規化
     try:
@@ -260,42 +216,47 @@ def PseudoKnotVisualizer(
     try:
         with open(PseudoKnotVisualizer_DIR / "VERSION.txt", "r") as vf:
             version_str = vf.read().strip()
-        print(f"version {version_str}")
+        logger.info("version %s", version_str)
     except Exception:
         pass
-    print(
-        f"arguments: pdb_object={pdb_object}, chain={chain}, annotator={annotator}, "
-        f"auto_renumber={auto_renumber}, only_pure_rna={only_pure_rna}, skip_precoloring={skip_precoloring}, "
-        f"selection={selection}, include_all={include_all}"
+    logger.debug(
+        "arguments: pdb_object=%s, chain=%s, annotator=%s, auto_renumber=%s, only_pure_rna=%s, "
+        "skip_precoloring=%s, selection=%s, include_all=%s, dedup=%s",
+        pdb_object, chain, annotator, auto_renumber, only_pure_rna, skip_precoloring, selection, include_all, dedup,
     )
     
     if chain is None:
         chains = cmd.get_chains(pdb_object)
-        print("Chain ID is not specified and there are multiple chains. All chains ID will be analyzed: " + ", ".join(chains))
-        for chain in chains:
+        logger.info("Chain ID is not specified and there are multiple chains. All chains ID will be analyzed: %s", ", ".join(chains))
+        # 同じチェーンのコピーはアノテーターと DP を 1 回だけ実行し、layer を各コピーに適用する
+        representatives, duplicates = chains, {}
+        if str(dedup).lower() != "off":
+            fingerprints = table_fingerprints(selection_atom_table(pdb_object), modes=(str(dedup).lower(),))
+            representatives, duplicates = group_by_fingerprint(
+                chains, lambda chain: fingerprints[str(dedup).lower()].get(chain))
+            logger.info("dedup (%s): %d chains -> %d unique", dedup, len(chains), len(representatives))
+        for chain in representatives:
             # Recurse per chain
-            PseudoKnotVisualizer(pdb_object=pdb_object,
-                                    chain=chain,
-                                    auto_renumber=auto_renumber,
-                                    only_pure_rna=only_pure_rna,
-                                    skip_precoloring=skip_precoloring,
-                                    selection=selection,
-                                    annotator=annotator,
-                                    include_all=include_all)
+            PKlayers = PseudoKnotVisualizer(pdb_object=pdb_object,
+                                            chain=chain,
+                                            auto_renumber=auto_renumber,
+                                            only_pure_rna=only_pure_rna,
+                                            skip_precoloring=skip_precoloring,
+                                            selection=selection,
+                                            annotator=annotator,
+                                            include_all=include_all)
+            if PKlayers is None:
+                continue
+            for copy in duplicates.get(chain, []):
+                logger.info("Chain %s is identical to chain %s; reusing its layers.", copy, chain)
+                prepare_residue_numbering(pdb_object, copy, annotator, auto_renumber)
+                color_pk_layers(pdb_object, copy, PKlayers, skip_precoloring, selection)
         return
     elif chain not in cmd.get_chains(pdb_object):
-        print(f"Chain {chain} is not found in the pdb object.")
-        print(f"Available chains are: {', '.join(cmd.get_chains(pdb_object))}")
+        logger.error("Chain %s is not found in the pdb object.", chain)
+        logger.error("Available chains are: %s", ", ".join(cmd.get_chains(pdb_object)))
         return
-    # ★ RNAViewを使用する場合のみ、レジデュー番号をチェックして必要に応じて補正
-    if auto_renumber and annotator.upper() == "RNAVIEW":
-        if not check_residues_start_from_one(pdb_object, chain):
-            # print(f"[PseudoKnotVisualizer] Chain {chain}: レジデュー番号が1から始まっていないため、RNAView用に補正します。")
-            print(f"[PseudoKnotVisualizer] Chain {chain}: Residue numbers do not start from 1, renumbering for RNAView.")
-            print("It may be better to use DSSR instead of RNAView.")
-            auto_renumber_residues(pdb_object, chain)
-        else:
-            print(f"[PseudoKnotVisualizer] Chain {chain}: residue numbers start from 1.")
+    prepare_residue_numbering(pdb_object, chain, annotator, auto_renumber)
     # Note about only_pure_rna:
     # The flag and function `is_pure_rna` are kept for compatibility but intentionally not enforced.
     # This is to avoid unexpected early returns in diverse real-world structures.
@@ -305,7 +266,7 @@ def PseudoKnotVisualizer(
         #     print("The structure contains non-standard RNA bases or other molecules.")
         #     print("If you want to analyze them, please set pure_rna=False.")
         #     return
-        print("[info] only_pure_rna flag is currently ignored (kept for compatibility).")
+        logger.info("[info] only_pure_rna flag is currently ignored (kept for compatibility).")
     
     # パーサーの選択に応じてベースペアを抽出
     if annotator.upper() == "DSSR":
@@ -315,59 +276,41 @@ def PseudoKnotVisualizer(
     else:
         raise ValueError(f"Unsupported annotator: {annotator}. Use 'DSSR' or 'RNAView'.")
     
-    processed_df = raw_df_processing(raw_df, annotator)
-    processed_df, abnormal_pairs, dup_canonical_pairs = filter_abnormal_pairs(processed_df)
-    
-    # include_all フラグに基づいてフィルタリング
-    if include_all:
-        # すべての塩基対を使用（フィルタリング済み）
-        filtered_df = processed_df
-        canonical_count = len(processed_df[processed_df["is_canonical"]])
-        noncanonical_count = len(processed_df) - canonical_count
-        print(f"Using all base pairs: {len(filtered_df)} total ({canonical_count} canonical, {noncanonical_count} non-canonical)")
-        # 重複する canonical pairs がある場合は警告
-        if dup_canonical_pairs:
-            print(f"Warning: {len(dup_canonical_pairs)} duplicate canonical pairs found and recorded.")
-    else:
-        # canonical base pairsのみを使用
-        filtered_df = processed_df[processed_df["is_canonical"]]
-        print(f"Using canonical base pairs only: {len(filtered_df)}/{len(processed_df)} pairs")
-    
-    # print(processed_df)
-    # Orientation normalization: ensure i < j for PKextractor compatibility
-    BPL = []
-    for _, row in filtered_df.iterrows():
-        i, j = row["position"]
-        BPL.append((i, j) if i < j else (j, i))
-    # print(f"extracted base pairs: {BPL}")
-    PKlayers = PKextractor(BPL)
+    PKlayers, layer_notes = decompose_annotation(raw_df, annotator, include_all)
+
+    color_pk_layers(pdb_object, chain, PKlayers, skip_precoloring, selection, layer_notes)
+    return PKlayers
+
 
+def prepare_residue_numbering(pdb_object, chain, annotator, auto_renumber=True):
+    # ★ RNAViewを使用する場合のみ、レジデュー番号をチェックして必要に応じて補正
+    if auto_renumber and annotator.upper() == "RNAVIEW":
+        if not check_residues_start_from_one(pdb_object, chain):
+            # print(f"[PseudoKnotVisualizer] Chain {chain}: レジデュー番号が1から始まっていないため、RNAView用に補正します。")
+            logger.info("[PseudoKnotVisualizer] Chain %s: Residue numbers do not start from 1, renumbering for RNAView.", chain)
+            logger.info("It may be better to use DSSR instead of RNAView.")
+            auto_renumber_residues(pdb_object, chain)
+        else:
+            logger.debug("[PseudoKnotVisualizer] Chain %s: residue numbers start from 1.", chain)
+
+
+@timed("coloring")
+def color_pk_layers(pdb_object, chain, PKlayers, skip_precoloring=False, selection=True, layer_notes=None):
+    """
+    PKlayers を pdb_object の chain に色付けし、selection=True なら layer ごとの selection を作る。
+    layer_notes があれば各 layer の色付けの前に表示する。
+    """
     if not skip_precoloring:
-        print(f"Precoloring all atoms to white since skip_precoloring is {skip_precoloring}")
+        logger.debug("Precoloring all atoms to white since skip_precoloring is %s", skip_precoloring)
         cmd.color("white", f"{pdb_object} and chain {chain}")
     
-    # Details dict for base pair analysis (similar to analysis script)
-    records = filtered_df.to_dict(orient="records") if not filtered_df.empty else []
-    details_dict = {tuple(rec["position"]): {
-            "position": rec["position"],
-            "residues": rec["residues"],
-            "is_canonical": rec["is_canonical"],
-            "saenger_id": rec["saenger_id"],
-        } for rec in records
-    }
-    
     for depth, PKlayer in enumerate(PKlayers):
         color = get_color_for_depth(depth + 1, colors)
         
-        # Layer statistics (when using non-canonical pairs)
-        if include_all:
-            canon_count = sum(1 for bp in PKlayer if details_dict[bp]["is_canonical"])
-            noncanon_count = sum(1 for bp in PKlayer if not details_dict[bp]["is_canonical"])
-            print(f"Layer {depth + 1}: {len(PKlayer)} pairs ({canon_count} canonical, {noncanon_count} non-canonical)")
-        else:
-            print(f"Layer {depth + 1}: {len(PKlayer)} canonical pairs")
+        if layer_notes:
+            logger.info(layer_notes[depth])
         
-        print(f"Coloring layer {depth + 1} with color: {color}")
+        logger.info("Coloring layer %d with color: %s", depth + 1, color)
         
         # PKlayerから全ての残基番号を取得して、PyMOL用の選択文字列を作成
         all_residues = []
@@ -385,21 +328,300 @@ def PseudoKnotVisualizer(
             paper_name = f"{str(pathlib.Path(pdb_object).stem)}_{chain}_{paper_name}"
 
             cmd.select(paper_name, f"{pdb_object} and chain {chain} and resi {selection_str}")
-            print(f"Created selection: {paper_name} with residues {selection_str}")
+            logger.debug("Created selection: %s with residues %s", paper_name, selection_str)
 
             # legacy name kept for backward-compatibility
             # legacy_name = f"{pdb_object}_c{chain}_l{depth + 1}"
             # cmd.select(legacy_name, f"{pdb_object} and chain {chain} and resi {selection_str}")
             # print(f"Created selection: {legacy_name} with residues {selection_str}")
-        print(f"Layer {depth + 1}: (i, j) = {PKlayer}")
-    print("Coloring done.")
-    print(f"pseudoknot order (number of layers): {len(PKlayers)}")
-    
-    clear_intermediate_files()
+        logger.debug("Layer %d: (i, j) = %s", depth + 1, PKlayer)
+    logger.info("Coloring done.")
+    logger.info("pseudoknot order (number of layers): %d", len(PKlayers))
     return
 
 
+def pkv_log_level(level="INFO"):
+    """
+    PseudoknotVisualizer のメッセージの表示レベルを変える（PyMOL: pkv_log_level DEBUG）。
+    DEBUG で塩基対の一覧や selection の内容、WARNING で警告だけを表示する。
+    """
+    configure_logging(str(level), force=True)
+
+
+def pkv_stats(reset=0, path=None):
+    """
+    PyMOL を起動してからの段階ごとの所要時間とカウンターを表示する（PyMOL: pkv_stats [reset [, path]]）。
+    path を指定するとその内容を書き出す（.prom なら Prometheus のテキスト形式、それ以外は JSON）。
+    reset=1 で表示・書き出しの後に集計を消す。
+    """
+    snapshot = PROCESS_STATS.snapshot()
+    for line in format_summary(snapshot):
+        print(line)
+    if path:
+        print(f"Stats written to {write_stats(snapshot, path)}")
+    if str(reset).strip().lower() in ("1", "true", "yes", "on"):
+        PROCESS_STATS.reset()
+    return snapshot
+
+
+# ---------------- pkv_async: チェーンをバックグラウンドのスレッドで解析する ----------------
+# 書き出し・アノテーター・layer 分解をワーカースレッドで行い、色付けと selection だけをメインスレッドで行う
+# （PyMOL の API と GUI はメインスレッドから触る）。
+# 結果はキューに入り、Qt の GUI がある場合はメインスレッドのタイマー (ASYNC_POLL_MS ごと) で取り込む。
+# GUI の無い PyMOL (pymol -c) では pkv_wait で取り込む。
+ASYNC_POLL_MS = 200
+ASYNC_WORKERS = max(1, min(4, os.cpu_count() or 1))
+_JOBS = []
+_POLLING = False
+# layer 分解のプロセスプールはセッションで 1 つを共有し、最初のジョブで作って、使うジョブが無くなったら止める
+_DP_POOL = None
+_DP_USERS = 0
+_DP_LOCK = threading.Lock()
+
+
+def _acquire_dp_pool(workers):
+    """共有のプロセスプールを（無ければ作って）返し、使うジョブの数を 1 増やす"""
+    global _DP_POOL, _DP_USERS
+    with _DP_LOCK:
+        if _DP_POOL is None:
+            # spawn: PyMOL のスレッドを抱えたプロセスを fork しない
+            _DP_POOL = multiprocessing.get_context("spawn").Pool(processes=max(ASYNC_WORKERS, workers))
+        _DP_USERS += 1
+        return _DP_POOL
+
+
+def _release_dp_pool(terminate=False):
+    """
+    使うジョブの数を 1 減らし、0 になったらプールを close（terminate=True なら terminate）して join する。
+    他のジョブが使っている間は terminate しない（取り消したジョブの実行中の DP は終わるまで走り、結果は捨てられる）。
+    """
+    global _DP_POOL, _DP_USERS
+    with _DP_LOCK:
+        _DP_USERS -= 1
+        if _DP_USERS > 0:
+            return
+        pool, _DP_POOL = _DP_POOL, None
+    if terminate:
+        pool.terminate()
+    else:
+        pool.close()
+    pool.join()
+
+
+class PkvJob:
+    """
+    pkv_async の 1 回分のチェーンの解析。
+    アノテーターの実行はスレッド、layer 分解（GIL を握り続ける DP）はセッションで共有するプロセスプールで行う。
+    全チェーンのスレッドが終わった時点で（poll されなくても）プールを手放す。
+    cancel() はアノテーターを kill し、他に使っているジョブが無ければプールを terminate して実行中の DP も止める。
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, pdb_object, tables, duplicates, annotator, include_all, workers,
+                 skip_precoloring=False, selection=True):
+        self.id = next(self._ids)
+        self.pdb_object = pdb_object
+        self.duplicates = duplicates
+        self.annotator = annotator
+        self.include_all = include_all
+        self.skip_precoloring = skip_precoloring
+        self.selection = selection
+        self.total = len(tables)
+        self.done = self.failed = 0
+        self._dropped = 0  # 実行中に取り消された・取り消した後に届いた結果の数
+        self.start = time.perf_counter()
+        self.cancel_event = threading.Event()
+        self.results = queue.Queue()
+        self._remaining = self.total  # まだ終わっていない（取り消されてもいない）スレッドの数
+        self._remaining_lock = threading.Lock()
+        self.dp_pool = _acquire_dp_pool(workers)
+        if not self.total:
+            _release_dp_pool()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"pkv-job{self.id}")
+        self.futures = [self.executor.submit(self._analyze, chain, table) for chain, table in tables.items()]
+        for future in self.futures:
+            # 取り消された future のコールバックも呼ばれる
+            future.add_done_callback(self._thread_done)
+        self.executor.shutdown(wait=False)
+
+    def _thread_done(self, _):
+        """最後のチェーンのスレッドが終わった（取り消された）らプールを手放す"""
+        with self._remaining_lock:
+            self._remaining -= 1
+            last = self._remaining == 0
+        if last:
+            _release_dp_pool(terminate=self.cancel_event.is_set())
+
+    def _analyze(self, chain, table):
+        """ワーカースレッド: 1 チェーンの書き出し・アノテーター・layer 分解（PyMOL には触らない）"""
+        try:
+            if self.cancel_event.is_set():
+                raise AnnotationCancelled("cancelled before start")
+            raw_df = annotate_table(table, chain, self.annotator, cancel=self.cancel_event)
+            if self.cancel_event.is_set():
+                raise AnnotationCancelled("cancelled after annotation")
+            pending = self.dp_pool.apply_async(decompose_annotation_task, (raw_df, self.annotator, self.include_all))
+            while True:
+                # terminate されたプールの結果は届かないので、取り消しを見ながら待つ
+                if self.cancel_event.is_set():
+                    raise AnnotationCancelled("cancelled during decomposition")
+                try:
+                    PKlayers, layer_notes, stats = pending.get(CANCEL_POLL_SEC)
+                    break
+                except multiprocessing.TimeoutError:
+                    continue
+            # 子プロセスで記録された DP の段階とキャッシュのカウンターを pkv_stats に入れる
+            PROCESS_STATS.merge(stats)
+            self.results.put((chain, PKlayers, layer_notes, None))
+        except Exception as e:
+            self.results.put((chain, None, None, e))
+
+    @property
+    def cancelled(self):
+        """取り消したチェーンの数（始まる前に取り消した future は、その状態から 1 回だけ数える）"""
+        return self._dropped + sum(future.cancelled() for future in self.futures)
+
+    @property
+    def finished(self):
+        return self.done + self.failed + self.cancelled >= self.total
+
+    def poll(self):
+        """メインスレッド: 届いた結果を色付けし、すべて終わっていれば True を返す"""
+        while True:
+            try:
+                chain, PKlayers, layer_notes, error = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(error, AnnotationCancelled) or self.cancel_event.is_set():
+                # 取り消した後に届いた結果は色付けしない
+                self._dropped += 1
+                continue
+            if error is not None:
+                self.failed += 1
+                logger.error("[pkv_async] %s chain %s failed: %s", self.pdb_object, chain, error)
+            else:
+                self.done += 1
+                color_pk_layers(self.pdb_object, chain, PKlayers, self.skip_precoloring, self.selection, layer_notes)
+                for copy in self.duplicates.get(chain, []):
+                    logger.info("Chain %s is identical to chain %s; reusing its layers.", copy, chain)
+                    color_pk_layers(self.pdb_object, copy, PKlayers, self.skip_precoloring, self.selection)
+            logger.info("[pkv_async] job %d %s: %d/%d chains done (chain %s), %.1f s",
+                        self.id, self.pdb_object, self.done + self.failed + self.cancelled, self.total, chain,
+                        time.perf_counter() - self.start)
+        if self.finished:
+            logger.info("[pkv_async] job %d %s finished: %d ok, %d failed, %d cancelled in %.1f s",
+                        self.id, self.pdb_object, self.done, self.failed, self.cancelled,
+                        time.perf_counter() - self.start)
+        return self.finished
+
+    def cancel(self):
+        """まだ始まっていないチェーンを取り消し、実行中のアノテーターと layer 分解を止める"""
+        self.cancel_event.set()
+        for future in self.futures:
+            future.cancel()
+
+
+def _schedule_poll():
+    """Qt の GUI のメインスレッドなら ASYNC_POLL_MS 後に _poll_jobs を予約して True を返す"""
+    global _POLLING
+    if _POLLING:
+        return True
+    try:
+        from pymol.Qt import QtCore, QtWidgets
+    except Exception:
+        return False
+    if QtWidgets.QApplication.instance() is None or threading.current_thread() is not threading.main_thread():
+        return False
+    _POLLING = True
+    QtCore.QTimer.singleShot(ASYNC_POLL_MS, _poll_jobs)
+    return True
+
+
+def _poll_jobs():
+    global _POLLING
+    _POLLING = False
+    for job in list(_JOBS):
+        if job.poll():
+            _JOBS.remove(job)
+    if _JOBS:
+        _schedule_poll()
+
+
+def pkv_async(pdb_object, chain=None, annotator="RNAView", auto_renumber=True, skip_precoloring=False,
+              selection=True, include_all=False, dedup="coords", workers=ASYNC_WORKERS):
+    """
+    pkv と同じ解析をバックグラウンドのスレッドで行い、PyMOL の GUI を止めない。
+
+    PyMOL command:
+        pkv_async object [,chain] [,annotator] [,auto_renumber] [,skip_precoloring] [,selection] [,include_all] [,dedup] [,workers]
+
+    workers 本のスレッドで最大 workers 本のチェーンを同時に解析し（layer 分解はセッションで共有するプロセスプール）、
+    終わったチェーンから順に色付けする。
+    進捗は 1 チェーンごとに表示する。pkv_cancel で取り消し、pkv_wait で終わるまで待つ
+    （GUI の無い PyMOL では pkv_wait を呼んだ時に色付けする）。
+    残基番号の付け直しと原子の取り出しは開始時にメインスレッドで行う。
+
+    Returns:
+        PkvJob
+    """
+    include_all, auto_renumber, skip_precoloring, selection = (
+        str(value).strip().lower() in ("1", "true", "t", "yes", "y", "on")
+        for value in (include_all, auto_renumber, skip_precoloring, selection)
+    )
+    chains = cmd.get_chains(pdb_object)
+    if chain is not None and chain not in chains:
+        logger.error("Chain %s is not found in the pdb object.", chain)
+        logger.error("Available chains are: %s", ", ".join(chains))
+        return None
+    representatives, duplicates = ([chain] if chain is not None else chains), {}
+    if chain is None and str(dedup).lower() != "off":
+        fingerprints = table_fingerprints(selection_atom_table(pdb_object), modes=(str(dedup).lower(),))
+        representatives, duplicates = group_by_fingerprint(
+            chains, lambda chain: fingerprints[str(dedup).lower()].get(chain))
+        logger.info("dedup (%s): %d chains -> %d unique", dedup, len(chains), len(representatives))
+    tables = {}
+    for chain in representatives:
+        for target in [chain] + duplicates.get(chain, []):
+            prepare_residue_numbering(pdb_object, target, annotator, auto_renumber)
+        tables[chain] = chain_atom_table(pdb_object, chain)
+
+    job = PkvJob(pdb_object, tables, duplicates, annotator, include_all, max(1, int(workers)),
+                 skip_precoloring, selection)
+    _JOBS.append(job)
+    logger.info("[pkv_async] job %d %s: %d chains on %s threads (%s)", job.id, pdb_object, job.total,
+                workers, annotator)
+    if not _schedule_poll():
+        logger.info("[pkv_async] no GUI event loop; run pkv_wait to apply the results.")
+    return job
+
+
+def pkv_cancel(pdb_object=None):
+    """実行中の pkv_async を取り消す（PyMOL: pkv_cancel [object]。object を省略するとすべて）"""
+    for job in list(_JOBS):
+        if pdb_object is None or job.pdb_object == pdb_object:
+            job.cancel()
+            logger.info("[pkv_async] job %d %s: cancelling", job.id, job.pdb_object)
+
+
+def pkv_wait(timeout=None):
+    """pkv_async がすべて終わるまで結果を色付けしながら待つ（PyMOL: pkv_wait [timeout]）"""
+    deadline = None if timeout is None else time.perf_counter() + float(timeout)
+    while _JOBS and (deadline is None or time.perf_counter() < deadline):
+        for job in list(_JOBS):
+            if job.poll():
+                _JOBS.remove(job)
+        if _JOBS:
+            time.sleep(ASYNC_POLL_MS / 1000)
+    return not _JOBS
+
+
 cmd.extend("PseudoKnotVisualizer", PseudoKnotVisualizer)
+cmd.extend("pkv_async", pkv_async)
+cmd.extend("pkv_cancel", pkv_cancel)
+cmd.extend("pkv_wait", pkv_wait)
+cmd.extend("pkv_stats", pkv_stats)
+cmd.extend("pkv_log_level", pkv_log_level)
 cmd.extend("pkv", PseudoKnotVisualizer)
 
 if __name__ == "__main__":
@@ -2,6 +2,9 @@ import json
 import pandas as pd
 import re
 
+from instrumentation import timed
+
+@timed("parse")
 def load_dssr_data(input_file: str):
     """
     DSSR JSON出力からベースペア情報をDataFrameとして読み込む
@@ -1,6 +1,9 @@
 import re
 import pandas as pd
 
+from instrumentation import timed
+
+@timed("parse")
 def load_rnaview_data(input_file: str):
     """
     RNAView出力からベースペア情報をDataFrameとして読み込む
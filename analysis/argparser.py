@@ -25,6 +25,12 @@ Examples:
   
     # RNAViewを使用して解析
     python analysis/pseudoknotlayer_analysis.py --annotator RNAView
+
+    # アノテーターを 1 回だけ実行して canonical-only と all の両方を出力
+    python analysis/pseudoknotlayer_analysis.py --annotator DSSR --both-variants
+
+    # 追加・更新されたファイルだけを処理して結果を更新
+    python analysis/pseudoknotlayer_analysis.py --annotator DSSR --refresh
         """
     )
     
@@ -46,6 +52,13 @@ Examples:
         default=False,
         help="Only analyze canonical base pairs (default: False)"
     )
+    parser.add_argument(
+        "--both-variants",
+        action="store_true",
+        default=False,
+        help="Run the annotator once per structure and write both the canonical-only and the all-pairs results "
+             "(overrides --canonical-only)"
+    )
     parser.add_argument(
         "--ncpus",
         "-n",
@@ -53,7 +66,74 @@ Examples:
         default=1,
         help="Number of CPU cores to use for parallel processing (default: 1)"
     )
-    
+    parser.add_argument(
+        "--output-format",
+        choices=["jsonl", "npz", "parquet"],
+        default="jsonl",
+        help="Result format: one compact record per line (jsonl), or columnar chain/pair tables (npz, parquet) (default: jsonl)"
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        type=str,
+        default=None,
+        help="Result file; the format follows its extension "
+             "(default: analysis/pseudoknot_analysis_<annotator>[_canonical_only].<output-format>)"
+    )
+    parser.add_argument(
+        "--index",
+        type=str,
+        default=None,
+        help="Dataset index (JSON) with per-file hash, chain, atom/residue counts and last runtime "
+             "(default: <dataset dir>.index.json next to the dataset directory)"
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=int,
+        default=None,
+        help="Estimated memory (MB) that running jobs may use together; limits how many large structures run at once "
+             "(default: no limit)"
+    )
+    parser.add_argument(
+        "--checkpoint",
+        type=str,
+        default=None,
+        help="Checkpoint log (JSONL) to append per-structure results to "
+             "(default: analysis/pseudoknot_analysis_<annotator>[_canonical_only].checkpoint.jsonl)"
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        default=False,
+        help="Only process files that are new or whose size/mtime changed since the checkpoint (no re-hashing of unchanged files)"
+    )
+    parser.add_argument(
+        "--fresh",
+        action="store_true",
+        default=False,
+        help="Discard the existing checkpoint and process every file again"
+    )
+    parser.add_argument(
+        "--status-file",
+        type=str,
+        default=None,
+        help="Rewrite the progress (done/running counts, throughput, annotator latency, ETA) as JSON in this file "
+             "every --progress-interval seconds, for headless runs"
+    )
+    parser.add_argument(
+        "--progress-interval",
+        type=float,
+        default=2.0,
+        help="Seconds between progress updates (default: 2)"
+    )
+    parser.add_argument(
+        "--log-level",
+        type=str.upper,
+        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+        default="WARNING",
+        help="Logging level of the per-structure messages (default: WARNING). DEBUG shows DataFrames and base-pair lists"
+    )
+
     return parser
 
 
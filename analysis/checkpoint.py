@@ -0,0 +1,142 @@
+"""
+Checkpoint log for dataset analysis
+
+構造ごとの解析結果を完了した順に JSONL の checkpoint に追記する。
+再開時は (入力ファイルのハッシュ, アノテーター, オプション) が一致するエントリを読み飛ばし、
+refresh モードではファイルサイズと mtime が記録と同じファイルをハッシュ計算なしで再利用する。
+
+Author: PseudoknotVisualizer Analysis
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    """入力ファイルの SHA-256（.gz は圧縮されたバイト列のまま計算する）"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def task_key(input_hash, annotator, options):
+    """入力ハッシュ・アノテーター・オプションから checkpoint のキーを作る"""
+    opts = json.dumps(options, sort_keys=True, separators=(",", ":"))
+    return f"{input_hash}:{annotator.upper()}:{opts}"
+
+
+def file_stat(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+class CheckpointLog:
+    """
+    追記専用の JSONL checkpoint。
+
+    1 行 1 レコード:
+        {"key", "input", "input_hash", "size", "mtime_ns", "annotator", "options", "result"}
+    途中でクラッシュして最終行が壊れていても、その行だけ無視して読み込む。
+    メモリにはレコードのメタデータと行のオフセットだけを持ち、result は read_result で必要な時に読む。
+    """
+
+    def __init__(self, path, fresh=False):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if fresh and self.path.exists():
+            self.path.unlink()
+        self.records = {}      # key -> record
+        self.by_input = {}     # input path -> record（最新のもの）
+        self._load()
+        self._fh = open(self.path, "ab")
+        if self._fh.tell() > 0:
+            with open(self.path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    # 壊れた最終行の後ろに次のレコードが続かないようにする
+                    self._fh.write(b"\n")
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        with open(self.path, "rb") as f:
+            offset = 0
+            for line in f:
+                line_offset, offset = offset, offset + len(line)
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 書き込み途中で落ちた行
+                    continue
+                self._index(record, line_offset)
+
+    def _index(self, record, offset):
+        meta = {key: value for key, value in record.items() if key != "result"}
+        meta["offset"] = offset
+        self.records[meta["key"]] = meta
+        self.by_input[meta["input"]] = meta
+        return meta
+
+    def __len__(self):
+        return len(self.records)
+
+    def lookup(self, pdb_file, annotator, options, trust_stat=False, input_hash=None):
+        """
+        再利用できる checkpoint レコードを探す。
+
+        Args:
+            trust_stat (bool): True の場合、サイズと mtime が記録と一致すればハッシュを計算せずに再利用する
+            input_hash (str | None): 計算済みのハッシュ（dataset index など）があれば再計算しない
+
+        Returns:
+            tuple: (record or None, input_hash or None)
+        """
+        if trust_stat:
+            prev = self.by_input.get(str(pdb_file))
+            if prev is not None and [prev.get("size"), prev.get("mtime_ns")] == list(file_stat(pdb_file)):
+                key = task_key(prev["input_hash"], annotator, options)
+                if key in self.records:
+                    return self.records[key], prev["input_hash"]
+        if input_hash is None:
+            input_hash = file_sha256(pdb_file)
+        return self.records.get(task_key(input_hash, annotator, options)), input_hash
+
+    def append(self, pdb_file, input_hash, annotator, options, result):
+        """結果を 1 行追記して即座にディスクへ書き出す"""
+        size, mtime_ns = file_stat(pdb_file)
+        record = {
+            "key": task_key(input_hash, annotator, options),
+            "input": str(pdb_file),
+            "input_hash": input_hash,
+            "size": size,
+            "mtime_ns": mtime_ns,
+            "annotator": annotator,
+            "options": options,
+            "result": result,
+        }
+        offset = self._fh.seek(0, os.SEEK_END)
+        self._fh.write((json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n").encode())
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+        return self._index(record, offset)
+
+    def read_result(self, record):
+        """lookup / append が返したレコードの result を checkpoint から読み出す"""
+        with open(self.path, "rb") as f:
+            f.seek(record["offset"])
+            return json.loads(f.readline())["result"]
+
+    def close(self):
+        self._fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,228 @@
+"""
+Dataset index and cost-aware scheduling
+
+データセットの各ファイルについて、ハッシュ・REMARK 350 のチェーン・原子数・残基数・
+前回の実行時間を JSON に保存しておき、再実行のたびにファイルを開き直さずに済ませる。
+
+スケジューリング:
+    - 推定コストの大きい順（longest-first）に投入し、巨大な構造が最後に残ってコアが遊ぶのを防ぐ
+    - 推定メモリの合計が memory budget を超えないよう、大きなジョブの同時実行数を制限する
+
+Author: PseudoknotVisualizer Analysis
+"""
+
+import json
+import os
+import queue
+import statistics
+import sys
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+script_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(script_dir))
+
+from analysis.checkpoint import file_sha256, file_stat
+from atom_table import read_atom_table
+from dedup import table_fingerprints
+from log_config import get_logger
+
+logger = get_logger("analysis.dataset_index")
+
+# 実行時間が未計測のファイルに使う「原子 1 個あたりの秒数」（計測済みのファイルがあればその中央値で置き換える）
+DEFAULT_SEC_PER_ATOM = 1e-4
+# 1 ジョブの推定メモリ (MB) = MEMORY_BASE_MB + 原子数 * MEMORY_PER_ATOM_MB
+MEMORY_BASE_MB = 150
+MEMORY_PER_ATOM_MB = 0.02
+
+
+def default_index_path(dataset_dir):
+    """データセットディレクトリの隣に置く index のパス (例: .../BGSU_..._3_396.index.json)"""
+    dataset_dir = Path(dataset_dir)
+    return dataset_dir.parent / f"{dataset_dir.name}.index.json"
+
+
+def describe_structure(pdb_file):
+    """
+    1 ファイル分の index エントリを作る（ハッシュ・REMARK 350 のチェーン・原子数・残基数・
+    最初のモデルの各チェーンの fingerprint）。
+    """
+    from analysis.io_utils import extract_actual_chain_from_pdb
+
+    size, mtime_ns = file_stat(pdb_file)
+    table = read_atom_table(pdb_file)
+    chain_id = extract_actual_chain_from_pdb(pdb_file)
+    first = table.select(model=table.first_model()) if len(table) else table
+    chain_table = first.select(chain=chain_id) if chain_id in first.chain_ids() else first
+    # atom_count / residue_count は REMARK 350 のチェーン、model_atom_count は最初のモデル全体
+    return {
+        "path": str(pdb_file),
+        "size": size,
+        "mtime_ns": mtime_ns,
+        "sha256": file_sha256(pdb_file),
+        "chain_id": chain_id,
+        "atom_count": int(len(chain_table)),
+        "residue_count": int(chain_table.residue_count()) if len(chain_table) else 0,
+        "model_atom_count": int(len(first)),
+        "fingerprints": table_fingerprints(first),
+        "runtime_sec": {},
+    }
+
+
+def _try_describe(pdb_file):
+    """describe_structure の結果を (entry, None)、失敗した場合は (None, エラーの説明) で返す（ワーカープロセス用）"""
+    try:
+        return describe_structure(pdb_file), None
+    except Exception as e:
+        return None, str(e)
+
+
+class DatasetIndex:
+    """
+    データセット index（JSON、path -> エントリ）。
+
+    エントリ:
+        {"path", "size", "mtime_ns", "sha256", "chain_id", "atom_count", "residue_count", "model_atom_count",
+         "fingerprints": {"coords": {chain: fp}, "sequence": {chain: fp}},
+         "runtime_sec": {"DSSR": 1.23, "RNAVIEW": 0.45}}
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.entries = {}
+        if self.path.exists():
+            with open(self.path) as f:
+                self.entries = json.load(f).get("entries", {})
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, pdb_file):
+        return self.entries[str(pdb_file)]
+
+    def update(self, pdb_files, processes=None):
+        """
+        新規ファイルとサイズ・mtime が変わったファイルだけを読み直す（前回の実行時間は内容が同じなら引き継ぐ）。
+        読めないファイルは index に載せず、推定コスト 0 として扱う（エラーは解析時に報告される）。
+        processes > 1 の場合、読み直し（パースと sha256）をその数のプロセスで並列に行う。
+
+        Returns:
+            int: 読み直したファイル数
+        """
+        stale = []
+        for pdb_file in pdb_files:
+            prev = self.entries.get(str(pdb_file))
+            if (prev is not None and "fingerprints" in prev
+                    and [prev["size"], prev["mtime_ns"]] == list(file_stat(pdb_file))):
+                continue
+            stale.append(pdb_file)
+        if processes and processes > 1 and len(stale) > 1:
+            with ProcessPoolExecutor(max_workers=min(processes, len(stale))) as executor:
+                described = list(executor.map(_try_describe, stale, chunksize=max(1, len(stale) // (4 * processes))))
+        else:
+            described = [_try_describe(pdb_file) for pdb_file in stale]
+
+        n_updated = 0
+        for pdb_file, (entry, error) in zip(stale, described):
+            prev = self.entries.get(str(pdb_file))
+            if entry is None:
+                logger.warning("could not index %s: %s", pdb_file, error)
+                self.entries.pop(str(pdb_file), None)
+                continue
+            if prev is not None and prev["sha256"] == entry["sha256"]:
+                entry["runtime_sec"] = prev.get("runtime_sec", {})
+            self.entries[str(pdb_file)] = entry
+            n_updated += 1
+        return n_updated
+
+    def record_runtime(self, pdb_file, annotator, seconds):
+        entry = self.entries.get(str(pdb_file))
+        if entry is not None:
+            entry.setdefault("runtime_sec", {})[annotator.upper()] = round(seconds, 4)
+
+    def estimated_costs(self, pdb_files, annotator, atoms="atom_count"):
+        """
+        ファイルごとの推定実行時間（秒）。前回の実行時間があればそれを、無ければ原子数から推定する。
+        atoms="model_atom_count" にするとモデル全体の原子数を使う（全チェーンを処理する manifest バッチ用）。
+        """
+        key = annotator.upper()
+        ratios = [
+            e["runtime_sec"][key] / e[atoms]
+            for e in self.entries.values() if key in e.get("runtime_sec", {}) and e.get(atoms)
+        ]
+        sec_per_atom = statistics.median(ratios) if ratios else DEFAULT_SEC_PER_ATOM
+        costs = []
+        for pdb_file in pdb_files:
+            entry = self.entries.get(str(pdb_file), {})
+            runtime = entry.get("runtime_sec", {}).get(key)
+            costs.append(runtime if runtime is not None else entry.get(atoms, 0) * sec_per_atom)
+        return costs
+
+    def estimated_memory_mb(self, pdb_files, atoms="atom_count"):
+        return [MEMORY_BASE_MB + self.entries.get(str(p), {}).get(atoms, 0) * MEMORY_PER_ATOM_MB for p in pdb_files]
+
+    def save(self):
+        """一時ファイルに書いてから置き換える（途中で落ちても index が壊れない）"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # 一時ファイル名はプロセスごとに変える（共有ファイルシステム上で複数のノードが同時に保存しても衝突しない）
+        tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp")
+        with open(tmp, "w") as f:
+            json.dump({"version": 1, "entries": self.entries}, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, self.path)
+
+
+def longest_first(tasks, costs):
+    """推定コストの大きい順に並べた (tasks, costs の並び順) を返す"""
+    order = sorted(range(len(tasks)), key=lambda i: costs[i], reverse=True)
+    return [tasks[i] for i in order], order
+
+
+def budgeted_imap(executor, func, tasks, slots, memory_mb=None, budget_mb=None, on_error=None):
+    """
+    tasks を先頭から（=重い順に並べておく）executor (concurrent.futures) に投入し、終わった順に func の戻り値を返す。
+
+    同時に投入するのは slots 件まで。budget_mb を指定した場合は、実行中のジョブの推定メモリの合計が
+    budget_mb を超えないように投入する。先頭の（最も重い）ジョブが入らない間は、そのジョブの分の
+    メモリを空けておける範囲でだけ小さなジョブを追い越させる（大きなジョブが後回しにされ続けないように）。
+    単独で budget_mb を超えるジョブは、他に何も実行していない時に 1 件だけ実行する。
+
+    func が例外で終わった場合（ワーカーが kill されてプールが壊れた BrokenProcessPool を含む）は、
+    on_error があれば on_error(task, exc) の戻り値をそのタスクの結果として返し、無ければ例外を送出する。
+    """
+    memory_mb = memory_mb or [0] * len(tasks)
+    done = queue.Queue()
+    pending = list(range(len(tasks)))
+    in_flight = {}
+
+    def submit(i):
+        in_flight[i] = memory_mb[i]
+        future = executor.submit(func, tasks[i])
+        future.add_done_callback(lambda future, i=i: done.put((i, future)))
+
+    while pending or in_flight:
+        used = sum(in_flight.values())
+        k = 0
+        while k < len(pending) and len(in_flight) < slots:
+            i = pending[k]
+            if not in_flight or budget_mb is None:
+                fits = True
+            elif k == 0:
+                fits = used + memory_mb[i] <= budget_mb
+            else:
+                # 先頭のジョブの分を確保したまま入るものだけ追い越させる
+                fits = used + memory_mb[i] + memory_mb[pending[0]] <= budget_mb
+            if fits:
+                submit(pending.pop(k))
+                used += memory_mb[i]
+            else:
+                k += 1
+        i, future = done.get()
+        del in_flight[i]
+        exc = future.exception()
+        if exc is None:
+            yield future.result()
+        elif on_error is not None:
+            yield on_error(tasks[i], exc)
+        else:
+            raise exc
@@ -3,52 +3,50 @@
 Multi Base Pairing Entry Extractor
 
 DSSR解析結果から"(i, j) と (i, j') といった multi base pairing を持ったエントリ"を抽出し、
-新しいJSONファイルとして保存するスクリプト
+新しい結果ファイル (JSONL) として保存するスクリプト
 
 Step by step で慎重に実行します。
 """
 
-import json
+import sys
 from pathlib import Path
 
-def extract_multi_pairing_entries(input_json_file, output_json_file):
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from analysis.results_io import iter_results, write_results
+
+def extract_multi_pairing_entries(input_file, output_file):
     """
     multi base pairingを持つエントリを抽出
     
     Args:
-        input_json_file (str): 入力JSONファイルパス
-        output_json_file (str): 出力JSONファイルパス
+        input_file (str): 入力結果ファイルパス（拡張子なしなら .jsonl / .npz / .parquet / .json を探す）
+        output_file (str): 出力結果ファイルパス (.jsonl / .npz / .parquet)
     
     Returns:
         int: 抽出されたエントリ数
     """
-    print(f"📖 入力ファイル読み込み: {input_json_file}")
-    
-    with open(input_json_file, 'r') as f:
-        all_results = json.load(f)
-    
-    print(f"📊 総エントリ数: {len(all_results)}")
+    print(f"📖 入力ファイル読み込み: {input_file}")
     
-    # multi base pairingを持つエントリを抽出
-    multi_pairing_entries = []
-    
-    for entry in all_results:
-        dup_canonical_pairs = entry.get('dup_canonical_pairs', [])
-        
-        # dup_canonical_pairsが空でないエントリを抽出
-        if dup_canonical_pairs:
-            multi_pairing_entries.append(entry)
-            print(f"✅ Multi pairing発見: {entry['pdb_id']} - {len(dup_canonical_pairs)} pairs")
-    
-    print(f"\n🎯 Multi base pairing エントリ数: {len(multi_pairing_entries)}")
-    
-    # 結果を保存
-    with open(output_json_file, 'w') as f:
-        json.dump(multi_pairing_entries, f, indent=2, ensure_ascii=False)
+    total = 0
+
+    # multi base pairingを持つエントリを 1 件ずつ読みながら抽出して書き出す
+    def multi_pairing_entries():
+        nonlocal total
+        for entry in iter_results(input_file):
+            total += 1
+            dup_canonical_pairs = entry.get('dup_canonical_pairs', [])
+            # dup_canonical_pairsが空でないエントリを抽出
+            if dup_canonical_pairs:
+                print(f"✅ Multi pairing発見: {entry['pdb_id']} - {len(dup_canonical_pairs)} pairs")
+                yield entry
+
+    n_extracted = write_results(multi_pairing_entries(), output_file)
     
-    print(f"💾 保存完了: {output_json_file}")
+    print(f"📊 総エントリ数: {total}")
+    print(f"\n🎯 Multi base pairing エントリ数: {n_extracted}")
+    print(f"💾 保存完了: {output_file}")
     
-    return len(multi_pairing_entries)
+    return n_extracted
 
 def analyze_multi_pairing_stats(entries):
     """
@@ -95,16 +93,17 @@ def main():
     print("=" * 60)
     
     # 入力・出力ファイル設定
-    input_file = "analysis/pseudoknot_analysis_dssr_all.json"
-    output_file = "analysis/multi_pairing_entries_dssr.json"
+    input_file = "analysis/pseudoknot_analysis_dssr_all"
+    output_file = "analysis/multi_pairing_entries_dssr.jsonl"
     
     # Step 1: エントリ抽出
     extracted_count = extract_multi_pairing_entries(input_file, output_file)
     
     # Step 2: 抽出したエントリを再読み込みして統計分析
     if extracted_count > 0:
-        with open(output_file, 'r') as f:
-            multi_pairing_entries = json.load(f)
+        multi_pairing_entries = list(iter_results(output_file, fields=[
+            'pdb_id', 'dup_canonical_pairs', 'pseudoknot_layer_count', 'total_bp_count', 'total_canonical_bp_count'
+        ]))
         
         analyze_multi_pairing_stats(multi_pairing_entries)
     else:
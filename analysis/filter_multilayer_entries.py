@@ -3,7 +3,7 @@
 Multi-layer Pseudoknot Entry Filter
 
 analysis/datasets/pdbid_chains.csv から、
-analysis/pseudoknot_analysis_dssr_all.json の条件に合致するエントリを抽出
+analysis/pseudoknot_analysis_dssr_all.jsonl (.npz / .parquet / 旧形式 .json) の条件に合致するエントリを抽出
 
 条件:
 - total_bp_count > 0
@@ -12,20 +12,22 @@ analysis/pseudoknot_analysis_dssr_all.json の条件に合致するエントリ
 - pdb_id と actual_chain_id が一致
 """
 
-import json
+import sys
 import pandas as pd
 from pathlib import Path
 
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from analysis.results_io import load_chains
+
 def main():
     # ファイルパス
     csv_file = "analysis/datasets/pdbid_chains.csv"
-    json_file = "analysis/pseudoknot_analysis_dssr_all.json"
-    
-    # JSONデータをDataFrameに変換
-    with open(json_file, 'r') as f:
-        json_data = json.load(f)
+    result_stem = "analysis/pseudoknot_analysis_dssr_all"
     
-    json_df = pd.DataFrame(json_data)
+    # チェーンごとの集計表から必要な列だけ読み込む
+    json_df = load_chains(result_stem, columns=[
+        'pdb_id', 'chain_id', 'total_bp_count', 'pseudoknot_layer_count', 'output_exists'
+    ])
     
     # 条件でフィルタリング
     filtered_json = json_df[
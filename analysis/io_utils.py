@@ -2,6 +2,7 @@
 I/O Utilities for Pseudoknot Analysis
 
 PDBファイルの列挙、チェーンID抽出、RNAView/DSSR実行を担当
+RNAView/DSSR は呼び出しごとに専用の作業ディレクトリで実行するため、複数プロセスから同時に呼び出せる
 
 Author: PseudoknotVisualizer Analysis
 Date: 2025年7月21日
@@ -16,11 +17,17 @@ script_dir = Path(__file__).parent.parent
 sys.path.insert(0, str(script_dir))
 
 from CLI_PseudoknotVisualizer import CLI_rnaview, CLI_dssr
+from structure_io import STRUCTURE_GLOBS, open_structure, structure_stem
+from workdir import annotator_workdir
+from log_config import get_logger
+
+logger = get_logger("analysis.io_utils")
 
 
 def get_pdb_files(dataset_dir):
     """
     データセットディレクトリから全PDBファイルのリストを取得
+    gzip 圧縮されたファイル (*.pdb.gz) もそのまま対象に含める
     
     Args:
         dataset_dir (str): データセットディレクトリのパス
@@ -28,8 +35,8 @@ def get_pdb_files(dataset_dir):
     Returns:
         list: PDBファイルのPathオブジェクトのリスト
     """
-    pdb_files = list(Path(dataset_dir).glob("*.pdb"))
-    print(f"Found {len(pdb_files)} PDB files in dataset")
+    pdb_files = [path for pattern in STRUCTURE_GLOBS for path in Path(dataset_dir).glob(pattern)]
+    logger.info("Found %d PDB files in dataset", len(pdb_files))
     return sorted(pdb_files)
 
 
@@ -46,8 +53,9 @@ def extract_chain_from_filename(filename):
     Examples:
         1EHZ_1_A.pdb -> A
         1J7T_1_A-B.pdb -> A (最初のチェーンを使用)
+        1EHZ_1_A.pdb.gz -> A
     """
-    stem = Path(filename).stem
+    stem = structure_stem(filename)
     parts = stem.split('_')
     if len(parts) >= 3:
         chain_part = parts[2]
@@ -68,7 +76,7 @@ def extract_actual_chain_from_pdb(pdb_file_path):
         str: チェーンID（見つからない場合は'A'）
     """
     try:
-        with open(pdb_file_path, 'r') as f:
+        with open_structure(pdb_file_path) as f:
             for line in f:
                 # REMARK 350 APPLY THE FOLLOWING TO CHAINS: の行を探す
                 if line.startswith('REMARK 350') and 'APPLY THE FOLLOWING TO CHAINS:' in line:
@@ -82,72 +90,73 @@ def extract_actual_chain_from_pdb(pdb_file_path):
                     break
         
         # 見つからない場合はデフォルト
-        print(f"Warning: No REMARK 350 CHAINS found in {pdb_file_path}, using default 'A'")
+        logger.warning("No REMARK 350 CHAINS found in %s, using default 'A'", pdb_file_path)
         return 'A'
         
     except Exception as e:
-        print(f"Error reading PDB file {pdb_file_path}: {e}")
+        logger.error("could not read PDB file %s: %s", pdb_file_path, e)
         return 'A'
 
 
 def run_rnaview_analysis(pdb_file_path, chain_id):
     """
-    RNAViewを実行して出力ファイルのパスを返す
+    RNAViewを専用の作業ディレクトリで実行する
     
     Args:
         pdb_file_path (str or Path): PDBファイルのパス
         chain_id (str): チェーンID
         
     Returns:
-        Path: RNAView出力ファイルのパス（存在しない場合はNone）
+        bool: RNAView出力ファイルが生成されたか, raw_df: pd.DataFrame
     """
-    print("HELLOOO")
     pdb_file = Path(pdb_file_path)
-    print(f"Running RNAView for {pdb_file.name} with chain {chain_id}...")
+    logger.debug("Running RNAView for %s with chain %s...", pdb_file.name, chain_id)
     
-    # RNAViewを実行
-    raw_df = CLI_rnaview(str(pdb_file), chain_id)
-    print(f"RNAView output generated:\n {raw_df}")
-    # 出力ファイルパスを構築
-    output_file = Path(f"intermediate/{pdb_file.name}.out")
-    if not output_file.exists():
-        raise FileNotFoundError(f"RNAView output not found for {pdb_file.name}")
-    print(f"RNAView output generated: \n{output_file}")
-    return output_file, raw_df
+    with annotator_workdir("rnaview") as workdir:
+        # RNAViewを実行
+        raw_df = CLI_rnaview(str(pdb_file), chain_id, workdir=workdir)
+        logger.debug("RNAView output generated:\n %s", raw_df)
+        # 出力ファイルパスを構築（作業ディレクトリは抜けると削除されるので、ここで存在確認する）
+        output_file = workdir / f"{structure_stem(pdb_file)}_chain_{chain_id}.pdb.out"
+        if not output_file.exists():
+            raise FileNotFoundError(f"RNAView output not found for {pdb_file.name}")
+        logger.debug("RNAView output generated: \n%s", output_file)
+    return True, raw_df
 
 
 def run_dssr_analysis(pdb_file_path, chain_id):
     """
-    DSSRを実行して出力ファイルのパスを返す
+    DSSRを専用の作業ディレクトリで実行する
     
     Args:
         pdb_file_path (str or Path): PDBファイルのパス
         chain_id (str): チェーンID
         
     Returns:
-        Path: DSSR出力ファイルのパス（存在しない場合はNone）, raw_df: pd.DataFrame
+        bool: DSSR出力ファイルが生成されたか, raw_df: pd.DataFrame
     """
     pdb_file = Path(pdb_file_path)
-    print(f"Running DSSR for {pdb_file.name} with chain {chain_id}...")
-    
-    # DSSRを実行
-    raw_df = CLI_dssr(str(pdb_file), chain_id)
-    print(f"DSSR output generated: {raw_df}")
+    logger.debug("Running DSSR for %s with chain %s...", pdb_file.name, chain_id)
     
-    # 出力ファイルパスを構築
-    output_file = Path(f"intermediate/{pdb_file.name}.dssr.json")
-    
-    if not output_file.exists():
-        print(f"Warning: DSSR output not found for {pdb_file}")
-        # raise FileNotFoundError(f"DSSR output not found for {pdb_file.name}")
-    print(f"DSSR output generated: \n{output_file}")
-    print(f"Warning: DSSR output not found for {pdb_file.name}")
-    return output_file, raw_df
+    with annotator_workdir("dssr") as workdir:
+        # DSSRを実行
+        raw_df = CLI_dssr(str(pdb_file), chain_id, workdir=workdir)
+        logger.debug("DSSR output generated: %s", raw_df)
+        
+        # 出力ファイルパスを構築（作業ディレクトリは抜けると削除されるので、ここで存在確認する）
+        output_file = workdir / f"{structure_stem(pdb_file)}_chain_{chain_id}.cif.dssr.json"
+        output_exists = output_file.exists()
+        if not output_exists:
+            logger.warning("DSSR output not found for %s", pdb_file.name)
+            # raise FileNotFoundError(f"DSSR output not found for {pdb_file.name}")
+        else:
+            logger.debug("DSSR output generated: \n%s", output_file)
+    return output_exists, raw_df
 
 
 def run_parser_analysis(pdb_file_path, chain_id, parser="RNAView"):
     """
-    指定されたパーサーを実行して出力ファイルのパスを返す
+    指定されたパーサーを実行する
     
     Args:
         pdb_file_path (str or Path): PDBファイルのパス
@@ -155,10 +164,10 @@ def run_parser_analysis(pdb_file_path, chain_id, parser="RNAView"):
         parser (str): "RNAView" or "DSSR"
         
     Returns:
-        Path: 出力ファイルのパス（存在しない場合はNone）
+        bool: 出力ファイルが生成されたか, raw_df: pd.DataFrame
     """
     if parser.upper() == "RNAVIEW":
-        output_file, raw_df = run_rnaview_analysis(pdb_file_path, chain_id)
+        output_exists, raw_df = run_rnaview_analysis(pdb_file_path, chain_id)
     elif parser.upper() == "DSSR":
-        output_file, raw_df = run_dssr_analysis(pdb_file_path, chain_id)
-    return output_file, raw_df
+        output_exists, raw_df = run_dssr_analysis(pdb_file_path, chain_id)
+    return output_exists, raw_df
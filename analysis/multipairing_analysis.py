@@ -5,21 +5,27 @@ Multi-pairing Analysis Script
 JSONファイル生成時にmulti-pairing（triplet等）がどう処理されているかを確認
 """
 
-import json
+import sys
 from pathlib import Path
 
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from analysis.results_io import find_results, iter_results
+
 def analyze_multipairing_handling():
     """Multi-pairing処理の確認"""
     
     # サンプルファイルを調査
-    json_file = "analysis/pseudoknot_analysis_dssr_all.json"
+    result_stem = "analysis/pseudoknot_analysis_dssr_all"
     
-    if not Path(json_file).exists():
-        print(f"❌ {json_file} が見つかりません")
+    try:
+        result_file = find_results(result_stem)
+    except FileNotFoundError:
+        print(f"❌ {result_stem}.jsonl が見つかりません")
         return
     
-    with open(json_file, 'r') as f:
-        results = json.load(f)
+    results = iter_results(result_file, fields=[
+        'pdb_id', 'chain_id', 'dup_canonical_pairs', 'total_bp_count', 'abnormal_pairs'
+    ])
     
     print("=" * 60)
     print("Multi-pairing (Triplet) 処理分析")
@@ -60,7 +66,7 @@ def analyze_multipairing_handling():
     print("   - canonical vs canonical → 両方をdup_canonical_pairsに記録")
     print("   - non-canonical vs non-canonical → 両方を除外")
     print()
-    print("2. 最終的なJSONファイルには:")
+    print("2. 最終的な結果ファイルには:")
     print("   - フィルタリング後の塩基対のみ記録")
     print("   - 除外された塩基対は abnormal_pairs に記録")
     print("   - 重複canonical塩基対は dup_canonical_pairs に記録")
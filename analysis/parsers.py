@@ -8,8 +8,13 @@ sys.path.insert(0, str(script_dir))
 
 from addressRNAviewOutput import load_rnaview_data
 from addressDSSROutput import load_dssr_data
+from log_config import get_logger
+from instrumentation import timed
 
+logger = get_logger("analysis.parsers")
 
+
+@timed("raw_df_processing")
 def raw_df_processing(df: pd.DataFrame, parser_type: str):
     """
     DataFrameから詳細な塩基対情報を共通フォーマットで作成
@@ -78,6 +83,7 @@ def parse_output_file(output_file_path, parser_type):
     return raw_df
 
 
+@timed("filter_abnormal_pairs")
 def filter_abnormal_pairs(processed_df: pd.DataFrame):
     """
     自己ペア（i=j）を除外したリストを作成
@@ -106,7 +112,7 @@ def filter_abnormal_pairs(processed_df: pd.DataFrame):
         right_idx = max(left_idx_tmp, right_idx_tmp)
         # print(f"left_idx: {left_idx}, right_idx: {right_idx}")
         if (right_idx, left_idx) in base_pairs:
-            print(f"Switched pair found: {(left_idx, right_idx)} and {(right_idx, left_idx)}")
+            logger.debug("Switched pair found: %s and %s", (left_idx, right_idx), (right_idx, left_idx))
             abnormal_pairs.append([right_idx, left_idx])
 
     # (i, j) と (i, j') のような塩基対を検出
@@ -133,5 +139,5 @@ def filter_abnormal_pairs(processed_df: pd.DataFrame):
     bp_details_filtered_df = pd.DataFrame(bp_details_filtered)
     if bp_details_filtered_df.empty:
         return pd.DataFrame(columns=["position", "residues", "is_canonical", "saenger_id"]), abnormal_pairs, dup_canonical_pairs
-    print(f"Remaining pairs: {len(bp_details_filtered)}")
+    logger.debug("Remaining pairs: %d", len(bp_details_filtered))
     return bp_details_filtered_df, abnormal_pairs, dup_canonical_pairs
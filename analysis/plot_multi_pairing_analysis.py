@@ -9,13 +9,15 @@ Multi Base Pairing Entries Plotting Script
 
 import os
 import sys
-import json
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.font_manager as fm
 from pathlib import Path
 from collections import defaultdict
 
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from analysis.results_io import iter_results
+
 def setup_fonts():
     """利用可能なフォントを確認して設定"""
     available_fonts = [f.name for f in fm.fontManager.ttflist]
@@ -268,14 +270,15 @@ def main():
     setup_matplotlib()
     
     # 入力・出力設定
-    input_file = Path("analysis/multi_pairing_entries_dssr.json")
+    input_file = Path("analysis/multi_pairing_entries_dssr.jsonl")
     output_dir = Path("analysis/graphs/multi_pairing")
     output_dir.mkdir(parents=True, exist_ok=True)
     
     # データ読み込み
     print(f"📖 データ読み込み: {input_file}")
-    with open(input_file, 'r') as f:
-        data = json.load(f)
+    data = list(iter_results(input_file, fields=[
+        'pdb_id', 'layers', 'pseudoknot_layer_count', 'total_bp_count', 'dup_canonical_pairs'
+    ]))
     
     print(f"📊 Multi base pairing エントリ数: {len(data)}")
     
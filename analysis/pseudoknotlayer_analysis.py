@@ -7,16 +7,22 @@ Pseudoknot Layer Analysis Script (Parallelized)
 3. 各レイヤーでのcanonical / non-canonical base pairの割合を計算
 
 $ cd PseudoknotVisualizer
-$ python analysis/pseudoknotlayer_analysis.py --annotator [RNAView or DSSR] [--canonical-only]
+$ python analysis/pseudoknotlayer_analysis.py --annotator [RNAView or DSSR] [--canonical-only | --both-variants]
+
+結果は構造ごとに checkpoint (JSONL) に追記されるので、途中で止まっても再実行すれば続きから処理する。
+データセットに追加・更新されたファイルだけを処理するには --refresh を付ける。
+最終結果は 1 行 1 チェーンの JSONL（--output-format npz / parquet で列指向の表）に書き出す。
+読み込みは analysis/results_io.py の iter_results / load_chains / load_pairs を使う。
 """
 
+import logging
 import sys
-import json
+import time
 from pathlib import Path
 from functools import partial
 import pandas as pd
-from multiprocessing import Pool, cpu_count
-from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import cpu_count
 
 script_dir = Path(__file__).parent.parent
 sys.path.insert(0, str(script_dir))
@@ -34,7 +40,16 @@ from analysis.parsers import (
     raw_df_processing
 )
 from analysis.argparser import parse_args
+from analysis.checkpoint import CheckpointLog, file_sha256
+from analysis.results_io import write_results
+from analysis.dataset_index import DatasetIndex, budgeted_imap, default_index_path, longest_first
+from instrumentation import task_stats
+from progress import ProgressTracker, emit, init_worker_events
 from rna import PKextractor
+from structure_io import structure_stem
+from log_config import configure_logging, get_logger
+
+logger = get_logger("analysis.pseudoknotlayer_analysis")
 
 # データセットディレクトリ
 DATASET_DIR = "analysis/datasets/BGSU__M__All__A__4_0__pdb_3_396"
@@ -42,35 +57,59 @@ REMOVE_FILES = [
     "PDB_00003OK4_1_2.pdb"
 ]
 
-def analyze_single_pdb(pdb_file, parser="RNAView", canonical_only=True):
+def annotate_single_pdb(pdb_file, parser="RNAView", actual_chain_id=None):
     """
-    単一のPDBファイルを解析
+    単一のPDBファイルにアノテーターを実行し、異常ペアを除外した塩基対を返す（canonical の選択前）
+    actual_chain_id を渡した場合（dataset index に記録済み）はファイルを開き直してチェーンを探さない
+
+    Returns:
+        dict: display_chain_id, actual_chain_id, output_exists, processed_df, abnormal_pairs, dup_canonical_pairs
     """
     # チェーン情報を抽出（表示用）
     display_chain_id = extract_chain_from_filename(pdb_file.name)
     # PDBファイルのREMARK 350から実際のチェーンIDを取得
-    actual_chain_id = extract_actual_chain_from_pdb(pdb_file)
-    # パーサーを実行して出力ファイルを取得
-    output_file, raw_df = run_parser_analysis(pdb_file, actual_chain_id, parser)
-    print(f"Output file for {pdb_file.name}: {output_file}")
-
-    output_exists = output_file.exists()
-    if not output_file.exists():
-        print(f"Warning: {parser} output not found for {pdb_file.name}")
+    if actual_chain_id is None:
+        actual_chain_id = extract_actual_chain_from_pdb(pdb_file)
+    # パーサーを実行して塩基対を取得
+    output_exists, raw_df = run_parser_analysis(pdb_file, actual_chain_id, parser)
+    logger.debug("Output file for %s exists: %s", pdb_file.name, output_exists)
+
+    if not output_exists:
+        logger.warning("%s output not found for %s", parser, pdb_file.name)
         # raise ValueError(f"{parser} output not found for {pdb_file.name}")
 
     # 出力ファイルを解析して共通フォーマットで取得
     # raw_df = parse_output_file(output_file, parser)
-    print("raw_df:\n", raw_df.head())
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("raw_df:\n%s", raw_df.head())
     processed_df = raw_df_processing(raw_df, parser)
-    print(f"Processed DataFrame for {pdb_file.name}:\n", processed_df)
+    logger.debug("Processed DataFrame for %s:\n%s", pdb_file.name, processed_df)
 
     # 自己ペア（i=j）を検出・除外
     processed_df, abnormal_pairs, dup_canonical_pairs = filter_abnormal_pairs(processed_df)
+    return {
+        "display_chain_id": display_chain_id,
+        "actual_chain_id": actual_chain_id,
+        "output_exists": output_exists,
+        "processed_df": processed_df,
+        "abnormal_pairs": abnormal_pairs,
+        "dup_canonical_pairs": dup_canonical_pairs,
+    }
+
 
-    print(f"Analyzing {pdb_file.name} (Chain: {display_chain_id}, Actual Chain: {actual_chain_id})")
-    print("processed_df:\n", processed_df.head())
-    print(f"all base pairs found: {len(processed_df)}")
+def decompose_single_pdb(pdb_file, annotated, parser="RNAView", canonical_only=True):
+    """
+    annotate_single_pdb の結果を canonical_only に応じて pseudoknot layer に分解し、結果レコードを返す
+    """
+    display_chain_id = annotated["display_chain_id"]
+    actual_chain_id = annotated["actual_chain_id"]
+    output_exists = annotated["output_exists"]
+    processed_df = annotated["processed_df"]
+    abnormal_pairs = annotated["abnormal_pairs"]
+    dup_canonical_pairs = annotated["dup_canonical_pairs"]
+
+    logger.debug("Analyzing %s (Chain: %s, Actual Chain: %s)", pdb_file.name, display_chain_id, actual_chain_id)
+    logger.debug("all base pairs found: %d", len(processed_df))
     # 以下のコードは、dict が空の時にエラーになる。defaultdict を使えば問題ないが、未実装です。
 
     canonical_processed_df = processed_df[processed_df["is_canonical"]] if not processed_df.empty else pd.DataFrame(columns=processed_df.columns)
@@ -79,20 +118,20 @@ def analyze_single_pdb(pdb_file, parser="RNAView", canonical_only=True):
         basepair_list = [ (bp[0], bp[1]) for bp in canonical_processed_df["position"]]
     else:
         basepair_list = [ (bp[0], bp[1]) for bp in processed_df["position"]]
-    # key: pair (i, j) , value: base pair details
-    details_dict = {(bp[0][0], bp[0][1]): {
-            "position": bp[0], "residues": bp, "is_canonical": bp[2], "saenger_id": bp[3]
-        } for bp in processed_df.values.tolist()
-    }
-    # print(f"Total base pairs found: {details_dict}")
-    print("base pair list:")
-    for bp in basepair_list:
-        print(f"  {bp} ")
-    print("duplicated canonical pairs:")
-    for bp in dup_canonical_pairs:
-        print(f"  {bp} ")
     pk_layers = PKextractor(basepair_list.copy())
-    print("layer decomposed")    
+    logger.debug("layer decomposed")
+
+    # 塩基対ごとのフラットな表（列ごとのリスト）。layer に入らない塩基対の layer_id は -1
+    layer_of = {bp: layer_id for layer_id, layer_bps in enumerate(pk_layers) for bp in layer_bps}
+    pairs = {"i": [], "j": [], "res_i": [], "res_j": [], "is_canonical": [], "saenger_id": [], "layer_id": []}
+    for position, residues, is_canonical, saenger_id in processed_df[["position", "residues", "is_canonical", "saenger_id"]].values.tolist():
+        i, j = position
+        for key, value in zip(pairs, (int(i), int(j), residues[0], residues[1], bool(is_canonical), saenger_id, layer_of.get((i, j), -1))):
+            pairs[key].append(value)
+    is_canonical_of = dict(zip(zip(pairs["i"], pairs["j"]), pairs["is_canonical"]))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("base pair list:\n%s", "\n".join(f"  {bp} " for bp in basepair_list))
+        logger.debug("duplicated canonical pairs:\n%s", "\n".join(f"  {bp} " for bp in dup_canonical_pairs))
 
     layer_analysis = []
     for layer_id, layer_bps in enumerate(pk_layers):
@@ -100,18 +139,17 @@ def analyze_single_pdb(pdb_file, parser="RNAView", canonical_only=True):
             canon_count = len(layer_bps)
             noncanon_count = 0
         else:
-            canon_count = sum(1 for bp in layer_bps if details_dict[bp]["is_canonical"])
-            noncanon_count = sum(1 for bp in layer_bps if not details_dict[bp]["is_canonical"])
+            canon_count = sum(1 for bp in layer_bps if is_canonical_of[bp])
+            noncanon_count = sum(1 for bp in layer_bps if not is_canonical_of[bp])
         layer_analysis.append({
             "layer_id": layer_id,
             "total_bp_count": len(layer_bps),
-            "basepair_details": [details_dict[bp] for bp in layer_bps],
             "canonical_bp_count": canon_count,
             "non_canonical_bp_count": noncanon_count,
         })
 
     return {
-        "pdb_id": pdb_file.stem,
+        "pdb_id": structure_stem(pdb_file),
         "chain_id": display_chain_id,
         "actual_chain_id": actual_chain_id,
         "parser": parser,
@@ -120,17 +158,58 @@ def analyze_single_pdb(pdb_file, parser="RNAView", canonical_only=True):
         "pseudoknot_layer_count": len(pk_layers),
         "output_exists": output_exists,
         "layers": layer_analysis,
-        "all_base_pairs": processed_df["position"].tolist(),  # filtered: removed self-pairs
+        "pairs": pairs,  # filtered: removed self-pairs
         "abnormal_pairs": abnormal_pairs,
-        # "details": details_dict.values,
         "dup_canonical_pairs": list(dup_canonical_pairs) if dup_canonical_pairs else [],
     }
 
 
+def analyze_single_pdb(pdb_file, parser="RNAView", canonical_only=True, actual_chain_id=None):
+    """
+    単一のPDBファイルを解析
+    actual_chain_id を渡した場合（dataset index に記録済み）はファイルを開き直してチェーンを探さない
+    """
+    annotated = annotate_single_pdb(pdb_file, parser=parser, actual_chain_id=actual_chain_id)
+    return decompose_single_pdb(pdb_file, annotated, parser=parser, canonical_only=canonical_only)
+
+
+def analyze_single_pdb_variants(pdb_file, parser="RNAView", variants=(True, False), actual_chain_id=None):
+    """
+    アノテーターを 1 回だけ実行し、canonical_only の値ごとの結果を {canonical_only: result} で返す
+    （2 つの variant の違いは filter_abnormal_pairs の後の is_canonical の選択だけ）
+    """
+    annotated = annotate_single_pdb(pdb_file, parser=parser, actual_chain_id=actual_chain_id)
+    return {
+        canonical_only: decompose_single_pdb(pdb_file, annotated, parser=parser, canonical_only=canonical_only)
+        for canonical_only in variants
+    }
+
+
+def analyze_checkpoint_task(task, parser="RNAView", variants=(True,)):
+    """
+    checkpoint 用のタスク (pdb_file, input_hash, chain_id) を解析し、
+    (pdb_file, input_hash, {canonical_only: result}, 実行時間[秒]) を返す（開始と終了を進捗のイベントとして送る）
+    """
+    pdb_file, input_hash, chain_id = task
+    emit("start", pdb_file.name)
+    if input_hash is None:
+        input_hash = file_sha256(pdb_file)
+    start = time.perf_counter()
+    with task_stats() as stats:
+        results = analyze_single_pdb_variants(pdb_file, parser=parser, variants=variants, actual_chain_id=chain_id)
+    elapsed = time.perf_counter() - start
+    annotator_stage = stats.snapshot()["stages"].get("annotator")
+    emit("done", pdb_file.name, ok=1, pairs=results[variants[0]]["total_bp_count"],
+         annotator_sec={parser: [annotator_stage["total_sec"]]} if annotator_stage else {})
+    return pdb_file, input_hash, results, elapsed
+
+
 def main():
     args = parse_args()
+    configure_logging(args.log_level)
     pdb_files = get_pdb_files(DATASET_DIR)
-    pdb_files = [pdb_file for pdb_file in pdb_files if pdb_file.name not in REMOVE_FILES]
+    # .pdb.gz も同じ除外リストで判定する
+    pdb_files = [pdb_file for pdb_file in pdb_files if f"{structure_stem(pdb_file)}.pdb" not in REMOVE_FILES]
     # pdb_files = pdb_files[:10]
     # pdb_files = [Path("analysis/datasets/BGSU__M__All__A__4_0__pdb_3_396/1O9M_1_A-B.pdb")]
     # pdb_files = [Path("analysis/datasets/BGSU__M__All__A__4_0__pdb_3_396/PDB_00003OK4_1_2.pdb")]
@@ -144,36 +223,110 @@ def main():
     n_procs = args.processes if hasattr(args, 'processes') and args.processes else cpu_count()
     n_procs = min(n_procs, args.ncpus)  
 
-    # 並列で解析
-    process_func = partial(
-        analyze_single_pdb,
-        parser=getattr(args, 'annotator', 'DSSR'),
-        canonical_only=args.canonical_only
-    )
-    process_func(pdb_files[0])  # テスト用に最初のファイルだけ実行
-    # return
-
-    # with Pool(processes=n_procs) as pool:
-    #     results = list(tqdm(
-    #         pool.imap(process_func, pdb_files),
-    #         total=len(pdb_files),
-    #         desc="Processing PDB files",
-    #         unit="file"
-    #     ))
-    results = []
-    for pdb_file in tqdm(pdb_files, desc="Processing PDB files", unit="file"):
-        result = process_func(pdb_file)
-        results.append(result)
-        print(f"Processed {pdb_file.name}: {result['total_bp_count']} base pairs found.")
-        print("-" * 40)
-
-    # 結果をJSONに保存
-    output_file = f"analysis/pseudoknot_analysis_{getattr(args, 'annotator', 'DSSR').lower()}.json"
-    if args.canonical_only:
-        output_file = output_file.replace(".json", "_canonical_only.json")
-    with open(output_file, 'w') as f:
-        json.dump(results, f, indent=2, ensure_ascii=False)
-    print(f"Results saved to: {output_file}")
+    annotator = getattr(args, 'annotator', 'DSSR')
+    # --both-variants: アノテーターは 1 回だけ実行し、canonical-only と include-all の両方を書き出す
+    variants = (True, False) if args.both_variants else (args.canonical_only,)
+    if args.both_variants and args.output:
+        raise ValueError("--output cannot be combined with --both-variants (each variant has its own output file)")
+
+    # dataset index: ハッシュ・チェーン・原子数・前回の実行時間（新規・更新されたファイルだけ読み直す）
+    index = DatasetIndex(args.index or default_index_path(DATASET_DIR))
+    n_indexed = index.update(pdb_files, processes=n_procs)
+    index.save()
+    print(f"Dataset index: {index.path} ({len(index)} entries, {n_indexed} (re)indexed)")
+
+    def output_stem(canonical_only):
+        stem = f"analysis/pseudoknot_analysis_{annotator.lower()}"
+        return stem + "_canonical_only" if canonical_only else stem
+
+    def options(canonical_only):
+        return {"canonical_only": canonical_only}
+
+    # checkpoint のキーにはオプションが含まれるので、両 variant を 1 つの checkpoint に追記できる
+    checkpoint_path = args.checkpoint or f"{output_stem(variants[-1])}.checkpoint.jsonl"
+
+    def input_hash_of(pdb_file):
+        return index.entries.get(str(pdb_file), {}).get("sha256")
+
+    with CheckpointLog(checkpoint_path, fresh=args.fresh) as checkpoint:
+        # checkpoint に同じ (入力ハッシュ, アノテーター, オプション) の結果があれば再利用する
+        # refresh モードではサイズと mtime が変わっていないファイルはハッシュ計算もしない
+        # どれか 1 つの variant でも欠けていれば、そのファイルはアノテーターから実行し直す
+        pending = []
+        n_new = n_modified = 0
+        for pdb_file in pdb_files:
+            entry = index.entries.get(str(pdb_file), {})
+            input_hash = entry.get("sha256")
+            missing = False
+            for canonical_only in variants:
+                record, input_hash = checkpoint.lookup(pdb_file, annotator, options(canonical_only),
+                                                       trust_stat=args.refresh, input_hash=input_hash)
+                missing = missing or record is None
+            if missing:
+                pending.append((pdb_file, input_hash, entry.get("chain_id")))
+                if str(pdb_file) in checkpoint.by_input:
+                    n_modified += 1
+                else:
+                    n_new += 1
+        print(f"Checkpoint: {checkpoint_path} ({len(checkpoint)} records)")
+        print(f"{len(pdb_files) - len(pending)} files up to date, {len(pending)} to process "
+              f"({n_new} new, {n_modified} modified or re-configured)")
+
+        # 推定コストの大きい順に並べる（巨大な構造が最後に残ってコアが遊ぶのを防ぐ）
+        pending_files = [task[0] for task in pending]
+        costs = index.estimated_costs(pending_files, annotator)
+        pending, order = longest_first(pending, costs)
+        memory_of = index.estimated_memory_mb(pending_files)
+        memory_mb = [memory_of[i] for i in order]
+
+        def record(pdb_file, input_hash, results, elapsed):
+            for canonical_only, result in results.items():
+                checkpoint.append(pdb_file, input_hash, annotator, options(canonical_only), result)
+            index.record_runtime(pdb_file, annotator, elapsed)
+
+        # 並列で解析し、終わったものから checkpoint に追記する
+        # 各アノテーター実行は専用の作業ディレクトリを使うので、並列に走らせても干渉しない
+        process_func = partial(
+            analyze_checkpoint_task,
+            parser=annotator,
+            variants=variants
+        )
+        # 進捗: 完了・実行中の件数、スループット、アノテーターの所要時間、dataset index の推定コストによる ETA
+        tracker = ProgressTracker(
+            dict(zip((pdb_file.name for pdb_file in pending_files), costs)), workers=n_procs,
+            status_path=args.status_file, live=True, interval=args.progress_interval, label="analysis",
+        )
+        try:
+            if n_procs > 1 and len(pending) > 1:
+                with ProcessPoolExecutor(max_workers=n_procs, initializer=init_worker_events,
+                                         initargs=(tracker.events,)) as pool, tracker:
+                    for pdb_file, input_hash, results, elapsed in budgeted_imap(
+                        pool, process_func, pending, n_procs, memory_mb, args.memory_budget
+                    ):
+                        record(pdb_file, input_hash, results, elapsed)
+            else:
+                init_worker_events(tracker.events)
+                with tracker:
+                    for task in pending:
+                        pdb_file, input_hash, results, elapsed = process_func(task)
+                        record(pdb_file, input_hash, results, elapsed)
+                        logger.debug("Processed %s: %d base pairs found.", pdb_file.name,
+                                     results[variants[0]]["total_bp_count"])
+        finally:
+            # 次回のスケジューリングのために実行時間を保存する
+            index.save()
+
+        # variant ごとに、現在のデータセットに含まれるファイルの結果だけをファイル名順に書き出す
+        # （.jsonl は 1 件ずつ書き出すので、全件をメモリに載せない）
+        for canonical_only in variants:
+            output_file = args.output or f"{output_stem(canonical_only)}.{args.output_format}"
+            n_saved = write_results(
+                (checkpoint.read_result(checkpoint.lookup(pdb_file, annotator, options(canonical_only),
+                                                         trust_stat=True, input_hash=input_hash_of(pdb_file))[0])
+                 for pdb_file in pdb_files),
+                output_file,
+            )
+            print(f"Results ({n_saved} chains, canonical only: {canonical_only}) saved to: {output_file}")
 
 if __name__ == "__main__":
     main()
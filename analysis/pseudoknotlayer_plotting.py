@@ -1,6 +1,5 @@
 import os
 import sys
-import json
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.font_manager as fm
@@ -11,6 +10,9 @@ import numpy as np
 from matplotlib.ticker import MultipleLocator, FormatStrFormatter
 from matplotlib.markers import MarkerStyle
 
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from analysis.results_io import iter_results
+
 # 設定
 parsers = ['rnaview', 'dssr']
 base_dir = Path('analysis')
@@ -261,16 +263,15 @@ def main():
             structures_with_layers = 0
             structures_skipped = 0
 
-            # JSON読み込み
-            path = base_dir / f'pseudoknot_analysis_{parser}_{variant}.json'
-            with open(path) as f:
-                data = json.load(f)
-            
-            print(f"  [FILTER] 初期データ読み込み: {len(data)} structures loaded from JSON file")
+            # 結果読み込み（.jsonl / .npz / .parquet / 旧形式 .json）。1 件ずつ読み、必要なキーだけ残す
+            path = base_dir / f'pseudoknot_analysis_{parser}_{variant}'
+            data = iter_results(path, fields=['pdb_id', 'layers', 'pseudoknot_layer_count', 'total_bp_count'])
+            n_loaded = 0
             
             # layers --> pdb_id v.s. layer_id, canonical_bp_count, non_canonical_bp_count
             data_list = list()
             for item in data: # 各 pdb ごとに分解していく
+                n_loaded += 1
                 # sys.exit()
                 pdb_id = item['pdb_id']
                 layers = item['layers']
@@ -310,6 +311,7 @@ def main():
                 total_canonical_bps += canonical_bp_in_main_layer + canonical_bp_in_pk_layer
                 total_noncanonical_bps += non_canonical_bp_in_main_layer + non_canonical_bp_in_pk_layer
             
+            print(f"  [FILTER] 初期データ読み込み: {n_loaded} structures loaded from {path}")
             print(f"  [FILTER] レイヤーなし構造をスキップ: {structures_skipped} structures skipped (no layers)")
             print(f"  [FILTER] 残存構造数: {structures_with_layers} structures with layers")
             print(f"  [FILTER] 総塩基対数: {total_bps} BPs")
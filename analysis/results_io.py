@@ -0,0 +1,314 @@
+"""
+Result storage for dataset analysis
+
+pseudoknotlayer_analysis の結果を、データセットの大きさに比例してメモリと読み込み時間が
+増えない形式で読み書きする。
+
+形式（拡張子で判定）:
+    .jsonl   : 1 行 1 チェーンのコンパクトなレコード（既定）。行ごとにストリーム読み込みできる
+    .npz     : 列指向。chains (チェーンごとの集計) / pairs (塩基対ごとのフラットな表) /
+               flagged (abnormal_pairs, dup_canonical_pairs) の 3 表を列ごとに格納する。
+               読み込み時は要求された列だけを展開する
+    .parquet : .npz と同じ 3 表を <stem>.parquet/{chains,pairs,flagged}.parquet に書く（pyarrow が必要）
+    .json    : 旧形式（indent 付きの 1 つの配列）。読み込みのみ対応
+
+レコード (1 チェーン):
+    pdb_id, chain_id, actual_chain_id, parser, total_bp_count, total_canonical_bp_count,
+    pseudoknot_layer_count, output_exists,
+    layers: [{layer_id, total_bp_count, canonical_bp_count, non_canonical_bp_count}, ...],
+    pairs: {"i": [...], "j": [...], "res_i": [...], "res_j": [...],
+            "is_canonical": [...], "saenger_id": [...], "layer_id": [...]}  (layer に入らない塩基対は -1),
+    abnormal_pairs, dup_canonical_pairs
+"""
+
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+RESULT_SUFFIXES = (".jsonl", ".npz", ".parquet", ".json")
+TABLES = ("chains", "pairs", "flagged")
+
+CHAIN_COLUMNS = [
+    "pdb_id", "chain_id", "actual_chain_id", "parser",
+    "total_bp_count", "total_canonical_bp_count", "pseudoknot_layer_count", "output_exists",
+]
+PAIR_COLUMNS = ["i", "j", "res_i", "res_j", "is_canonical", "saenger_id", "layer_id"]
+FLAG_KINDS = ("abnormal_pairs", "dup_canonical_pairs")
+
+
+def result_format(path):
+    """ファイル名から形式 ("jsonl" / "npz" / "parquet" / "json") を返す"""
+    suffix = Path(path).suffix.lower()
+    if suffix not in RESULT_SUFFIXES:
+        raise ValueError(f"Unsupported result format: {path} (use one of {', '.join(RESULT_SUFFIXES)})")
+    return suffix[1:]
+
+
+def find_results(stem):
+    """
+    拡張子なしのパス (例: analysis/pseudoknot_analysis_dssr_all) に対して、
+    存在する結果ファイルを .jsonl → .npz → .parquet → .json の順に探す。
+    """
+    for suffix in RESULT_SUFFIXES:
+        path = Path(str(stem) + suffix)
+        if path.exists():
+            return path
+    raise FileNotFoundError(f"No result file found for {stem} ({', '.join(RESULT_SUFFIXES)})")
+
+
+# ---------------------------------------------------------------- 書き出し
+
+def _layer_summary(record):
+    """pairs の layer_id / is_canonical から layers の集計を作る（列指向からの復元用）"""
+    pairs = record["pairs"]
+    layers = []
+    for layer_id in range(record["pseudoknot_layer_count"]):
+        canon = [c for c, l in zip(pairs["is_canonical"], pairs["layer_id"]) if l == layer_id]
+        layers.append({
+            "layer_id": layer_id,
+            "total_bp_count": len(canon),
+            "canonical_bp_count": sum(canon),
+            "non_canonical_bp_count": len(canon) - sum(canon),
+        })
+    return layers
+
+
+class _ColumnarBuilder:
+    """レコードを chains / pairs / flagged の 3 表の列に積み上げる"""
+
+    def __init__(self):
+        self.chains = {col: [] for col in CHAIN_COLUMNS}
+        self.pairs = {"chain_index": [], **{col: [] for col in PAIR_COLUMNS}}
+        self.flagged = {"chain_index": [], "kind": [], "i": [], "j": []}
+
+    def add(self, record):
+        index = len(self.chains["pdb_id"])
+        for col in CHAIN_COLUMNS:
+            self.chains[col].append(record.get(col))
+        pairs = record.get("pairs") or {col: [] for col in PAIR_COLUMNS}
+        self.pairs["chain_index"].extend([index] * len(pairs["i"]))
+        for col in PAIR_COLUMNS:
+            self.pairs[col].extend(pairs[col])
+        for kind in FLAG_KINDS:
+            for bp in record.get(kind) or []:
+                self.flagged["chain_index"].append(index)
+                self.flagged["kind"].append(kind)
+                self.flagged["i"].append(int(bp[0]))
+                self.flagged["j"].append(int(bp[1]))
+
+    def arrays(self):
+        """{表名: {列名: np.ndarray}}（文字列列は固定長の unicode 配列にして pickle 不要にする）"""
+        dtypes = {
+            "chain_index": np.int32, "i": np.int32, "j": np.int32, "layer_id": np.int16,
+            "is_canonical": np.bool_, "output_exists": np.bool_,
+            "total_bp_count": np.int32, "total_canonical_bp_count": np.int32, "pseudoknot_layer_count": np.int16,
+        }
+        return {
+            name: {col: np.asarray(values, dtype=dtypes.get(col, str)) for col, values in getattr(self, name).items()}
+            for name in TABLES
+        }
+
+
+def compact_legacy_record(record):
+    """
+    旧形式 (.json) のレコードを新しいレコード形式に変換する。
+    layer に入らなかった塩基対は旧形式に詳細が残っていないので、is_canonical=False, saenger_id="" とする。
+    """
+    if "pairs" in record:
+        return record
+    pairs = {col: [] for col in PAIR_COLUMNS}
+    seen = set()
+    for layer in record.get("layers", []):
+        for detail in layer.get("basepair_details", []):
+            i, j = detail["position"]
+            residues = detail["residues"][1] if len(detail["residues"]) > 1 else ["", ""]
+            for col, value in zip(PAIR_COLUMNS, (i, j, residues[0], residues[1], bool(detail["is_canonical"]),
+                                                 detail["saenger_id"], layer["layer_id"])):
+                pairs[col].append(value)
+            seen.add((i, j))
+    for i, j in record.get("all_base_pairs", []):
+        if (i, j) not in seen:
+            for col, value in zip(PAIR_COLUMNS, (i, j, "", "", False, "", -1)):
+                pairs[col].append(value)
+    compact = {key: value for key, value in record.items() if key != "all_base_pairs"}
+    compact["layers"] = [
+        {key: value for key, value in layer.items() if key != "basepair_details"}
+        for layer in record.get("layers", [])
+    ]
+    compact["pairs"] = pairs
+    return compact
+
+
+def _jsonl_line(record):
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+def write_results(records, path):
+    """
+    レコードの iterable を path に書き出す（形式は拡張子で決める）。
+    .jsonl は 1 件ずつ書き出すので、records はジェネレーターでよい。
+
+    Returns:
+        int: 書き出したレコード数
+    """
+    path = Path(path)
+    fmt = result_format(path)
+    if fmt == "json":
+        raise ValueError("The indented .json format is read-only; write .jsonl, .npz or .parquet instead")
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    if fmt == "jsonl":
+        n = 0
+        with open(path, "w") as f:
+            for record in records:
+                f.write(_jsonl_line(record))
+                n += 1
+        return n
+
+    builder = _ColumnarBuilder()
+    for record in records:
+        builder.add(record)
+    tables = builder.arrays()
+    if fmt == "npz":
+        np.savez_compressed(path, **{
+            f"{name}.{col}": values for name, columns in tables.items() for col, values in columns.items()
+        })
+    else:
+        path.mkdir(exist_ok=True)
+        for name, columns in tables.items():
+            try:
+                pd.DataFrame(columns).to_parquet(path / f"{name}.parquet", index=False)
+            except ImportError as e:
+                raise ImportError("Writing .parquet requires pyarrow (pip install pyarrow)") from e
+    return len(tables["chains"]["pdb_id"])
+
+
+# ---------------------------------------------------------------- 読み込み
+
+def _read_table(path, table, columns=None):
+    """列指向の結果 (.npz / .parquet) から 1 つの表を、指定した列だけ読み込む"""
+    fmt = result_format(path)
+    if fmt == "parquet":
+        return pd.read_parquet(Path(path) / f"{table}.parquet", columns=columns)
+    with np.load(path) as npz:
+        prefix = f"{table}."
+        available = [key[len(prefix):] for key in npz.files if key.startswith(prefix)]
+        wanted = available if columns is None else [col for col in columns if col in available]
+        return pd.DataFrame({col: npz[prefix + col] for col in wanted})
+
+
+def _iter_columnar(path):
+    chains = _read_table(path, "chains")
+    pairs = _read_table(path, "pairs")
+    flagged = _read_table(path, "flagged")
+    pair_groups = dict(tuple(pairs.groupby("chain_index"))) if len(pairs) else {}
+    flag_groups = dict(tuple(flagged.groupby("chain_index"))) if len(flagged) else {}
+    empty_pairs = pd.DataFrame(columns=PAIR_COLUMNS)
+    for index, row in enumerate(chains.itertuples(index=False)):
+        record = {col: getattr(row, col) for col in CHAIN_COLUMNS}
+        for col in ("total_bp_count", "total_canonical_bp_count", "pseudoknot_layer_count"):
+            record[col] = int(record[col])
+        record["output_exists"] = bool(record["output_exists"])
+        chain_pairs = pair_groups.get(index, empty_pairs)
+        record["pairs"] = {col: chain_pairs[col].tolist() for col in PAIR_COLUMNS}
+        record["layers"] = _layer_summary(record)
+        chain_flags = flag_groups.get(index)
+        for kind in FLAG_KINDS:
+            if chain_flags is None:
+                record[kind] = []
+            else:
+                sel = chain_flags[chain_flags["kind"] == kind]
+                record[kind] = [[int(i), int(j)] for i, j in zip(sel["i"], sel["j"])]
+        yield record
+
+
+def iter_results(path, fields=None):
+    """
+    結果を 1 チェーンずつ dict で返すジェネレーター。
+
+    Args:
+        path (str | Path): 結果ファイル（拡張子なしのパスを渡すと find_results で探す）
+        fields (list[str] | None): 指定した場合、そのキーだけを残す
+
+    .jsonl は 1 行ずつ読むので、ファイル全体をメモリに載せない。
+    旧形式の .json は json.load で一度に読み込み、新しいレコード形式に変換して返す。
+    """
+    path = Path(path)
+    if path.suffix.lower() not in RESULT_SUFFIXES:
+        path = find_results(path)
+    fmt = result_format(path)
+    if fmt == "jsonl":
+        def records():
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+        source = records()
+    elif fmt == "json":
+        with open(path) as f:
+            source = (compact_legacy_record(record) for record in json.load(f))
+    else:
+        source = _iter_columnar(path)
+
+    for record in source:
+        if fields is not None:
+            record = {key: record[key] for key in fields if key in record}
+        yield record
+
+
+def load_chains(path, columns=None):
+    """
+    チェーンごとの集計表を DataFrame で返す（columns で列を絞れる）。
+    CHAIN_COLUMNS に加えて abnormal_pair_count / dup_canonical_pair_count 列を持つ。
+    """
+    path = Path(path)
+    if path.suffix.lower() not in RESULT_SUFFIXES:
+        path = find_results(path)
+    count_columns = ["abnormal_pair_count", "dup_canonical_pair_count"]
+    if result_format(path) in ("npz", "parquet"):
+        base_columns = None if columns is None else [c for c in columns if c not in count_columns]
+        chains = _read_table(path, "chains", base_columns)
+        if columns is None or any(c in count_columns for c in columns):
+            flagged = _read_table(path, "flagged", ["chain_index", "kind"])
+            n = len(_read_table(path, "chains", ["pdb_id"]))
+            for kind, col in zip(FLAG_KINDS, count_columns):
+                index = flagged.loc[flagged["kind"] == kind, "chain_index"].to_numpy()
+                chains[col] = np.bincount(index, minlength=n).astype(np.int32)
+        return chains if columns is None else chains[columns]
+
+    rows = []
+    for record in iter_results(path):
+        row = {col: record.get(col) for col in CHAIN_COLUMNS}
+        row["abnormal_pair_count"] = len(record.get("abnormal_pairs") or [])
+        row["dup_canonical_pair_count"] = len(record.get("dup_canonical_pairs") or [])
+        rows.append(row if columns is None else {col: row[col] for col in columns})
+    return pd.DataFrame(rows, columns=columns or CHAIN_COLUMNS + count_columns)
+
+
+def load_pairs(path, columns=None):
+    """
+    塩基対ごとのフラットな表を DataFrame で返す（pdb_id / chain_id 列付き、columns で列を絞れる）。
+    """
+    path = Path(path)
+    if path.suffix.lower() not in RESULT_SUFFIXES:
+        path = find_results(path)
+    if result_format(path) in ("npz", "parquet"):
+        pair_columns = None if columns is None else ["chain_index"] + [c for c in columns if c in PAIR_COLUMNS]
+        pairs = _read_table(path, "pairs", pair_columns)
+        chains = _read_table(path, "chains", ["pdb_id", "chain_id"])
+        index = pairs.pop("chain_index").to_numpy()
+        pairs.insert(0, "chain_id", chains["chain_id"].to_numpy()[index])
+        pairs.insert(0, "pdb_id", chains["pdb_id"].to_numpy()[index])
+        return pairs if columns is None else pairs[columns]
+
+    frames = []
+    for record in iter_results(path, fields=["pdb_id", "chain_id", "pairs"]):
+        frame = pd.DataFrame(record["pairs"], columns=PAIR_COLUMNS)
+        frame.insert(0, "chain_id", record["chain_id"])
+        frame.insert(0, "pdb_id", record["pdb_id"])
+        frames.append(frame if columns is None else frame[columns])
+    if not frames:
+        return pd.DataFrame(columns=columns or ["pdb_id", "chain_id"] + PAIR_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
@@ -5,41 +5,43 @@ Unified Filtering Analysis Script
 BGSU__M__All__A__4_0__pdb_3_396データセットの解析結果を統計的にまとめる統合スクリプト
 """
 
-import json
+import sys
 from pathlib import Path
 import pandas as pd
 
-def analyze_parser_results(json_file, description, initial_count):
-    """パーサー結果の分析"""
-    with open(json_file, 'r') as f:
-        results = json.load(f)
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from analysis.results_io import find_results, load_chains
+
+def analyze_parser_results(result_file, description, initial_count):
+    """パーサー結果の分析（チェーンごとの集計表の必要な列だけを読み込む）"""
+    chains = load_chains(result_file, columns=[
+        'output_exists', 'total_bp_count', 'total_canonical_bp_count',
+        'abnormal_pair_count', 'dup_canonical_pair_count'
+    ])
     
-    processed_count = len(results)
+    processed_count = len(chains)
     
-    # 解析成功の判定（DSSRはoutput_exists、RNAViewはtotal_bp_countフィールドの存在）
-    if results and 'output_exists' in results[0]:
-        successful = [r for r in results if r.get('output_exists', False)]
-    else:
-        successful = [r for r in results if 'total_bp_count' in r]
+    # 解析成功の判定（output_exists）
+    successful = chains[chains['output_exists'].fillna(False).astype(bool)]
     
-    chains_with_bp = [r for r in results if r.get('total_bp_count', 0) > 0]
+    chains_with_bp = chains[chains['total_bp_count'].fillna(0) > 0]
     
     # 統計計算
-    if chains_with_bp:
-        bp_counts = [r['total_bp_count'] for r in chains_with_bp]
-        canonical_counts = [r.get('total_canonical_bp_count', 0) for r in chains_with_bp]
-        avg_bp = sum(bp_counts) / len(bp_counts)
-        avg_canonical = sum(canonical_counts) / len(canonical_counts)
-        max_bp = max(bp_counts)
-        min_bp = min(bp_counts)
+    if len(chains_with_bp):
+        bp_counts = chains_with_bp['total_bp_count']
+        canonical_counts = chains_with_bp['total_canonical_bp_count'].fillna(0)
+        avg_bp = bp_counts.mean()
+        avg_canonical = canonical_counts.mean()
+        max_bp = int(bp_counts.max())
+        min_bp = int(bp_counts.min())
     else:
         avg_bp = avg_canonical = max_bp = min_bp = 0
     
     # 異常ペア統計
-    abnormal_chains = len([r for r in results if r.get('abnormal_pairs', [])])
-    chains_with_dup_canonical = len([r for r in results if r.get('dup_canonical_pairs', [])])
-    total_abnormal = sum(len(r.get('abnormal_pairs', [])) for r in results)
-    total_dup_canonical = sum(len(r.get('dup_canonical_pairs', [])) for r in results)
+    abnormal_chains = int((chains['abnormal_pair_count'] > 0).sum())
+    chains_with_dup_canonical = int((chains['dup_canonical_pair_count'] > 0).sum())
+    total_abnormal = int(chains['abnormal_pair_count'].sum())
+    total_dup_canonical = int(chains['dup_canonical_pair_count'].sum())
     
     retention_rate = len(chains_with_bp) / initial_count * 100
     
@@ -63,7 +65,7 @@ def main():
     """メイン分析関数"""
     # 初期データ
     dataset_dir = Path("analysis/datasets/BGSU__M__All__A__4_0__pdb_3_396")
-    initial_count = len(list(dataset_dir.glob("*.pdb")))
+    initial_count = len(list(dataset_dir.glob("*.pdb"))) + len(list(dataset_dir.glob("*.pdb.gz")))
     
     print("=" * 80)
     print("BGSU__M__All__A__4_0__pdb_3_396 統合フィルタリング分析")
@@ -71,19 +73,22 @@ def main():
     print(f"初期PDBファイル数: {initial_count}")
     print()
     
-    # 解析対象ファイル
+    # 解析対象ファイル（拡張子なし: .jsonl / .npz / .parquet / 旧形式 .json を探す）
     analysis_files = [
-        ("analysis/pseudoknot_analysis_dssr_all.json", "DSSR (All)"),
-        ("analysis/pseudoknot_analysis_dssr_canonical_only.json", "DSSR (Canonical Only)"),
-        ("analysis/pseudoknot_analysis_rnaview_all.json", "RNAView (All)"),
-        ("analysis/pseudoknot_analysis_rnaview_canonical_only.json", "RNAView (Canonical Only)")
+        ("analysis/pseudoknot_analysis_dssr_all", "DSSR (All)"),
+        ("analysis/pseudoknot_analysis_dssr_canonical_only", "DSSR (Canonical Only)"),
+        ("analysis/pseudoknot_analysis_rnaview_all", "RNAView (All)"),
+        ("analysis/pseudoknot_analysis_rnaview_canonical_only", "RNAView (Canonical Only)")
     ]
     
     results = []
-    for json_file, description in analysis_files:
-        if Path(json_file).exists():
-            result = analyze_parser_results(json_file, description, initial_count)
-            results.append(result)
+    for result_stem, description in analysis_files:
+        try:
+            result_file = find_results(result_stem)
+        except FileNotFoundError:
+            continue
+        result = analyze_parser_results(result_file, description, initial_count)
+        results.append(result)
     
     # 結果表示
     df_data = []
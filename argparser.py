@@ -1,8 +1,18 @@
 import argparse
 
+LOG_LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR')
+
+
+def add_log_level_argument(parser, default='INFO'):
+    """--log-level（DEBUG で構造ごとの詳細、WARNING 以上で要約も出さない）"""
+    parser.add_argument(
+        '--log-level', type=str.upper, choices=LOG_LEVELS, default=default,
+        help=f'Logging level of the pipeline messages (default: {default}). DEBUG shows per-structure details'
+    )
+
 def argparser():
     parser = argparse.ArgumentParser(description='Visualize pseudoknots in RNA structure')
-    parser.add_argument('-i', '--input', type=str, required=True, help='Input file containing RNA structure')
+    parser.add_argument('-i', '--input', type=str, required=True, help='Input file containing RNA structure (.pdb/.cif, optionally gzip-compressed .gz)')
     parser.add_argument('-o', '--output', type=str, required=True, help='Output script file for visualization')
     parser.add_argument(
         '-f', '--format', choices=['chimera', 'pymol'], 
@@ -16,17 +26,24 @@ def argparser():
 
     parser.add_argument('-c', '--chain', type=str, default='A', help='Chain ID for RNA structure, default is A')
     parser.add_argument(
-        '-a', '--annotator', choices=['DSSR', 'RNAView'],
-        default='RNAView', help='Base-pair annotator to use (DSSR or RNAView), default is RNAView'
+        '-a', '--annotator', choices=['DSSR', 'RNAView', 'both'],
+        default='RNAView', help='Base-pair annotator to use (DSSR or RNAView), default is RNAView. '
+                                '"both" runs DSSR and RNAView concurrently and reports their agreement'
     )
     parser.add_argument(
         '--include-all', action='store_true', default=False,
         help='Include all base pairs (canonical + non-canonical). Default: canonical only'
     )
+    parser.add_argument(
+        '--both-variants', action='store_true', default=False,
+        help='Run the annotator once and write both the canonical-only and the include-all script '
+             '(<output>.canonical_only<ext> and <output>.all<ext>)'
+    )
     # Hidden legacy options for backward compatibility (do not show in --help)
     parser.add_argument('-p', dest='annotator', choices=['DSSR', 'RNAView'], help=argparse.SUPPRESS)
     parser.add_argument('--parser', dest='annotator', choices=['DSSR', 'RNAView'], help=argparse.SUPPRESS)
 
+    add_log_level_argument(parser, default='INFO')
     return parser.parse_args()
 
 def args_validation(args):
@@ -38,6 +55,291 @@ def args_validation(args):
         raise ValueError("Model ID is required for Chimera format")
     
     chosen = getattr(args, 'annotator', None)
-    if chosen is None or chosen.upper() not in ['DSSR', 'RNAVIEW']:
-        raise ValueError("Annotator must be either 'DSSR' or 'RNAView'")
+    if chosen is None or chosen.upper() not in ['DSSR', 'RNAVIEW', 'BOTH']:
+        raise ValueError("Annotator must be 'DSSR', 'RNAView' or 'both'")
     return
+
+
+def batch_argparser(argv=None):
+    """
+    `CLI_PseudoknotVisualizer.py batch ...` 用のパーサー。
+    manifest (analysis/datasets/pdbid_chains.csv と同じレイアウト) の全チェーンをプロセスプールで処理する。
+    """
+    parser = argparse.ArgumentParser(
+        prog='CLI_PseudoknotVisualizer.py batch',
+        description='Decompose every chain listed in a manifest using a process pool'
+    )
+    parser.add_argument(
+        'manifest', type=str,
+        help='Manifest CSV: "<pdb_id>,<model>,<chains>,<extra>" per line, chains joined by "-" (e.g. 1J7T,1,A-B,)'
+    )
+    parser.add_argument(
+        '-d', '--structures-dir', type=str, required=True,
+        help='Directory containing the structure files (.pdb/.cif, optionally .gz)'
+    )
+    parser.add_argument(
+        '-a', '--annotator', choices=['DSSR', 'RNAView', 'both'],
+        default='RNAView', help='Base-pair annotator to use (DSSR or RNAView), default is RNAView. '
+                                '"both" runs DSSR and RNAView concurrently and reports their agreement'
+    )
+    parser.add_argument(
+        '--include-all', action='store_true', default=False,
+        help='Include all base pairs (canonical + non-canonical). Default: canonical only'
+    )
+    parser.add_argument(
+        '-j', '--processes', type=int, default=None,
+        help='Number of worker processes (default: number of CPU cores)'
+    )
+    parser.add_argument(
+        '-r', '--results', type=str, default='batch_results.jsonl',
+        help='Results file; one JSON record per chain is appended as soon as it completes (default: batch_results.jsonl)'
+    )
+    parser.add_argument(
+        '-f', '--format', choices=['chimera', 'pymol'], default=None,
+        help='Also write a coloring script per chain in this format (requires --output-dir)'
+    )
+    parser.add_argument('-o', '--output-dir', type=str, default=None, help='Directory for coloring scripts')
+    parser.add_argument('-m', '--model', type=int, default=None, help='Model ID (required if Chimera format is selected)')
+
+    # 失敗の切り離し（1 つの異常な入力で全体を止めない）
+    parser.add_argument(
+        '--annotator-timeout', type=float, default=None,
+        help='Seconds before an annotator run is killed (default: ANNOTATOR_TIMEOUT in config.py)'
+    )
+    parser.add_argument(
+        '--dp-timeout', type=float, default=None,
+        help='Seconds allowed for the pseudoknot layer decomposition of one chain (default: PKEXTRACTOR_TIMEOUT in config.py)'
+    )
+    parser.add_argument(
+        '--memory-limit', type=int, default=None,
+        help='Address-space limit per worker in MB, inherited by the annotator it runs (default: no limit)'
+    )
+    parser.add_argument(
+        '--max-tasks-per-child', type=int, default=100,
+        help='Recycle each worker process after this many manifest entries (default: 100)'
+    )
+    parser.add_argument(
+        '--retries', type=int, default=1,
+        help='Times a failed chain is retried (after the first pass) before it is quarantined (default: 1)'
+    )
+    parser.add_argument(
+        '--quarantine', type=str, default=None,
+        help='Quarantine file for chains that kept failing (default: <results>.quarantine.jsonl). '
+             'Quarantined chains are skipped on later runs'
+    )
+    parser.add_argument(
+        '--retry-quarantined', action='store_true', default=False,
+        help='Process chains listed in the quarantine file again'
+    )
+
+    # スケジューリング（重い構造から先に、メモリ予算の範囲で）
+    parser.add_argument(
+        '--index', type=str, default=None,
+        help='Dataset index with per-file hash, chains, atom counts and last runtime '
+             '(default: <structures-dir>.index.json next to the structures directory)'
+    )
+    parser.add_argument(
+        '--memory-budget', type=int, default=None,
+        help='Estimated memory (MB) that running entries may use together; limits concurrent large structures '
+             '(default: no limit)'
+    )
+
+    parser.add_argument(
+        '--dedup', choices=['coords', 'sequence', 'off'], default='coords',
+        help='Annotate and decompose identical chains once and copy the result to the others. '
+             '"coords": same numbered sequence and same geometry (default); "sequence": same numbered sequence; '
+             '"off": process every chain'
+    )
+    parser.add_argument(
+        '--stats', type=str, default=None,
+        help='Write the per-stage timings and counters of the whole run to this file '
+             '(Prometheus text format if it ends in .prom, JSON otherwise). '
+             'Per-chain values are always stored in the "stats" field of each result record'
+    )
+
+    # 進捗（完了・失敗・実行中の件数、スループット、アノテーターの所要時間、ETA）
+    parser.add_argument(
+        '--progress', action='store_true', default=False,
+        help='Show a live status line (done/failed/running, structures/s, pairs/s, annotator latency p50/p95, ETA) '
+             'instead of one line per chain; errors are still printed'
+    )
+    parser.add_argument(
+        '--status-file', type=str, default=None,
+        help='Rewrite the same status as JSON in this file every --progress-interval seconds (for headless runs)'
+    )
+    parser.add_argument(
+        '--progress-interval', type=float, default=2.0,
+        help='Seconds between status updates (default: 2)'
+    )
+
+    # プロファイル（遅い・メモリを使う構造の cProfile / tracemalloc を残す）
+    parser.add_argument(
+        '--profile-top', type=int, default=0, metavar='K',
+        help='Run cProfile and tracemalloc for every chain and keep the profiles (.pstats) and memory snapshots '
+             '(.tracemalloc) of the K slowest and the K most memory-hungry chains (default: 0, off)'
+    )
+    parser.add_argument(
+        '--profile-dir', type=str, default=None,
+        help='Directory for the kept profiles and profiles.json (default: <results>.profiles/)'
+    )
+
+    # 複数ノードでの分散実行（共有ファイルシステム上のキュー）
+    queue_group = parser.add_argument_group(
+        'distributed mode', 'Run the same command on several nodes that share a filesystem; '
+                            'merge the results afterwards with `CLI_PseudoknotVisualizer.py merge QUEUE`'
+    )
+    queue_group.add_argument(
+        '--queue', type=str, default=None,
+        help='Queue directory on the shared filesystem. Nodes claim manifest shards through lease files and '
+             'write results under QUEUE/results/<node-id>/ (--results and --quarantine are ignored). '
+             'Each node writes its own --stats file with the node id inserted before the suffix '
+             '(stats.json -> stats.<node-id>.json) and keeps --profile-dir profiles in one subdirectory per shard'
+    )
+    queue_group.add_argument('--node-id', type=str, default=None, help='Node name (default: <hostname>-<pid>)')
+    queue_group.add_argument(
+        '--shard-size', type=int, default=16,
+        help='Manifest entries per shard, used by the first node that creates the queue (default: 16)'
+    )
+    queue_group.add_argument(
+        '--lease-timeout', type=float, default=300,
+        help='Seconds without a heartbeat after which another node takes over a shard (default: 300)'
+    )
+    queue_group.add_argument(
+        '--heartbeat', type=float, default=30,
+        help='Seconds between lease heartbeats (default: 30)'
+    )
+    queue_group.add_argument(
+        '--no-wait', action='store_true', default=False,
+        help='Exit when no shard can be claimed instead of waiting for shards held by other nodes'
+    )
+
+    add_log_level_argument(parser, default='WARNING')
+    args = parser.parse_args(argv)
+    if args.format is not None and args.output_dir is None:
+        parser.error('--format requires --output-dir')
+    if args.format == 'chimera' and args.model is None:
+        parser.error('Model ID is required for Chimera format')
+    return args
+
+
+def merge_argparser(argv=None):
+    """
+    `CLI_PseudoknotVisualizer.py merge ...` 用のパーサー。
+    分散実行 (batch --queue) の完了した shard の結果を 1 つのファイルにまとめる。
+    """
+    parser = argparse.ArgumentParser(
+        prog='CLI_PseudoknotVisualizer.py merge',
+        description='Merge the per-node results of a distributed batch run'
+    )
+    parser.add_argument('queue', type=str, help='Queue directory passed to `batch --queue`')
+    parser.add_argument(
+        '-r', '--results', type=str, default='batch_results.jsonl',
+        help='Merged results file (default: batch_results.jsonl)'
+    )
+    parser.add_argument(
+        '--quarantine', type=str, default=None,
+        help='Merged quarantine file (default: <results>.quarantine.jsonl)'
+    )
+    parser.add_argument(
+        '--partial', action='store_true', default=False,
+        help='Merge the finished shards even if some shards are not finished yet'
+    )
+    add_log_level_argument(parser, default='WARNING')
+    return parser.parse_args(argv)
+
+
+def watch_argparser(argv=None):
+    """
+    `CLI_PseudoknotVisualizer.py watch ...` 用のパーサー。
+    ディレクトリに置かれた構造ファイルを検出して処理し続ける。
+    """
+    parser = argparse.ArgumentParser(
+        prog='CLI_PseudoknotVisualizer.py watch',
+        description='Watch a directory and decompose structure files as they arrive'
+    )
+    parser.add_argument('directory', type=str, help='Directory to watch (.pdb/.cif, optionally .gz)')
+    parser.add_argument(
+        '-a', '--annotator', choices=['DSSR', 'RNAView', 'both'],
+        default='RNAView', help='Base-pair annotator to use (DSSR or RNAView), default is RNAView'
+    )
+    parser.add_argument(
+        '--include-all', action='store_true', default=False,
+        help='Include all base pairs (canonical + non-canonical). Default: canonical only'
+    )
+    parser.add_argument('-c', '--chain', type=str, default=None, help='Chain ID to process (default: every chain)')
+    parser.add_argument(
+        '-j', '--processes', type=int, default=None,
+        help='Number of worker processes (default: number of CPU cores)'
+    )
+    parser.add_argument(
+        '-r', '--results', type=str, default=None,
+        help='Results file; one JSON record per chain is appended (default: <output-dir or directory>/pkv_watch_results.jsonl)'
+    )
+    parser.add_argument(
+        '-f', '--format', choices=['chimera', 'pymol'], default=None,
+        help='Also write a coloring script per chain in this format (requires --output-dir)'
+    )
+    parser.add_argument('-o', '--output-dir', type=str, default=None, help='Directory for coloring scripts')
+    parser.add_argument('-m', '--model', type=int, default=None, help='Model ID (required if Chimera format is selected)')
+    parser.add_argument(
+        '--state', type=str, default=None,
+        help='File recording processed files so they are not processed again after a restart '
+             '(default: <directory>/.pkv_watch_state.json)'
+    )
+    parser.add_argument('--interval', type=float, default=1.0, help='Seconds between directory polls (default: 1)')
+    parser.add_argument(
+        '--settle', type=float, default=2.0,
+        help='A file is processed once its size and mtime have not changed for this many seconds (default: 2)'
+    )
+    parser.add_argument('--once', action='store_true', default=False,
+                        help='Process the files present now and exit instead of watching')
+    parser.add_argument('--annotator-timeout', type=float, default=None,
+                        help='Seconds before an annotator run is killed (default: ANNOTATOR_TIMEOUT in config.py)')
+    parser.add_argument('--dp-timeout', type=float, default=None,
+                        help='Seconds allowed for the layer decomposition of one chain (default: PKEXTRACTOR_TIMEOUT in config.py)')
+    parser.add_argument('--memory-limit', type=int, default=None,
+                        help='Address-space limit per worker in MB (default: no limit)')
+    parser.add_argument('--max-tasks-per-child', type=int, default=100,
+                        help='Recycle each worker process after this many files (default: 100)')
+
+    add_log_level_argument(parser, default='WARNING')
+    args = parser.parse_args(argv)
+    if args.format is not None and args.output_dir is None:
+        parser.error('--format requires --output-dir')
+    if args.format == 'chimera' and args.model is None:
+        parser.error('Model ID is required for Chimera format')
+    return args
+
+
+def serve_argparser(argv=None):
+    """
+    `CLI_PseudoknotVisualizer.py serve ...` 用のパーサー。
+    常駐して解析リクエストを localhost の HTTP または Unix ソケットで受け付ける。
+    """
+    parser = argparse.ArgumentParser(
+        prog='CLI_PseudoknotVisualizer.py serve',
+        description='Run a long-lived local decomposition service (JSON over HTTP on localhost or a Unix socket)'
+    )
+    listen = parser.add_mutually_exclusive_group()
+    listen.add_argument('--port', type=int, default=8765, help='TCP port on --host (default: 8765)')
+    listen.add_argument('--socket', type=str, default=None, help='Listen on this Unix socket path instead of TCP')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Address to bind (default: 127.0.0.1)')
+    parser.add_argument(
+        '-j', '--processes', type=int, default=None,
+        help='Number of worker processes (default: number of CPU cores)'
+    )
+    parser.add_argument(
+        '--max-pending', type=int, default=None,
+        help='Requests accepted at once (running + queued); further requests get HTTP 503 (default: 4 x processes)'
+    )
+    parser.add_argument('--cache-size', type=int, default=256,
+                        help='Number of results kept in the in-memory cache (0 disables it, default: 256)')
+    parser.add_argument('--annotator-timeout', type=float, default=None,
+                        help='Seconds before an annotator run is killed (default: ANNOTATOR_TIMEOUT in config.py)')
+    parser.add_argument('--dp-timeout', type=float, default=None,
+                        help='Seconds allowed for the layer decomposition of one chain (default: PKEXTRACTOR_TIMEOUT in config.py)')
+    parser.add_argument('--memory-limit', type=int, default=None,
+                        help='Address-space limit per worker in MB (default: no limit)')
+    parser.add_argument('-v', '--verbose', action='store_true', default=False, help='Log every request')
+    add_log_level_argument(parser, default='WARNING')
+    return parser.parse_args(argv)
@@ -0,0 +1,225 @@
+"""
+asyncio API
+
+asyncio のサービスに組み込む場合、CLI の関数は subprocess.run（アノテーター）と PKextractor（CPU を使う DP）で
+イベントループを止めてしまう。ここではアノテーターを asyncio のサブプロセスとして起動し、
+構造ファイルの読み書きはスレッド、layer 分解はプロセスプールに回す。
+
+    analyzer = AsyncAnalyzer(max_workers=8)
+    results = await asyncio.gather(*(analyzer.analyze_chain(path, "A", annotator="DSSR") for path in paths))
+    analyzer.close()
+
+    # 既定の AsyncAnalyzer を使う簡易版
+    result = await analyze_chain("1kpd.cif", "A", annotator="DSSR")
+
+- アノテーターのサブプロセスと layer 分解は 1 つの semaphore (max_workers 個、既定: CPU コア数) を
+  分け合う（数百件を同時に await しても、CPU を使う処理は合わせて max_workers 個まで。
+  残りはイベントループ上で待つだけで CPU を取り合わない）
+- 作業ディレクトリの作成・削除と構造ファイルの読み書きはスレッドで行う
+- 結果の dict とタイムアウト・失敗時の例外は CLI の analyze_chain と同じ
+  （アノテーターのタイムアウトは subprocess.TimeoutExpired、異常終了は subprocess.CalledProcessError）
+"""
+
+import asyncio
+import contextlib
+import pathlib
+import subprocess
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import cpu_count
+
+import CLI_PseudoknotVisualizer as cli
+from addressDSSROutput import load_dssr_data
+from addressRNAviewOutput import load_rnaview_data
+from config import RNAVIEW_DIR
+from instrumentation import stage
+from structure_io import restore_chain_id, structure_stem
+from workdir import annotator_input, annotator_workdir
+
+
+async def run_subprocess(argv, cwd, timeout=None, env=None, pass_fds=()):
+    """
+    asyncio のサブプロセスとしてコマンドを実行する。
+    timeout 秒を超えたら kill して subprocess.TimeoutExpired、0 以外で終了したら
+    subprocess.CalledProcessError を送出する（subprocess.run(check=True, timeout=...) と同じ）。
+
+    Returns:
+        tuple: (stdout, stderr) の文字列
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *argv, cwd=cwd, env=env, pass_fds=pass_fds,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        raise subprocess.TimeoutExpired(argv, timeout)
+    except asyncio.CancelledError:
+        # 呼び出し側がキャンセルした場合もアノテーターを残さない
+        proc.kill()
+        await proc.wait()
+        raise
+    stdout, stderr = stdout.decode(errors="replace"), stderr.decode(errors="replace")
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, argv, stdout, stderr)
+    return stdout, stderr
+
+
+def _decompose_chain(pdb_file, chain_id, annotator, include_all, raw_df, dp_timeout):
+    """layer 分解のプロセスで実行する（戻り値は chain_result の dict）"""
+    decomposed = cli.decompose_variants(raw_df, annotator, (include_all,), timeout=dp_timeout)
+    return cli.chain_result(pdb_file, chain_id, annotator, include_all, *decomposed[include_all])
+
+
+@contextlib.asynccontextmanager
+async def _annotator_workdir(prefix):
+    """annotator_workdir の作成（mkdtemp）と削除（rmtree）をスレッドで行う版"""
+    workdir = annotator_workdir(prefix)
+    path = await asyncio.to_thread(workdir.__enter__)
+    try:
+        yield path
+    except BaseException as e:
+        if not await asyncio.to_thread(workdir.__exit__, type(e), e, e.__traceback__):
+            raise
+    else:
+        await asyncio.to_thread(workdir.__exit__, None, None, None)
+
+
+class AsyncAnalyzer:
+    """
+    CPU を使う処理（アノテーターと layer 分解）の同時実行数と、layer 分解のプロセスプールを持つ。
+    1 つのイベントループの中で使い回す（close() か async with で後片付けする）。
+
+    Args:
+        max_workers (int): アノテーターと layer 分解を合わせて同時に実行する数（既定: CPU コア数）
+        max_annotators (int): そのうちアノテーターに使える数（既定: max_workers）
+        dp_workers (int): layer 分解のプロセス数（既定: max_workers）
+        dp_executor (concurrent.futures.Executor): layer 分解に使う executor を外から渡す場合
+        annotator_timeout, dp_timeout (float): 時間上限（秒、既定は無制限）
+    """
+
+    def __init__(self, max_workers=None, max_annotators=None, dp_workers=None, dp_executor=None,
+                 annotator_timeout=None, dp_timeout=None):
+        self.max_workers = max_workers or cpu_count()
+        self.max_annotators = min(max_annotators or self.max_workers, self.max_workers)
+        self.annotator_timeout = annotator_timeout
+        self.dp_timeout = dp_timeout
+        self._dp_workers = dp_workers or self.max_workers
+        self._executor = dp_executor
+        self._owns_executor = dp_executor is None
+        self._cpu_slots = asyncio.Semaphore(self.max_workers)
+        self._annotator_slots = asyncio.Semaphore(self.max_annotators)
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self._dp_workers)
+        return self._executor
+
+    def close(self):
+        if self._owns_executor and self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await asyncio.to_thread(self.close)
+
+    async def _rnaview(self, struct_file, chain_id, chain_table):
+        async with _annotator_workdir("rnaview") as workdir:
+            export = await asyncio.to_thread(
+                cli._export_for, struct_file, chain_id,
+                workdir / f"{structure_stem(struct_file)}_chain_{chain_id}", "RNAView", chain_table,
+            )
+            with stage("annotator"):
+                await run_subprocess(cli.rnaview_command(export.path), workdir, self.annotator_timeout,
+                                     env={"RNAVIEW": str(RNAVIEW_DIR)})
+            df = await asyncio.to_thread(load_rnaview_data, str(workdir / (export.path.name + ".out")))
+        return restore_chain_id(df, export, chain_id)
+
+    async def _dssr(self, struct_file, chain_id, chain_table):
+        stem = f"{structure_stem(struct_file)}_chain_{chain_id}"
+        async with _annotator_workdir("dssr") as workdir:
+            json_output_path = workdir / f"{stem}.cif.dssr.json"
+            with annotator_input(workdir, "DSSR") as (input_path, pass_fds):
+                export = await asyncio.to_thread(
+                    cli._export_for, struct_file, chain_id, workdir / stem, "DSSR", chain_table, input_path,
+                )
+                with stage("annotator"):
+                    await run_subprocess(cli.dssr_command(export.path, json_output_path), workdir,
+                                         self.annotator_timeout, pass_fds=pass_fds)
+            df = await asyncio.to_thread(load_dssr_data, str(json_output_path))
+        return restore_chain_id(df, export, chain_id)
+
+    async def annotate_chain(self, pdb_file, chain_id, annotator="RNAView", chain_table=None):
+        """アノテーターを実行し、対象チェーン内の塩基対 (raw_df) を返す（CLI の annotate_chain と同じ）"""
+        if annotator.upper() == "DSSR":
+            run = self._dssr
+        elif annotator.upper() == "RNAVIEW":
+            run = self._rnaview
+        else:
+            raise ValueError(f"Unsupported annotator: {annotator}. Use 'DSSR', 'RNAView' or 'both'.")
+        async with self._annotator_slots, self._cpu_slots:
+            raw_df = await run(pathlib.Path(pdb_file), chain_id, chain_table)
+        return cli.filter_chain_pairs(raw_df, chain_id)
+
+    async def decompose(self, pdb_file, chain_id, annotator, include_all, raw_df):
+        """layer 分解をプロセスプールで実行し、chain_result の dict を返す"""
+        loop = asyncio.get_running_loop()
+        async with self._cpu_slots:
+            return await loop.run_in_executor(
+                self.executor, _decompose_chain, pdb_file, chain_id, annotator, include_all, raw_df, self.dp_timeout,
+            )
+
+    async def analyze_chain(self, pdb_file, chain_id, annotator="RNAView", include_all=False):
+        """
+        1 本のチェーンについて annotate → filter → decompose を行い、CLI の analyze_chain と同じ dict を返す。
+        annotator="both" の場合は両方のアノテーターを同時に実行する。
+        """
+        if annotator.lower() != "both":
+            raw_df = await self.annotate_chain(pdb_file, chain_id, annotator)
+            return await self.decompose(pdb_file, chain_id, annotator, include_all, raw_df)
+
+        chain_table = await asyncio.to_thread(cli.read_chain_table, pdb_file, chain_id)
+        loop = asyncio.get_running_loop()
+
+        async def run(name):
+            start = loop.time()
+            raw_df = await self.annotate_chain(pdb_file, chain_id, name, chain_table)
+            elapsed = round(loop.time() - start, 4)
+            return await self.decompose(pdb_file, chain_id, name, include_all, raw_df), elapsed
+
+        start = loop.time()
+        results = await asyncio.gather(*(run(name) for name in cli.JOINT_ANNOTATORS))
+        per_annotator = {name: result for name, (result, _) in zip(cli.JOINT_ANNOTATORS, results)}
+        elapsed = {name: sec for name, (_, sec) in zip(cli.JOINT_ANNOTATORS, results)}
+        elapsed["wall"] = round(loop.time() - start, 4)
+        return {
+            "pdb_id": structure_stem(pdb_file),
+            "input": str(pdb_file),
+            "chain_id": chain_id,
+            "annotator": "both",
+            "include_all": include_all,
+            "annotators": per_annotator,
+            "agreement": cli.pair_agreement(per_annotator),
+            "annotator_elapsed_sec": elapsed,
+        }
+
+
+_DEFAULT = weakref.WeakKeyDictionary()  # event loop -> AsyncAnalyzer
+
+
+async def analyze_chain(pdb_file, chain_id, annotator="RNAView", include_all=False):
+    """
+    イベントループごとに 1 つ作る既定の AsyncAnalyzer で analyze_chain を実行する。
+    同時実行数などを指定する場合は AsyncAnalyzer を直接使う。
+    """
+    loop = asyncio.get_running_loop()
+    analyzer = _DEFAULT.get(loop)
+    if analyzer is None:
+        analyzer = _DEFAULT[loop] = AsyncAnalyzer()
+    return await analyzer.analyze_chain(pdb_file, chain_id, annotator, include_all)
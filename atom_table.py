@@ -0,0 +1,376 @@
+"""
+Columnar atom table
+
+PDB (固定カラム) と mmCIF (_atom_site) を NumPy の struct-of-arrays に一度だけ読み込む軽量リーダー。
+チェーン一覧、残基番号チェック、チェーン切り出しなど、座標・チェーンID・残基番号・残基名だけが
+必要な処理のために、Biopython のオブジェクトモデルや PyMOL の get_model を経由せずに済ませる。
+
+    table = read_atom_table("test/1KPD.pdb")
+    table.chain_ids()                       # ['A']
+    sub = table.select(chain="A", resi_range=(1, 10))
+"""
+
+import re
+
+import numpy as np
+
+from structure_io import open_structure, structure_format
+
+# 1 行 80 カラムの PDB 座標レコード
+_PDB_LINE_WIDTH = 80
+_CIF_TOKEN = re.compile(r"""'(?:[^']|'(?!\s|$))*'(?=\s|$)|"(?:[^"]|"(?!\s|$))*"(?=\s|$)|\S+""")
+_CIF_NULLS = (".", "?")
+
+
+class AtomTable:
+    """
+    原子ごとの列を NumPy 配列で保持するテーブル。
+
+    Attributes:
+        model (int32), is_hetatm (bool), serial (int64), atom_name (U4+), alt_loc (U1+),
+        res_name (U3+), chain_id (U4+, mmCIF の複数文字チェーンも可), res_seq (int64),
+        ins_code (U1+), coords (float32, shape=(N, 3)), element (U2+)
+        records: PDB 由来の場合は元の ATOM/HETATM 行 (S80)。切り出し時にそのまま書き戻せる。
+    """
+
+    COLUMNS = ("model", "is_hetatm", "serial", "atom_name", "alt_loc", "res_name",
+               "chain_id", "res_seq", "ins_code", "coords", "element")
+
+    def __init__(self, model, is_hetatm, serial, atom_name, alt_loc, res_name,
+                 chain_id, res_seq, ins_code, coords, element, records=None):
+        self.model = model
+        self.is_hetatm = is_hetatm
+        self.serial = serial
+        self.atom_name = atom_name
+        self.alt_loc = alt_loc
+        self.res_name = res_name
+        self.chain_id = chain_id
+        self.res_seq = res_seq
+        self.ins_code = ins_code
+        self.coords = coords
+        self.element = element
+        self.records = records
+
+    def __len__(self):
+        return len(self.serial)
+
+    def __repr__(self):
+        return f"AtomTable(atoms={len(self)}, models={len(self.models())}, chains={self.chain_ids()})"
+
+    # ---------------- selection ----------------
+    def models(self):
+        """モデル番号をファイル中の出現順で返す"""
+        if len(self) == 0:
+            return []
+        _, first = np.unique(self.model, return_index=True)
+        return [int(m) for m in self.model[np.sort(first)]]
+
+    def first_model(self):
+        models = self.models()
+        return models[0] if models else None
+
+    def mask(self, chain=None, model=None, resi_range=None):
+        """
+        条件に合う原子の boolean mask を返す。
+
+        Args:
+            chain (str | Iterable[str] | None): チェーンID（複数指定可）
+            model (int | None): モデル番号
+            resi_range (tuple[int, int] | None): 残基番号の閉区間 (start, end)
+        """
+        m = np.ones(len(self), dtype=bool)
+        if chain is not None:
+            if isinstance(chain, str):
+                m &= self.chain_id == chain
+            else:
+                m &= np.isin(self.chain_id, list(chain))
+        if model is not None:
+            m &= self.model == model
+        if resi_range is not None:
+            start, end = resi_range
+            m &= (self.res_seq >= start) & (self.res_seq <= end)
+        return m
+
+    def select(self, mask=None, **criteria):
+        """mask（または mask() と同じキーワード条件）で絞り込んだ新しいテーブルを返す"""
+        if mask is None:
+            mask = self.mask(**criteria)
+        return AtomTable(
+            *(getattr(self, name)[mask] for name in self.COLUMNS),
+            records=None if self.records is None else self.records[mask],
+        )
+
+    # ---------------- summaries ----------------
+    def chain_ids(self, model="first"):
+        """
+        チェーンIDのソート済みリスト。既定では最初のモデルのみを対象にする
+        （model=None で全モデル）。
+        """
+        if model == "first":
+            model = self.first_model()
+        table = self if model is None else self.select(model=model)
+        return sorted(set(table.chain_id.tolist()))
+
+    def residue_index(self):
+        """
+        残基ごとの先頭原子インデックスを返す。
+        連続する (model, chain, res_seq, ins_code) が同じ原子を 1 残基とみなす。
+        """
+        if len(self) == 0:
+            return np.zeros(0, dtype=np.int64)
+        change = np.ones(len(self), dtype=bool)
+        change[1:] = (
+            (self.model[1:] != self.model[:-1])
+            | (self.chain_id[1:] != self.chain_id[:-1])
+            | (self.res_seq[1:] != self.res_seq[:-1])
+            | (self.ins_code[1:] != self.ins_code[:-1])
+        )
+        return np.flatnonzero(change)
+
+    def residue_numbers(self):
+        """ユニークな残基番号（昇順）"""
+        return np.unique(self.res_seq)
+
+    def residue_count(self):
+        return len(self.residue_index())
+
+    def sequence(self):
+        """残基名を残基順に並べた配列（チェーン・モデルは事前に select で絞ること）"""
+        return self.res_name[self.residue_index()]
+
+
+# ---------------- PDB ----------------
+def _pdb_column(block, start, end):
+    """(N, 80) uint8 ブロックから [start, end) カラムを固定長 bytes 配列として取り出す"""
+    return np.ascontiguousarray(block[:, start:end]).view(f"S{end - start}").ravel()
+
+
+def _pdb_str(block, start, end):
+    return np.char.strip(_pdb_column(block, start, end)).astype(str)
+
+
+def _pdb_number(block, start, end, dtype):
+    col = np.char.strip(_pdb_column(block, start, end))
+    out = np.zeros(len(col), dtype=dtype)
+    ok = col != b""
+    if ok.any():
+        out[ok] = col[ok].astype(dtype)
+    return out
+
+
+def parse_pdb_lines(lines):
+    """
+    PDB 形式の行イテレータから AtomTable を作る。
+    MODEL レコードがあればモデル番号を割り当て、ない場合は全原子をモデル 1 とする。
+    """
+    records = []
+    models = []
+    current_model = 1
+    for line in lines:
+        if line.startswith(("ATOM  ", "HETATM")):
+            records.append(line.rstrip("\r\n").ljust(_PDB_LINE_WIDTH)[:_PDB_LINE_WIDTH])
+            models.append(current_model)
+        elif line.startswith("MODEL"):
+            try:
+                current_model = int(line[10:14])
+            except ValueError:
+                current_model += 1
+    raw = np.array(records, dtype=f"S{_PDB_LINE_WIDTH}")
+    block = raw.view(np.uint8).reshape(len(raw), _PDB_LINE_WIDTH)
+
+    coords = np.empty((len(raw), 3), dtype=np.float32)
+    coords[:, 0] = _pdb_number(block, 30, 38, np.float64)
+    coords[:, 1] = _pdb_number(block, 38, 46, np.float64)
+    coords[:, 2] = _pdb_number(block, 46, 54, np.float64)
+    return AtomTable(
+        model=np.array(models, dtype=np.int32),
+        is_hetatm=_pdb_column(block, 0, 6) == b"HETATM",
+        serial=_pdb_number(block, 6, 11, np.int64),
+        atom_name=_pdb_str(block, 12, 16),
+        alt_loc=_pdb_str(block, 16, 17),
+        res_name=_pdb_str(block, 17, 20),
+        chain_id=_pdb_str(block, 21, 22),
+        res_seq=_pdb_number(block, 22, 26, np.int64),
+        ins_code=_pdb_str(block, 26, 27),
+        coords=coords,
+        element=_pdb_str(block, 76, 78),
+        records=raw,
+    )
+
+
+# ---------------- mmCIF ----------------
+def _cif_tokens(line):
+    if "'" not in line and '"' not in line:
+        return line.split()
+    return [tok[1:-1] if tok[:1] in ("'", '"') else tok for tok in _CIF_TOKEN.findall(line)]
+
+
+def _cif_atom_site_rows(lines):
+    """_atom_site の loop から (ヘッダー名リスト, トークン行リスト) を返す"""
+    headers = []
+    tokens = []
+    in_loop = False
+    for line in lines:
+        stripped = line.strip()
+        if not in_loop:
+            if stripped.startswith("_atom_site."):
+                headers.append(stripped.split()[0][len("_atom_site."):])
+                in_loop = True
+            continue
+        if stripped.startswith("_atom_site."):
+            headers.append(stripped.split()[0][len("_atom_site."):])
+            continue
+        if not stripped or stripped.startswith("#"):
+            if tokens:
+                break
+            continue
+        if stripped.startswith(("loop_", "_", "data_")):
+            break
+        tokens.extend(_cif_tokens(stripped))
+    ncols = len(headers)
+    if ncols == 0:
+        return headers, []
+    if len(tokens) % ncols != 0:
+        raise ValueError("Malformed _atom_site loop in mmCIF input")
+    return headers, [tokens[i:i + ncols] for i in range(0, len(tokens), ncols)]
+
+
+def parse_cif_lines(lines):
+    """
+    mmCIF の _atom_site loop から AtomTable を作る。
+    Biopython の MMCIFParser と同様に auth_asym_id / auth_seq_id を優先し、無ければ label_* を使う。
+    """
+    headers, rows = _cif_atom_site_rows(lines)
+    cols = {name: idx for idx, name in enumerate(headers)}
+    n = len(rows)
+    columns = list(zip(*rows)) if rows else [() for _ in headers]
+
+    def col(*names, default=""):
+        for name in names:
+            if name in cols:
+                return np.array([v if v not in _CIF_NULLS else default for v in columns[cols[name]]], dtype=str) if n else np.zeros(0, dtype=str)
+        return np.full(n, default, dtype=str)
+
+    def num(dtype, *names, default=0):
+        values = col(*names, default=str(default))
+        return values.astype(dtype) if n else np.zeros(0, dtype=dtype)
+
+    coords = np.empty((n, 3), dtype=np.float32)
+    coords[:, 0] = num(np.float64, "Cartn_x")
+    coords[:, 1] = num(np.float64, "Cartn_y")
+    coords[:, 2] = num(np.float64, "Cartn_z")
+    return AtomTable(
+        model=num(np.int32, "pdbx_PDB_model_num", default=1),
+        is_hetatm=col("group_PDB") == "HETATM",
+        serial=num(np.int64, "id"),
+        atom_name=col("auth_atom_id", "label_atom_id"),
+        alt_loc=col("label_alt_id"),
+        res_name=col("auth_comp_id", "label_comp_id"),
+        chain_id=col("auth_asym_id", "label_asym_id"),
+        res_seq=num(np.int64, "auth_seq_id", "label_seq_id"),
+        ins_code=col("pdbx_PDB_ins_code"),
+        coords=coords,
+        element=col("type_symbol"),
+    )
+
+
+def parse_atom_table_text(text, fmt):
+    """文字列（例: PyMOL の cmd.get_str の出力）から AtomTable を作る"""
+    lines = text.splitlines()
+    return parse_cif_lines(lines) if fmt == "cif" else parse_pdb_lines(lines)
+
+
+def read_atom_table(struct_file):
+    """
+    構造ファイル (.pdb / .cif / .mmcif、.gz 可) を AtomTable として読み込む。
+    """
+    fmt = structure_format(struct_file)
+    with open_structure(struct_file) as handle:
+        if fmt == "cif":
+            return parse_cif_lines(handle)
+        return parse_pdb_lines(handle)
+
+
+# ---------------- writers ----------------
+def _format_pdb_atom_name(name, element):
+    # 元素記号が 1 文字で 4 文字未満の原子名は 14 カラム目から始める (PDB 慣例)
+    if len(name) < 4 and len(element) <= 1:
+        return f" {name:<3}"
+    return f"{name:<4}"
+
+
+def pdb_records(table):
+    """
+    AtomTable を PDB の ATOM/HETATM 行 (str) のリストにする。
+    PDB 由来のテーブルは元の行をそのまま使い、mmCIF 由来の場合は列から整形する。
+    PDB 形式で表現できない（複数文字のチェーンID、99,999 を超える原子番号）場合は ValueError。
+    """
+    if table.records is not None:
+        return [rec.decode().rstrip() for rec in table.records.tolist()]
+    if len(table) and max(len(c) for c in set(table.chain_id.tolist())) > 1:
+        raise ValueError("Multi-character chain IDs cannot be written in PDB format")
+    if len(table) > 99999:
+        raise ValueError("More than 99,999 atoms cannot be written in PDB format")
+    lines = []
+    for idx in range(len(table)):
+        x, y, z = table.coords[idx]
+        lines.append(
+            f"{'HETATM' if table.is_hetatm[idx] else 'ATOM':<6}{idx + 1:>5} "
+            f"{_format_pdb_atom_name(table.atom_name[idx], table.element[idx])}"
+            f"{table.alt_loc[idx]:1}{table.res_name[idx]:>3} {table.chain_id[idx]:1}"
+            f"{int(table.res_seq[idx]):>4}{table.ins_code[idx]:1}   "
+            f"{x:8.3f}{y:8.3f}{z:8.3f}{1.0:6.2f}{0.0:6.2f}          {table.element[idx]:>2}"
+        )
+    return lines
+
+
+def write_pdb(table, out_path):
+    """AtomTable を PDB ファイルとして書き出す"""
+    with open(out_path, "w") as f:
+        for line in pdb_records(table):
+            f.write(line + "\n")
+        f.write("END\n")
+    return out_path
+
+
+_CIF_ATOM_SITE_FIELDS = (
+    "group_PDB", "id", "type_symbol", "label_atom_id", "label_alt_id", "label_comp_id",
+    "label_asym_id", "label_seq_id", "pdbx_PDB_ins_code", "Cartn_x", "Cartn_y", "Cartn_z",
+    "occupancy", "B_iso_or_equiv", "auth_seq_id", "auth_comp_id", "auth_asym_id",
+    "auth_atom_id", "pdbx_PDB_model_num",
+)
+
+
+def _cif_value(value, null="."):
+    if value == "":
+        return null
+    if "'" in value and '"' not in value:
+        return f'"{value}"'
+    if '"' in value or " " in value:
+        return f"'{value}'"
+    return value
+
+
+def write_cif(table, out_path, data_name="pkv"):
+    """
+    AtomTable を mmCIF (_atom_site loop) として書き出す。
+    PDB 形式の上限（原子数・1 文字チェーンID）に縛られないため、巨大な複合体や複数文字チェーンにも使える。
+    """
+    with open(out_path, "w") as f:
+        f.write(f"data_{data_name}\n#\nloop_\n")
+        for field in _CIF_ATOM_SITE_FIELDS:
+            f.write(f"_atom_site.{field}\n")
+        for idx in range(len(table)):
+            x, y, z = table.coords[idx]
+            atom = _cif_value(table.atom_name[idx])
+            resn = _cif_value(table.res_name[idx])
+            chain = _cif_value(table.chain_id[idx])
+            seq = int(table.res_seq[idx])
+            f.write(
+                f"{'HETATM' if table.is_hetatm[idx] else 'ATOM'} {idx + 1} {_cif_value(table.element[idx])} "
+                f"{atom} {_cif_value(table.alt_loc[idx])} {resn} {chain} {seq} "
+                f"{_cif_value(table.ins_code[idx], null='?')} {x:.3f} {y:.3f} {z:.3f} 1.00 0.00 "
+                f"{seq} {resn} {chain} {atom} {int(table.model[idx])}\n"
+            )
+        f.write("#\n")
+    return out_path
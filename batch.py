@@ -0,0 +1,715 @@
+"""
+Manifest-driven batch processing
+
+manifest (analysis/datasets/pdbid_chains.csv と同じレイアウト) に列挙された全チェーンを
+プロセスプールで annotate → filter → decompose し、終わったものから結果を 1 行 1 レコードで書き出す。
+
+    $ python CLI_PseudoknotVisualizer.py batch analysis/datasets/pdbid_chains.csv \
+        -d analysis/datasets/BGSU__M__All__A__4_0__pdb_3_396 -a DSSR -j 16 -r results.jsonl
+
+manifest の各行: <pdb_id>,<model>,<chains>,<extra>
+    chains は "-" 区切り (例: 1J7T,1,A-B,)。ヘッダー行 (pdb_id,...) があれば読み飛ばす。
+"""
+
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import pathlib
+import time
+import traceback
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import nullcontext
+from multiprocessing import cpu_count
+
+from analysis.dataset_index import DatasetIndex, budgeted_imap, default_index_path, longest_first
+from dedup import dedup_ratio, group_by_fingerprint
+from instrumentation import Stats, format_summary, task_stats, write_stats
+from limits import classify_failure
+from log_config import LOGGER_NAME, get_logger
+from profiling import ProfileKeeper, TaskProfiler, profile_name
+from progress import ProgressTracker, emit, init_worker_events, record_fields
+from workdir import sweep_stale_workdirs
+
+
+logger = get_logger("batch")
+
+ManifestEntry = namedtuple("ManifestEntry", ["pdb_id", "model", "chains", "extra"])
+
+STRUCTURE_SUFFIXES = (".pdb", ".pdb.gz", ".cif", ".cif.gz", ".mmcif", ".mmcif.gz")
+
+# 再試行する失敗の種類（ファイルやチェーンが見つからない等は何度やっても同じなので再試行しない）
+RETRYABLE_FAILURES = ("timeout", "memory", "annotator_failed", "crashed", "error")
+
+# ワーカーの起動方法。ProcessPoolExecutor の max_tasks_per_child は fork では使えないので spawn にする
+MP_CONTEXT = multiprocessing.get_context("spawn")
+
+# ワーカープロセスごとに一度だけ初期化される状態（_init_worker を参照）
+_WORKER = {}
+
+
+def read_manifest(manifest_path):
+    """
+    manifest CSV を読み込んで ManifestEntry のリストを返す。
+
+    Examples:
+        157D,1,A-B,  -> ManifestEntry("157D", 1, ["A", "B"], "")
+    """
+    entries = []
+    with open(manifest_path, newline="") as f:
+        for row in csv.reader(f):
+            if not row or not row[0].strip() or row[0].startswith("#"):
+                continue
+            if row[0].strip().lower() == "pdb_id":
+                continue
+            row = [field.strip() for field in row] + [""] * (4 - len(row))
+            pdb_id, model, chains, extra = row[:4]
+            entries.append(ManifestEntry(
+                pdb_id=pdb_id,
+                model=int(model) if model else 1,
+                chains=[c for c in chains.split("-") if c] if chains else [],
+                extra=extra,
+            ))
+    return entries
+
+
+def index_structure_dir(structures_dir):
+    """ディレクトリ内の構造ファイルを {ファイル名: Path} で返す（1 回の走査で済ませる）"""
+    index = {}
+    with os.scandir(structures_dir) as it:
+        for item in it:
+            if item.is_file() and item.name.lower().endswith(STRUCTURE_SUFFIXES):
+                index[item.name] = pathlib.Path(item.path)
+    return index
+
+
+def resolve_structure(entry, index):
+    """
+    manifest の 1 行に対応する構造ファイルを探す。
+
+    候補（拡張子は .pdb / .cif / .mmcif とその .gz）:
+        <pdb_id>_<model>_<chains>   (RNAsolo / BGSU の命名, 例: 1EHZ_1_A.pdb)
+        PDB_0000<pdb_id>_<model>_<chains>
+        <pdb_id>, <pdb_id 小文字>
+    """
+    chains = "-".join(entry.chains)
+    stems = [
+        f"{entry.pdb_id}_{entry.model}_{chains}",
+        f"PDB_0000{entry.pdb_id}_{entry.model}_{chains}",
+        entry.pdb_id,
+        entry.pdb_id.lower(),
+    ]
+    for stem in stems:
+        for suffix in STRUCTURE_SUFFIXES:
+            path = index.get(stem + suffix)
+            if path is not None:
+                return path
+    return None
+
+
+class WorkerPool:
+    """
+    ProcessPoolExecutor を包み、ワーカーが kill されて（OOM killer, segfault など）プールが壊れたら
+    次の submit で新しいプールに作り直す。壊れた時に実行中だったタスクの future は BrokenProcessPool で終わる
+    （multiprocessing.Pool と違い、結果が返らないまま待ち続けることがない）。
+    kill されたワーカーが残した作業ディレクトリは、作り直す時と shutdown(wait=True) の時に削除する。
+    """
+
+    def __init__(self, processes, initializer=None, initargs=(), max_tasks_per_child=None):
+        self._options = dict(max_workers=processes, mp_context=MP_CONTEXT, initializer=initializer,
+                             initargs=initargs, max_tasks_per_child=max_tasks_per_child)
+        self._executor = ProcessPoolExecutor(**self._options)
+        self.restarts = 0
+
+    def submit(self, fn, *args):
+        try:
+            return self._executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            # kill されたワーカーは作業ディレクトリを消せていない
+            sweep_stale_workdirs()
+            self._executor = ProcessPoolExecutor(**self._options)
+            self.restarts += 1
+            return self._executor.submit(fn, *args)
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self._executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+        if wait:
+            sweep_stale_workdirs()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+
+def _init_worker(annotator, include_all, fmt, output_dir, model_id, limits=None, events=None, profile_dir=None,
+                 log_level=None):
+    """
+    ワーカー初期化: パイプライン本体のモジュール（pandas / config / colors.json の読み込みを含む）を
+    プロセスごとに一度だけ import し、以降のタスクで使い回す。
+    limits["memory_mb"] があれば、このワーカー（と子プロセスのアノテーター）のメモリ上限を設定する。
+    events があれば、進捗のイベント (progress.emit) をそこに送る。
+    profile_dir があれば、チェーンごとに cProfile と tracemalloc を取ってそこに書き出す。
+    log_level があれば、メインプロセスと同じレベルでログを出す（spawn したワーカーは設定を引き継がない）。
+    """
+    import CLI_PseudoknotVisualizer as cli
+    from config import ANNOTATOR_TIMEOUT, PKEXTRACTOR_TIMEOUT
+    from limits import set_memory_limit
+    from log_config import configure_logging
+
+    if log_level:
+        configure_logging(log_level)
+    limits = limits or {}
+    set_memory_limit(limits.get("memory_mb"))
+    init_worker_events(events)
+    _WORKER.update(
+        cli=cli,
+        annotator=annotator,
+        include_all=include_all,
+        format=fmt,
+        output_dir=pathlib.Path(output_dir) if output_dir else None,
+        model_id=model_id,
+        annotator_timeout=limits.get("annotator_timeout") or ANNOTATOR_TIMEOUT,
+        dp_timeout=limits.get("dp_timeout") or PKEXTRACTOR_TIMEOUT,
+        profiler=TaskProfiler(profile_dir) if profile_dir else None,
+    )
+
+
+def _resolve_chains(requested, available):
+    """
+    manifest のチェーンをファイル中のチェーンに対応付ける。
+    RNAsolo のようにチェーンを 1 本に切り出したファイルでは ID が変わっていることがあるので、
+    見つからない場合はファイル中の唯一のチェーンを使う。
+    """
+    resolved = []
+    for chain in requested or available:
+        if chain in available:
+            actual = chain
+        elif len(available) == 1:
+            actual = available[0]
+        else:
+            actual = None
+        resolved.append((chain, actual))
+    return resolved
+
+
+def _failure(base, exc, **fields):
+    """例外から構造化された失敗レコードを作る"""
+    error_type = classify_failure(exc)
+    return dict(
+        base, status="error", error_type=error_type, error=f"{type(exc).__name__}: {exc}",
+        retryable=error_type in RETRYABLE_FAILURES,
+        traceback=traceback.format_exc(limit=-5)[-2000:], **fields,
+    )
+
+
+def _write_scripts(cli, result, structure_id, chain_id, fmt, output_dir, model_id):
+    """結果のカラーリングスクリプトを書き出し、パスを result (と annotators の各要素) の "script" に入れる"""
+    script = output_dir / f"{structure_id}_{chain_id}.{fmt}.txt"
+    # --annotator both の場合はアノテーターごとにスクリプトを書き出す
+    for name, sub in result.get("annotators", {None: result}).items():
+        sub_script = cli.annotator_output_path(script, name) if name else script
+        cli.write_coloring_script(structure_id, chain_id, sub["layers"], fmt, sub_script, model_id)
+        sub["script"] = str(sub_script)
+
+
+def _progress_key(entry):
+    return f"{entry.pdb_id}:{entry.model}:{'-'.join(entry.chains)}"
+
+
+def _run_entry(task):
+    """
+    1 行分（1 ファイル・複数チェーン）を処理し、(task, チェーンごとの結果レコードのリスト) を返す。
+    開始と終了を進捗のイベントとして送る。
+    """
+    key = _progress_key(task[0])
+    emit("start", key)
+    task, records = _analyze_entry(task)
+    emit("done", key, **record_fields(records, _WORKER["annotator"]))
+    return task, records
+
+
+def _analyze_entry(task):
+    """
+    _run_entry の本体。例外はすべてここで失敗レコードに変換し、ワーカープロセスの外には出さない。
+    """
+    entry, path, attempt = task
+    cli = _WORKER["cli"]
+    base = {"pdb_id": entry.pdb_id, "model": entry.model, "input": str(path) if path else None, "attempt": attempt}
+    if path is None:
+        return task, [dict(base, chain_id="-".join(entry.chains), requested_chain_id="-".join(entry.chains),
+                           status="error", error_type="not_found", error="structure file not found", retryable=False)]
+    try:
+        available = cli.get_chain_ids(path)
+    except Exception as e:
+        chains = "-".join(entry.chains)
+        return task, [_failure(base, e, chain_id=chains, requested_chain_id=chains)]
+
+    records = []
+    done = set()
+    for chain, actual in _resolve_chains(entry.chains, available):
+        if actual is None:
+            records.append(dict(base, chain_id=chain, requested_chain_id=chain, status="error",
+                                error_type="not_found", retryable=False,
+                                error=f"chain not found (available: {', '.join(available)})"))
+            continue
+        if actual in done:
+            continue
+        done.add(actual)
+        start = time.perf_counter()
+        profiler = _WORKER["profiler"]
+        profiling = nullcontext() if profiler is None else profiler.profile(
+            profile_name(entry.pdb_id, entry.model, actual, attempt),
+            pdb_id=entry.pdb_id, model=entry.model, chain_id=actual, input=str(path), attempt=attempt,
+        )
+        # 段階ごとの時間とカウンターをチェーン単位で集計し、レコードの "stats" に入れる
+        with task_stats() as stats, profiling as profile:
+            try:
+                result = cli.analyze_chain(path, actual, _WORKER["annotator"], _WORKER["include_all"],
+                                           annotator_timeout=_WORKER["annotator_timeout"],
+                                           dp_timeout=_WORKER["dp_timeout"])
+                if _WORKER["format"] is not None:
+                    _write_scripts(cli, result, result["pdb_id"], actual, _WORKER["format"],
+                                   _WORKER["output_dir"], _WORKER["model_id"])
+                records.append(dict(result, **base, structure_id=result["pdb_id"], requested_chain_id=chain,
+                                    status="ok", elapsed_sec=round(time.perf_counter() - start, 4),
+                                    stats=stats.snapshot()))
+            except Exception as e:
+                records.append(_failure(base, e, chain_id=actual, requested_chain_id=chain,
+                                        elapsed_sec=round(time.perf_counter() - start, 4),
+                                        stats=stats.snapshot()))
+        if profile is not None:
+            # メインプロセスが上位 K 件を選んだ後、レコードからは外す
+            records[-1]["profile"] = profile
+    return task, records
+
+
+def worker_log_level():
+    """ワーカーに引き継ぐログのレベル（メインプロセスで configure_logging していなければ None）"""
+    return logging.getLogger(LOGGER_NAME).level or None
+
+
+def _lost_entry(task, exc):
+    """
+    ワーカーごと失われたタスク（プロセスが kill された・segfault した等）を _run_entry と同じ形の失敗レコードにする。
+    全チェーンを処理するタスク (chains が空) は requested_chain_id が "" のレコード 1 件にする。
+    """
+    entry, path, attempt = task
+    base = {"pdb_id": entry.pdb_id, "model": entry.model, "input": str(path) if path else None, "attempt": attempt}
+    return task, [
+        dict(base, chain_id=chain, requested_chain_id=chain, status="error", error_type=classify_failure(exc),
+             error=f"{type(exc).__name__}: {exc}", retryable=True)
+        for chain in entry.chains or [""]
+    ]
+
+
+def _dedup_tasks(tasks, index, mode):
+    """
+    dataset index の fingerprint で同じチェーンをまとめ、代表のチェーンだけを残したタスクを返す。
+    fingerprint の無いタスク（ファイルが見つからない・読めない）はそのまま残す。
+
+    Returns:
+        tuple: (tasks, {代表の quarantine_key: [(entry, path, requested_chain, actual_chain), ...]},
+                チェーン数, ユニークなチェーン数)
+    """
+    def fingerprints(path):
+        return index.entries.get(str(path), {}).get("fingerprints", {}).get(mode) if path is not None else None
+
+    items = []
+    for n, (entry, path, _) in enumerate(tasks):
+        fps = fingerprints(path)
+        if fps:
+            items.extend((n, chain, actual) for chain, actual in _resolve_chains(entry.chains, sorted(fps)))
+        else:
+            items.append((n, None, None))
+
+    def fingerprint_of(item):
+        n, chain, actual = item
+        return None if actual is None else fingerprints(tasks[n][1])[actual]
+
+    representatives, grouped = group_by_fingerprint(items, fingerprint_of)
+    kept = {}
+    for n, chain, _ in representatives:
+        kept.setdefault(n, []).append(chain)
+    deduped = []
+    for n, (entry, path, attempt) in enumerate(tasks):
+        if n in kept:
+            chains = kept[n]
+            deduped.append((entry if chains == [None] else entry._replace(chains=chains), path, attempt))
+
+    duplicates = {}
+    for (n, chain, _), dups in grouped.items():
+        entry = tasks[n][0]
+        duplicates[quarantine_key(entry.pdb_id, entry.model, chain)] = [
+            (tasks[m][0], tasks[m][1], dup_chain, dup_actual) for m, dup_chain, dup_actual in dups
+        ]
+    n_chains = sum(1 if chain is not None else len(tasks[n][0].chains) or 1 for n, chain, _ in items)
+    n_unique = n_chains - sum(len(dups) for dups in duplicates.values())
+    return deduped, duplicates, n_chains, n_unique
+
+
+def _fan_out(record, entry, path, chain, actual):
+    """代表のチェーンの結果レコードを重複したチェーンのレコードに書き換える（チェーンIDを付け替える）"""
+    from structure_io import structure_stem
+
+    structure_id = structure_stem(path)
+    dup = dict(
+        record, pdb_id=entry.pdb_id, model=entry.model, input=str(path), chain_id=actual,
+        requested_chain_id=chain, structure_id=structure_id, elapsed_sec=0.0,
+        dedup_of={key: record.get(key) for key in ("pdb_id", "model", "chain_id", "input")},
+    )
+    dup.pop("stats", None)  # 処理したのは代表のチェーンだけ
+    if "annotators" in record:
+        dup["annotators"] = {
+            name: dict(sub, pdb_id=structure_id, input=str(path), chain_id=actual)
+            for name, sub in record["annotators"].items()
+        }
+    return dup
+
+
+def _summary(record):
+    """進捗表示用の 1 行要約（--annotator both の場合はアノテーターごとの layer 数と一致度）"""
+    if "annotators" in record:
+        layers = " ".join(f"{name}:{sub['pseudoknot_layer_count']}" for name, sub in record["annotators"].items())
+        return f"layers={layers} jaccard={record['agreement']['jaccard']}"
+    return f"layers={record['pseudoknot_layer_count']}"
+
+
+def quarantine_key(pdb_id, model, chain):
+    return f"{pdb_id}:{model}:{chain}"
+
+
+def read_quarantine(quarantine_path):
+    """quarantine ファイルに記録されたチェーンのキー集合を返す"""
+    keys = set()
+    path = pathlib.Path(quarantine_path)
+    if not path.exists():
+        return keys
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            keys.add(quarantine_key(record["pdb_id"], record["model"], record["requested_chain_id"]))
+    return keys
+
+
+def _write_record(fh, record):
+    fh.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+
+def run_batch(manifest, structures_dir, annotator="RNAView", include_all=False, processes=None,
+              results_path="batch_results.jsonl", fmt=None, output_dir=None, model_id=None,
+              annotator_timeout=None, dp_timeout=None, memory_mb=None, max_tasks_per_child=100,
+              retries=1, quarantine_path=None, retry_quarantined=False, index_path=None, memory_budget_mb=None,
+              dedup="coords", stats_path=None, progress=False, status_path=None, progress_interval=2.0,
+              profile_top=0, profile_dir=None, structure_index=None, dataset_index=None):
+    """
+    manifest の全チェーンをプロセスプールで処理し、完了したものから results_path に追記する。
+    manifest は CSV のパスか、ManifestEntry のリスト（work_queue の shard など）。
+    同じ structures_dir で何度も呼ぶ場合（work_queue.run_node）は、index_structure_dir の結果を
+    structure_index に、読み込み済みの DatasetIndex を dataset_index に渡すと呼び出しごとの走査と読み直しを省ける。
+
+    失敗の切り離し:
+        - アノテーターと layer 分解にはそれぞれ時間上限 (annotator_timeout / dp_timeout 秒) がある
+        - memory_mb を指定すると各ワーカーのアドレス空間を制限する
+        - ワーカーは max_tasks_per_child 件ごとに作り直す（メモリリークの蓄積を防ぐ）
+        - 失敗したチェーンは全体の 1 周目の後に最大 retries 回再試行し、
+          それでも失敗したものは quarantine_path に失敗レコードを書いて以降の実行では読み飛ばす
+        - ワーカーが kill された（OOM killer, segfault など）場合はプールを作り直し、その時に実行中だった
+          タスクを 1 件ずつ実行し直す。単独で実行しても落ちたタスクだけを "crashed" の失敗として再試行・隔離する
+
+    スケジューリング:
+        - dataset index (index_path, 既定は <structures_dir>.index.json) の前回の実行時間・原子数から
+          推定コストの大きい順に投入する
+        - memory_budget_mb を指定すると、推定メモリの合計がそれを超えないよう大きな構造の同時実行を制限する
+
+    重複の除去 (dedup="coords" / "sequence", "off" で無効):
+        - 同じ fingerprint のチェーン（集合体内のコピーや別エントリの同じ分子）は最初の 1 本だけを処理し、
+          その結果をチェーンIDを付け替えて他のコピーのレコードとして書き出す（dedup_of に代表を記録）
+
+    進捗 (progress / status_path):
+        - ワーカーから送られるイベントを集計し、完了・失敗・実行中の件数、構造/秒と塩基対/秒、
+          アノテーターの所要時間の p50 / p95、dataset index の推定コストによる ETA を
+          progress_interval 秒ごとに表示する（progress=True の場合。チェーンごとの ok の行は出さない）
+        - status_path を指定すると同じ内容を JSON で書き直す（端末の無い実行の監視用）
+
+    計測:
+        - 各レコードの "stats" にそのチェーンの段階ごとの時間とカウンターを入れ、最後に全体の集計を表示する
+        - stats_path を指定すると全体の集計を書き出す（.prom なら Prometheus のテキスト形式、それ以外は JSON）
+        - profile_top > 0 の場合、チェーンごとに cProfile と tracemalloc を取り、最も遅い profile_top 件と
+          最もメモリを使った profile_top 件の .pstats / .tracemalloc を profile_dir
+          (既定: <results>.profiles/) に残す（一覧は profiles.json）
+
+    Returns:
+        dict: 集計 (entries, chains_ok, chains_failed, chains_retried, chains_skipped,
+              chains_total, chains_unique, dedup_ratio, worker_restarts, elapsed_sec, stats, profiles)
+    """
+    entries = read_manifest(manifest) if isinstance(manifest, (str, os.PathLike)) else list(manifest)
+    # 前回の実行で kill されたワーカーが残した作業ディレクトリ
+    sweep_stale_workdirs()
+    index = structure_index if structure_index is not None else index_structure_dir(structures_dir)
+    if quarantine_path is None:
+        quarantine_path = str(pathlib.Path(results_path).with_suffix("")) + ".quarantine.jsonl"
+    quarantined = set() if retry_quarantined else read_quarantine(quarantine_path)
+
+    summary = {"entries": len(entries), "chains_ok": 0, "chains_failed": 0, "chains_retried": 0, "chains_skipped": 0}
+    tasks = []
+    for entry in entries:
+        chains = [c for c in entry.chains if quarantine_key(entry.pdb_id, entry.model, c) not in quarantined]
+        summary["chains_skipped"] += len(entry.chains) - len(chains)
+        if entry.chains and not chains:
+            continue
+        if not entry.chains and quarantine_key(entry.pdb_id, entry.model, "") in quarantined:
+            # 全チェーンを処理する行がワーカーごと落ち続けた場合 (_lost_entry)
+            summary["chains_skipped"] += 1
+            continue
+        tasks.append((entry._replace(chains=chains), resolve_structure(entry, index), 1))
+    if output_dir:
+        pathlib.Path(output_dir).mkdir(parents=True, exist_ok=True)
+
+    index = dataset_index
+    if index is None:
+        index = DatasetIndex(index_path or default_index_path(structures_dir))
+    found = sorted({str(path) for _, path, _ in tasks if path is not None})
+    # パースと sha256 は新規・更新されたファイルだけ、ワーカーと同じ数のプロセスで並列に行う
+    n_indexed = index.update(found, processes=processes or cpu_count())
+    index.save()
+    logger.info(f"[batch] dataset index: {index.path} ({len(index)} entries, {n_indexed} (re)indexed)")
+
+    duplicates = {}
+    if dedup != "off":
+        tasks, duplicates, n_chains, n_unique = _dedup_tasks(tasks, index, dedup)
+        summary.update(chains_total=n_chains, chains_unique=n_unique, dedup_ratio=dedup_ratio(n_chains, n_unique))
+        logger.info(f"[batch] dedup ({dedup}): {n_chains} chains -> {n_unique} unique "
+              f"(dedup ratio {summary['dedup_ratio']})")
+    cli = None
+    if duplicates and fmt is not None:
+        # 重複したチェーンのスクリプトはこのプロセスで書き出す
+        import CLI_PseudoknotVisualizer as cli
+
+    def schedule(tasks):
+        """推定コストの大きい順に並べ、推定メモリのリストと一緒に返す（ファイルが無いものは最後）"""
+        known = [task for task in tasks if task[1] is not None]
+        paths = [str(task[1]) for task in known]
+        known, order = longest_first(known, index.estimated_costs(paths, annotator, atoms="model_atom_count"))
+        memory = index.estimated_memory_mb(paths, atoms="model_atom_count")
+        missing = [task for task in tasks if task[1] is None]
+        return known + missing, [memory[i] for i in order] + [0] * len(missing)
+
+    n_procs = max(1, min(processes or cpu_count(), len(tasks) or 1))
+    logger.info(f"[batch] {len(tasks)} manifest entries, {n_procs} worker processes, annotator={annotator}")
+    if summary["chains_skipped"]:
+        logger.info(f"[batch] skipping {summary['chains_skipped']} quarantined chains listed in {quarantine_path}")
+
+    tracker = None
+    if progress or status_path:
+        known = [(entry, path) for entry, path, _ in tasks if path is not None]
+        estimates = dict(zip(
+            (_progress_key(entry) for entry, _ in known),
+            index.estimated_costs([str(path) for _, path in known], annotator, atoms="model_atom_count"),
+        ))
+        tracker = ProgressTracker({_progress_key(entry): estimates.get(_progress_key(entry), 0.0)
+                                   for entry, _, _ in tasks},
+                                  workers=n_procs, status_path=status_path, live=progress,
+                                  interval=progress_interval, label="batch", mp_context=MP_CONTEXT)
+    def echo(message):
+        # 進捗の行を表示している間は、その行を消してから出力する
+        if progress:
+            tracker.clear_line()
+        logger.info(message)
+
+    keeper = None
+    if profile_top > 0:
+        profile_dir = profile_dir or str(pathlib.Path(results_path).with_suffix("")) + ".profiles"
+        keeper = ProfileKeeper(profile_dir, profile_top)
+        logger.info(f"[batch] profiling every chain; keeping the {profile_top} slowest and "
+              f"{profile_top} most memory-hungry in {profile_dir}")
+
+    limits = {"annotator_timeout": annotator_timeout, "dp_timeout": dp_timeout, "memory_mb": memory_mb}
+    failures = {}  # quarantine_key -> 過去の試行の失敗 (error_type, error, elapsed_sec)
+    run_stats = Stats()  # 再試行した分も含めたワーカーの集計
+    start = time.perf_counter()
+    with open(results_path, "a") as out, WorkerPool(
+        n_procs,
+        initializer=_init_worker,
+        initargs=(annotator, include_all, fmt, output_dir, model_id, limits, tracker and tracker.events,
+                  keeper and profile_dir, worker_log_level()),
+        max_tasks_per_child=max_tasks_per_child,
+    ) as pool, open(quarantine_path, "a") as quarantine, tracker or nullcontext():
+        # tracker はプールより先に止める（ワーカーが生きている間に残りのイベントを受け取る）
+
+        def run_pass(tasks, slots):
+            """
+            tasks を最大 slots 件ずつ同時に実行し、終わったものから書き出す。
+
+            Returns:
+                tuple: (再試行するタスク, ワーカーごと落ちた時に同時に実行していたため単独で実行し直すタスク)
+            """
+            retry_tasks, suspects = [], []
+            tasks, memory = schedule(tasks)
+            # 完了順に受け取り、その場で 1 行ずつ書き出す
+            for done, ((entry, path, attempt), records) in enumerate(
+                    budgeted_imap(pool, _run_entry, tasks, slots, memory, memory_budget_mb, on_error=_lost_entry),
+                    start=1):
+                if records and records[0].get("error_type") == "crashed":
+                    if tracker is not None:
+                        tracker.lost(_progress_key(entry), len(records))
+                    if slots > 1 and len(tasks) > 1:
+                        # どのタスクがワーカーを落としたのか分からないので、試行回数は数えずに 1 件ずつ実行し直す
+                        suspects.append((entry, path, attempt))
+                        if tracker is not None:
+                            tracker.retry(_progress_key(entry))
+                        echo(f"[batch] {done}/{len(tasks)} {entry.pdb_id}: a worker process died; "
+                             f"will rerun on its own")
+                        continue
+                retry_chains = []
+                if path is not None and all(record["status"] == "ok" for record in records):
+                    index.record_runtime(path, annotator, sum(record["elapsed_sec"] for record in records))
+                for record in records:
+                    run_stats.merge(record.get("stats"))
+                    if "profile" in record:
+                        keeper.add(record.pop("profile"))
+                    dups = duplicates.get(quarantine_key(record["pdb_id"], record["model"], record["requested_chain_id"]), [])
+                    if record["status"] == "ok":
+                        summary["chains_ok"] += 1 + len(dups)
+                        _write_record(out, record)
+                        for dup_entry, dup_path, dup_chain, dup_actual in dups:
+                            dup = _fan_out(record, dup_entry, dup_path, dup_chain, dup_actual)
+                            if cli is not None:
+                                _write_scripts(cli, dup, dup["structure_id"], dup_actual, fmt,
+                                               pathlib.Path(output_dir), model_id)
+                            _write_record(out, dup)
+                        if not progress:
+                            logger.info(f"[batch] {done}/{len(tasks)} {record['pdb_id']} {record['chain_id']}: "
+                                  f"{_summary(record)}" + (f" (+{len(dups)} identical chains)" if dups else ""))
+                        continue
+
+                    key = quarantine_key(record["pdb_id"], record["model"], record["requested_chain_id"])
+                    history = failures.setdefault(key, [])
+                    history.append({k: record.get(k) for k in ("attempt", "error_type", "error", "elapsed_sec")})
+                    if record["retryable"] and attempt <= retries:
+                        retry_chains.append(record["requested_chain_id"])
+                        echo(f"[batch] {done}/{len(tasks)} {record['pdb_id']} {record['chain_id']}: "
+                             f"{record['error_type']} ({record['error']}), will retry")
+                        continue
+
+                    summary["chains_failed"] += 1 + len(dups)
+                    record["attempts"] = history
+                    for failed in [record] + [_fan_out(record, *dup) for dup in dups]:
+                        _write_record(out, failed)
+                        if record["retryable"]:
+                            # 何度やっても失敗する入力は隔離し、次回以降の実行で読み飛ばす
+                            _write_record(quarantine, failed)
+                    quarantine.flush()
+                    echo(f"[batch] {done}/{len(tasks)} {record['pdb_id']} {record['chain_id']}: "
+                         f"ERROR {record['error_type']} ({record['error']})")
+                out.flush()
+                if retry_chains:
+                    # requested_chain_id が "" なのは全チェーンを処理する行 (_lost_entry)
+                    retry_tasks.append((entry._replace(chains=[c for c in retry_chains if c]), path, attempt + 1))
+                    if tracker is not None:
+                        tracker.retry(_progress_key(entry), _progress_key(retry_tasks[-1][0]))
+            return retry_tasks, suspects
+
+        while tasks:
+            retry_tasks, suspects = run_pass(tasks, n_procs)
+            if suspects:
+                echo(f"[batch] rerunning {len(suspects)} entries one at a time after a worker process died")
+                # 単独で実行すれば、ワーカーを落としたタスクだけが失敗（再試行・quarantine）になる
+                retry_tasks += run_pass(suspects, 1)[0]
+            tasks = retry_tasks
+            if tasks:
+                summary["chains_retried"] += sum(len(entry.chains) or 1 for entry, _, _ in tasks)
+                echo(f"[batch] retrying {len(tasks)} entries (attempt {tasks[0][2]})")
+        summary["worker_restarts"] = pool.restarts
+    index.save()
+    summary["elapsed_sec"] = round(time.perf_counter() - start, 3)
+    summary["stats"] = run_stats.snapshot()
+    logger.info(f"[batch] finished: {summary['chains_ok']} chains ok, {summary['chains_failed']} failed "
+          f"in {summary['elapsed_sec']} s -> {results_path}")
+    for line in format_summary(summary["stats"], summary["elapsed_sec"]):
+        logger.info(f"[batch] {line}")
+    if stats_path:
+        logger.info(f"[batch] stage timings -> {write_stats(summary['stats'], stats_path)}")
+    if keeper is not None:
+        summary["profiles"] = keeper.summary()
+        logger.info(f"[batch] profiles -> {keeper.write_index()}")
+        for label, key in (("slowest", "slowest"), ("peak memory", "largest_peak_memory")):
+            for info in summary["profiles"][key]:
+                logger.info(f"[batch]   {label}: {info['pdb_id']} {info['chain_id']} {info['elapsed_sec']} s, "
+                      f"{info['peak_bytes'] / 2**20:.1f} MiB peak -> {info['pstats']}")
+    return summary
+
+
+def batch_main(argv=None):
+    from argparser import batch_argparser
+    from log_config import configure_logging, show_progress
+
+    args = batch_argparser(argv)
+    configure_logging(args.log_level)
+    show_progress("batch", "queue")
+    if args.queue:
+        # 共有ファイルシステム上のキューから shard を確保して処理する（複数ノードで同じコマンドを実行する）
+        from work_queue import run_node
+        run_node(
+            args.queue, args.manifest, args.structures_dir,
+            node_id=args.node_id,
+            shard_size=args.shard_size,
+            lease_timeout=args.lease_timeout,
+            heartbeat=args.heartbeat,
+            wait=not args.no_wait,
+            annotator=args.annotator,
+            include_all=args.include_all,
+            processes=args.processes,
+            fmt=args.format,
+            output_dir=args.output_dir,
+            model_id=args.model,
+            annotator_timeout=args.annotator_timeout,
+            dp_timeout=args.dp_timeout,
+            memory_mb=args.memory_limit,
+            max_tasks_per_child=args.max_tasks_per_child,
+            retries=args.retries,
+            index_path=args.index,
+            memory_budget_mb=args.memory_budget,
+            dedup=args.dedup,
+            stats_path=args.stats,
+            progress=args.progress,
+            status_path=args.status_file,
+            progress_interval=args.progress_interval,
+            profile_top=args.profile_top,
+            profile_dir=args.profile_dir,
+        )
+        return
+    run_batch(
+        args.manifest, args.structures_dir,
+        annotator=args.annotator,
+        include_all=args.include_all,
+        processes=args.processes,
+        results_path=args.results,
+        fmt=args.format,
+        output_dir=args.output_dir,
+        model_id=args.model,
+        annotator_timeout=args.annotator_timeout,
+        dp_timeout=args.dp_timeout,
+        memory_mb=args.memory_limit,
+        max_tasks_per_child=args.max_tasks_per_child,
+        retries=args.retries,
+        quarantine_path=args.quarantine,
+        retry_quarantined=args.retry_quarantined,
+        index_path=args.index,
+        memory_budget_mb=args.memory_budget,
+        dedup=args.dedup,
+        stats_path=args.stats,
+        progress=args.progress,
+        status_path=args.status_file,
+        progress_interval=args.progress_interval,
+        profile_top=args.profile_top,
+        profile_dir=args.profile_dir,
+    )
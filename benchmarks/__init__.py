@@ -0,0 +1,11 @@
+"""
+Benchmarks for PseudoknotVisualizer
+
+    synthetic.py         合成した塩基対リスト（H 型、kissing loop、多層の交差、ランダム）
+    bench_pkextractor.py layer 分解のエンジンの速度・スケーリング・ピークメモリとベースラインとの比較
+    bench_atom_table.py  atom_table のリーダーと Biopython のパーサーの速度・ピークメモリ・読んだ原子の一致
+    differential.py      基準エンジンと候補のエンジンの layer の差分テスト（反例の最小化と速度比）
+    replay.py            記録したアノテーター出力を返す代役で CLI / pkv_core / batch を実行し、段階ごとの時間を報告
+    replay_annotator.py  入力の内容をキーに記録済みの出力を返す x3dna-dssr / rnaview の代役
+    corpus/              replay.py の記録済み corpus（test/1KPD の DSSR 出力）
+"""
@@ -0,0 +1,170 @@
+"""
+Atom table reader benchmark
+
+atom_table.read_atom_table (NumPy の列指向リーダー) と Biopython の PDBParser / MMCIFParser で
+同じ構造ファイルを読み、所要時間 (best-of-N) と tracemalloc のピークメモリを比べる。
+あわせて最初のモデルの原子（チェーン・残基番号・挿入コード・残基名・原子名・座標）が
+Biopython と一致するかを確かめ、1 つでも違えば終了コード 1 を返す。
+
+$ cd PseudoknotVisualizer
+$ python benchmarks/bench_atom_table.py                          # test/1KPD.pdb と、それを書き出した mmCIF
+$ python benchmarks/bench_atom_table.py 4V9F.cif.gz --repeat 3 --min-speedup 10
+
+--min-speedup を指定すると、速度比がそれを下回った入力でも終了コード 1 を返す
+（1KPD のような小さな構造では固定の起動コストが目立つので、既定では比較しない）。
+"""
+
+import argparse
+import json
+import math
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+script_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(script_dir))
+
+from atom_table import read_atom_table, write_cif
+from structure_io import open_structure, structure_format, structure_stem
+
+DEFAULT_INPUT = script_dir / "test" / "1KPD.pdb"
+COORD_TOLERANCE = 1e-3
+
+
+def biopython_structure(struct_file):
+    from Bio.PDB import PDBParser
+    from Bio.PDB.MMCIFParser import MMCIFParser
+
+    parser = MMCIFParser(QUIET=True) if structure_format(struct_file) == "cif" else PDBParser(QUIET=True)
+    with open_structure(struct_file) as handle:
+        return parser.get_structure(structure_stem(struct_file), handle)
+
+
+def table_atoms(table):
+    """AtomTable の最初のモデルの原子を {(chain, resseq, icode, resname, atom): 座標} にする（altloc は先頭だけ）"""
+    first = table.select(model=table.first_model())
+    atoms = {}
+    for chain, resseq, icode, resname, name, xyz in zip(
+            first.chain_id.tolist(), first.res_seq.tolist(), first.ins_code.tolist(),
+            first.res_name.tolist(), first.atom_name.tolist(), first.coords.tolist()):
+        atoms.setdefault((chain, int(resseq), icode, resname, name), xyz)
+    return atoms
+
+
+def biopython_atoms(structure):
+    """Biopython の最初のモデルの原子を table_atoms と同じ形にする"""
+    model = next(iter(structure))
+    atoms = {}
+    for atom in model.get_atoms():
+        residue = atom.get_parent()
+        _, resseq, icode = residue.get_id()
+        key = (residue.get_parent().id, int(resseq), icode.strip(), residue.get_resname().strip(), atom.get_name())
+        atoms.setdefault(key, [float(v) for v in atom.get_coord()])
+    return atoms
+
+
+def compare_atoms(ours, theirs):
+    """
+    Returns:
+        list[str]: 食い違いの説明（一致すれば空）
+    """
+    problems = []
+    only_ours = sorted(ours.keys() - theirs.keys())
+    only_theirs = sorted(theirs.keys() - ours.keys())
+    if only_ours:
+        problems.append(f"{len(only_ours)} atoms only in AtomTable (e.g. {only_ours[0]})")
+    if only_theirs:
+        problems.append(f"{len(only_theirs)} atoms only in Biopython (e.g. {only_theirs[0]})")
+    moved = [key for key in ours.keys() & theirs.keys()
+             if max(abs(a - b) for a, b in zip(ours[key], theirs[key])) > COORD_TOLERANCE]
+    if moved:
+        problems.append(f"{len(moved)} atoms with different coordinates (e.g. {sorted(moved)[0]})")
+    return problems
+
+
+def best_of(func, repeat):
+    best = math.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def peak_memory(func):
+    """1 回実行した時の tracemalloc のピーク（バイト）"""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_file(struct_file, repeat):
+    """
+    Returns:
+        dict: input, atoms, atom_table_sec, biopython_sec, speedup, atom_table_peak_kib, biopython_peak_kib,
+              memory_ratio, problems
+    """
+    table = read_atom_table(struct_file)
+    problems = compare_atoms(table_atoms(table), biopython_atoms(biopython_structure(struct_file)))
+    ours_sec = best_of(lambda: read_atom_table(struct_file), repeat)
+    theirs_sec = best_of(lambda: biopython_structure(struct_file), repeat)
+    ours_peak = peak_memory(lambda: read_atom_table(struct_file))
+    theirs_peak = peak_memory(lambda: biopython_structure(struct_file))
+    return {
+        "input": str(struct_file),
+        "atoms": len(table),
+        "atom_table_sec": round(ours_sec, 6),
+        "biopython_sec": round(theirs_sec, 6),
+        "speedup": round(theirs_sec / ours_sec, 2),
+        "atom_table_peak_kib": round(ours_peak / 1024, 1),
+        "biopython_peak_kib": round(theirs_peak / 1024, 1),
+        "memory_ratio": round(theirs_peak / ours_peak, 2),
+        "problems": problems,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Compare atom_table.read_atom_table with Biopython's parsers")
+    parser.add_argument("inputs", nargs="*", type=Path,
+                        help="Structure files (.pdb / .cif / .mmcif, .gz allowed; "
+                             "default: test/1KPD.pdb and an mmCIF copy of it)")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per parser; the best is kept (default: 5)")
+    parser.add_argument("--min-speedup", type=float, default=None,
+                        help="Fail when AtomTable is less than this many times faster than Biopython (default: report only)")
+    parser.add_argument("--output", "-o", type=Path, default=None, help="Also write the results as JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory(prefix="pkv_bench_atoms_") as tmpdir:
+        inputs = list(args.inputs)
+        if not inputs:
+            # 同じ構造の mmCIF 版も読み、parse_cif_lines も Biopython と比べる
+            inputs = [DEFAULT_INPUT, write_cif(read_atom_table(DEFAULT_INPUT), Path(tmpdir) / "1KPD.cif", "1KPD")]
+        results = [bench_file(path, args.repeat) for path in inputs]
+
+    status = 0
+    for result in results:
+        print(f"[bench] {Path(result['input']).name:<20}{result['atoms']:>8} atoms  "
+              f"AtomTable {result['atom_table_sec'] * 1000:>9.2f} ms {result['atom_table_peak_kib']:>10.1f} KiB  "
+              f"Biopython {result['biopython_sec'] * 1000:>9.2f} ms {result['biopython_peak_kib']:>10.1f} KiB  "
+              f"x{result['speedup']} faster, x{result['memory_ratio']} less memory")
+        for problem in result["problems"]:
+            print(f"[bench]   MISMATCH {problem}")
+            status = 1
+        if args.min_speedup is not None and result["speedup"] < args.min_speedup:
+            print(f"[bench]   SLOW: less than x{args.min_speedup} faster than Biopython")
+            status = 1
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2) + "\n")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
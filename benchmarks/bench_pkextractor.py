@@ -0,0 +1,235 @@
+"""
+PKextractor micro-benchmark
+
+合成した塩基対リスト（benchmarks/synthetic.py）に対して rna.PK_ENGINES の各エンジンを実行し、
+サイズ区分ごとの所要時間・スケーリング（塩基対数に対する log-log の傾き）・ピークメモリを測る。
+保存してあるベースラインと比べ、サイズ区分ごとの時間が許容範囲を超えて遅くなっていれば終了コード 1 を返す。
+
+$ cd PseudoknotVisualizer
+$ python benchmarks/bench_pkextractor.py                       # 測定してベースラインと比較
+$ python benchmarks/bench_pkextractor.py --sizes xs s m l xl   # 大きいサイズも測る
+$ python benchmarks/bench_pkextractor.py --update-baseline     # 現在の結果をベースラインとして保存
+
+ベースラインと比べるのは、マシンの速さの違いを打ち消すため固定の純 Python の計算（calibrate()）の時間で
+割った値。CPU のクロックや他のプロセスによる揺れを打ち消すよう、calibrate() はケースごとに
+エンジンの測定と交互に実行し、--repeat 回の（エンジンの時間 / calibrate の時間）の中央値を使う。
+1 回の測定が短すぎる小さいケースは、MIN_SAMPLE_SEC 以上になるまで繰り返した平均を 1 回分とする。
+ピークメモリは tracemalloc で別に 1 回測る（tracemalloc は時間を大きく伸ばすので、時間の測定には含めない）。
+"""
+
+import argparse
+import json
+import math
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+script_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(script_dir))
+
+from benchmarks.synthetic import MOTIFS, SIZE_CLASSES, make_case
+from rna import PK_ENGINES
+
+DEFAULT_BASELINE = Path(__file__).parent / "baselines" / "pkextractor.json"
+DEFAULT_SIZES = ("xs", "s", "m", "l")
+DEFAULT_TOLERANCE = 0.25
+DEFAULT_REPEAT = 9
+MIN_SAMPLE_SEC = 0.01
+CALIBRATION_N = 80
+CALIBRATION_TABLE = [[(i * j) % 7 for j in range(CALIBRATION_N)] for i in range(CALIBRATION_N)]
+
+
+def calibrate():
+    """固定の純 Python の計算（DP の内側のループに近いリストの添字と max）1 回分の秒"""
+    n, table = CALIBRATION_N, CALIBRATION_TABLE
+    start = time.perf_counter()
+    for i in range(n):
+        for j in range(i, n):
+            max([table[i][k] + table[k][j] for k in range(i, j + 1)])
+    return time.perf_counter() - start
+
+
+def loops_for(engine, BPL):
+    """1 回の測定が MIN_SAMPLE_SEC 以上になる実行回数"""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            engine(list(BPL))
+        if time.perf_counter() - start >= MIN_SAMPLE_SEC:
+            return number
+        number *= 2
+
+
+def time_engine(engine, BPL, repeat):
+    """
+    エンジンの測定と calibrate() を repeat 回交互に行う。
+
+    Returns:
+        tuple: (1 回あたりの秒の中央値, (エンジンの秒 / calibrate の秒) の中央値, calibrate の秒の中央値, layers)
+    """
+    number = loops_for(engine, BPL)
+    samples, ratios, calibrations = [], [], []
+    for _ in range(repeat):
+        calibration = calibrate()
+        pairs = [list(BPL) for _ in range(number)]
+        start = time.perf_counter()
+        for bpl in pairs:
+            layers = engine(bpl)
+        elapsed = (time.perf_counter() - start) / number
+        samples.append(elapsed)
+        calibrations.append(calibration)
+        ratios.append(elapsed / calibration)
+    return statistics.median(samples), statistics.median(ratios), statistics.median(calibrations), layers
+
+
+def peak_memory(engine, BPL):
+    """1 回実行した時の tracemalloc のピーク（バイト）"""
+    tracemalloc.start()
+    try:
+        engine(list(BPL))
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def scaling_exponent(points):
+    """(塩基対数, 秒) の列に対する log-log の最小二乗の傾き（O(n^k) の k の目安）"""
+    points = [(n, t) for n, t in points if n > 0 and t > 0]
+    if len(points) < 2:
+        return None
+    xs = [math.log(n) for n, _ in points]
+    ys = [math.log(t) for _, t in points]
+    mx, my = sum(xs) / len(xs), sum(ys) / len(ys)
+    sxx = sum((x - mx) ** 2 for x in xs)
+    return round(sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / sxx, 2) if sxx else None
+
+
+def run_benchmark(engines, motifs, sizes, repeat=DEFAULT_REPEAT, seed=0, memory=True):
+    """
+    Returns:
+        dict: calibration_sec (全ケースの calibrate の中央値),
+              cases (engine, motif, size, pairs, span, layers, median_sec, normalized, peak_kib),
+              size_classes ("engine/size" -> 全モチーフの median_sec と normalized の合計),
+              scaling ("engine/motif" -> 傾き)
+    """
+    calibrations = []
+    cases = []
+    for size in sizes:
+        n_pairs = SIZE_CLASSES[size]
+        for motif in motifs:
+            BPL = make_case(motif, n_pairs, seed=seed)
+            for name in engines:
+                engine = PK_ENGINES[name]
+                median, normalized, calibration, layers = time_engine(engine, BPL, repeat)
+                calibrations.append(calibration)
+                case = {
+                    "engine": name, "motif": motif, "size": size, "pairs": len(BPL),
+                    "span": max(j for _, j in BPL), "layers": len(layers), "median_sec": round(median, 6),
+                    "normalized": round(normalized, 5),
+                }
+                if memory:
+                    case["peak_kib"] = round(peak_memory(engine, BPL) / 1024, 1)
+                cases.append(case)
+                print(f"[bench] {name:<16}{motif:<9}{size:<4}{len(BPL):>5} pairs {len(layers):>3} layers "
+                      f"{median * 1000:>10.3f} ms  x{normalized:.4f} calibration"
+                      + (f" {case['peak_kib']:>9.1f} KiB" if memory else ""))
+
+    size_classes = {}
+    for case in cases:
+        entry = size_classes.setdefault(f"{case['engine']}/{case['size']}", {"median_sec": 0.0, "normalized": 0.0})
+        entry["median_sec"] += case["median_sec"]
+        entry["normalized"] += case["normalized"]
+    for entry in size_classes.values():
+        entry["median_sec"] = round(entry["median_sec"], 6)
+        entry["normalized"] = round(entry["normalized"], 4)
+    scaling = {
+        f"{name}/{motif}": scaling_exponent([(c["pairs"], c["median_sec"]) for c in cases
+                                             if c["engine"] == name and c["motif"] == motif])
+        for name in engines for motif in motifs
+    }
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "calibration_sec": round(statistics.median(calibrations), 6),
+        "repeat": repeat,
+        "cases": cases,
+        "size_classes": size_classes,
+        "scaling": scaling,
+    }
+
+
+def compare(result, baseline, tolerance):
+    """
+    サイズ区分ごとに calibration で割った時間をベースラインと比べる。
+
+    Returns:
+        list: (key, ベースライン, 今回, 比) のうち 1 + tolerance を超えたもの
+    """
+    regressions = []
+    for key, entry in result["size_classes"].items():
+        base = baseline.get("size_classes", {}).get(key)
+        if base is None or not base["normalized"]:
+            continue
+        ratio = entry["normalized"] / base["normalized"]
+        flag = "REGRESSION" if ratio > 1 + tolerance else "ok"
+        print(f"[bench] {key:<22} baseline {base['median_sec'] * 1000:>10.3f} ms  "
+              f"now {entry['median_sec'] * 1000:>10.3f} ms  normalized x{ratio:.2f}  {flag}")
+        if ratio > 1 + tolerance:
+            regressions.append((key, base["normalized"], entry["normalized"], round(ratio, 3)))
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmark of the pseudoknot layer decomposition engines")
+    parser.add_argument("--engines", nargs="+", choices=sorted(PK_ENGINES), default=sorted(PK_ENGINES),
+                        help="Engines to run (default: all in rna.PK_ENGINES)")
+    parser.add_argument("--motifs", nargs="+", choices=sorted(MOTIFS), default=list(MOTIFS),
+                        help="Synthetic structures (default: all)")
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZE_CLASSES), default=list(DEFAULT_SIZES),
+                        help=f"Size classes (default: {' '.join(DEFAULT_SIZES)}; "
+                             + ", ".join(f"{k}={v} pairs" for k, v in SIZE_CLASSES.items()) + ")")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT,
+                        help=f"Timed runs per case, each next to a calibration run; the median is kept "
+                             f"(default: {DEFAULT_REPEAT})")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random motif (default: 0)")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc peak-memory run")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE,
+                        help=f"Baseline JSON (default: {DEFAULT_BASELINE.relative_to(script_dir)})")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help=f"Allowed slowdown per size class before failing (default: {DEFAULT_TOLERANCE} = +25%%)")
+    parser.add_argument("--update-baseline", action="store_true", help="Write the results as the new baseline")
+    parser.add_argument("--output", "-o", type=Path, default=None, help="Also write the full results as JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = run_benchmark(args.engines, args.motifs, args.sizes, args.repeat, args.seed, memory=not args.no_memory)
+    print(f"[bench] calibration {result['calibration_sec'] * 1000:.2f} ms")
+    for key, exponent in result["scaling"].items():
+        if exponent is not None:
+            print(f"[bench] scaling {key:<28} time ~ pairs^{exponent}")
+    if args.output:
+        args.output.write_text(json.dumps(result, indent=2) + "\n")
+
+    if args.update_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(result, indent=2) + "\n")
+        print(f"[bench] baseline written to {args.baseline}")
+        return 0
+    if not args.baseline.exists():
+        print(f"[bench] no baseline at {args.baseline}; run with --update-baseline to create it")
+        return 0
+    regressions = compare(result, json.loads(args.baseline.read_text()), args.tolerance)
+    if regressions:
+        print(f"[bench] {len(regressions)} size classes are more than {args.tolerance:.0%} slower than the baseline")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,238 @@
+"""
+Differential testing of the layer decomposition engines
+
+rna.PK_ENGINES の基準エンジン（既定 "dp"）と候補のエンジンを同じ塩基対リストで実行し、
+layer が 1 つでも違えば（どの塩基対がどの layer に入るかのタイブレークを含む）、
+delta debugging で最小化した反例を報告する。あわせてエンジンごとの合計時間と基準に対する速度比を記録する。
+
+$ cd PseudoknotVisualizer
+$ python benchmarks/differential.py                                   # replay corpus + 合成ケース
+$ python benchmarks/differential.py --results analysis/pseudoknot_analysis_output_DSSR.jsonl --random 1000
+$ python benchmarks/differential.py --engines dp_uncompressed -o differential.json
+
+入力:
+    --results : pseudoknotlayer_analysis の結果 (.jsonl / .npz / .parquet / .json)。layer_id >= 0 の塩基対
+                （layer 分解に渡した塩基対）を記録した順に使い、記録された layer とも基準エンジンの結果を比べる
+    --corpus  : benchmarks/replay.py の corpus（corpus.json の layers を合わせたもの）
+    合成      : benchmarks/synthetic.py の各モチーフ（--sizes）と、塩基対数・ヘリックス長・交差の密度を
+                ランダムに選んだ random_bpl を --random 件
+
+layer の比較では layer の順序はそのまま、layer 内の塩基対の順序は区別しない。
+不一致（候補の例外も含む）が 1 件でもあれば終了コード 1 を返す。
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+script_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(script_dir))
+
+from benchmarks.synthetic import MOTIFS, SIZE_CLASSES, make_case, random_bpl
+from rna import PK_ENGINES
+
+DEFAULT_CORPUS = Path(__file__).parent / "corpus"
+DEFAULT_SIZES = ("xs", "s", "m")
+REFERENCE = "dp"
+
+
+def normalize_layers(layers):
+    """layer の順序は保ち、layer 内は (i, j) の昇順にする"""
+    return [sorted((int(i), int(j)) for i, j in layer) for layer in layers]
+
+
+def recorded_cases(results_path):
+    """分析結果の各チェーンを (名前, BPL, 記録された layers) にする"""
+    from analysis.results_io import iter_results
+
+    for record in iter_results(results_path, fields=["pdb_id", "chain_id", "pairs"]):
+        pairs = record.get("pairs") or {}
+        layer_ids = pairs.get("layer_id", [])
+        BPL = [(i, j) for i, j, layer_id in zip(pairs.get("i", []), pairs.get("j", []), layer_ids) if layer_id >= 0]
+        layers = [[] for _ in range(max(layer_ids, default=-1) + 1)]
+        for i, j, layer_id in zip(pairs.get("i", []), pairs.get("j", []), layer_ids):
+            if layer_id >= 0:
+                layers[layer_id].append((i, j))
+        yield f"{record['pdb_id']}_{record['chain_id']}", BPL, normalize_layers(layers)
+
+
+def corpus_cases(corpus_dir):
+    """replay の corpus の各 entry を (名前, BPL, 記録された layers) にする"""
+    path = Path(corpus_dir) / "corpus.json"
+    if not path.exists():
+        return
+    for entry in json.loads(path.read_text())["entries"]:
+        BPL = sorted((i, j) for layer in entry["layers"] for i, j in layer)
+        name = f"{Path(entry['structure']).name.split('.')[0]}_{entry['chain']}_{entry['annotator']}"
+        yield name, BPL, normalize_layers(entry["layers"])
+
+
+def synthetic_cases(sizes, n_random, seed=0, max_pairs=64):
+    """モチーフ x サイズ区分と、パラメーターをランダムに選んだ random_bpl（記録された layers は無い）"""
+    for size in sizes:
+        for motif in MOTIFS:
+            yield f"{motif}_{size}", make_case(motif, SIZE_CLASSES[size], seed=seed), None
+    rng = random.Random(seed)
+    for k in range(n_random):
+        n_pairs = rng.randint(1, max_pairs)
+        params = {
+            "helix_length": rng.randint(1, 6),
+            "crossing_density": rng.choice([0.0, 0.1, 0.3, 0.6, 0.9]),
+            "seed": rng.randrange(2 ** 31),
+        }
+        params["length"] = rng.randint(2 * n_pairs + 2 * params["helix_length"] + 3, 4 * n_pairs + 20)
+        yield f"random_{k}", random_bpl(n_pairs, **params), None
+
+
+def run_engine(engine, BPL, repeat=1):
+    """(best-of-repeat 秒, 正規化した layers または例外の文字列)"""
+    best = float("inf")
+    layers = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        try:
+            layers = normalize_layers(engine(list(BPL)))
+        except Exception as e:
+            return time.perf_counter() - start, f"{type(e).__name__}: {e}"
+        best = min(best, time.perf_counter() - start)
+    return best, layers
+
+
+def ddmin(items, fails):
+    """
+    delta debugging (ddmin): fails(subset) が True のままになる、1 要素も取り除けない部分リストを返す。
+    items は fails(items) が True であること。
+    """
+    items = list(items)
+    n = 2
+    while len(items) >= 2:
+        chunk = len(items) // n
+        subsets = [items[k:k + chunk] for k in range(0, len(items), chunk)] if chunk else [[x] for x in items]
+        reduced = False
+        for k, subset in enumerate(subsets):
+            complement = [x for m, s in enumerate(subsets) if m != k for x in s]
+            if fails(subset):
+                items, n, reduced = subset, 2, True
+                break
+            if fails(complement):
+                items, n, reduced = complement, max(n - 1, 2), True
+                break
+        if not reduced:
+            if n >= len(items):
+                break
+            n = min(2 * n, len(items))
+    return items
+
+
+def compact_positions(BPL):
+    """塩基番号を、使われている番号の順位 (1, 2, ...) に詰める（読みやすい反例にするため）"""
+    rank = {pos: r for r, pos in enumerate(sorted({p for bp in BPL for p in bp}), start=1)}
+    return [(rank[i], rank[j]) for i, j in BPL]
+
+
+def minimize(BPL, reference, candidate):
+    """基準と候補の layers が食い違う最小の BPL（番号を詰めても食い違う場合は詰めたもの）"""
+    def fails(subset):
+        return run_engine(reference, subset)[1] != run_engine(candidate, subset)[1]
+
+    minimal = ddmin(BPL, fails)
+    compacted = compact_positions(minimal)
+    return compacted if fails(compacted) else minimal
+
+
+def differential(cases, reference=REFERENCE, engines=None, repeat=1, minimize_mismatches=True):
+    """
+    Args:
+        cases: (名前, BPL, 記録された layers または None) の iterable
+
+    Returns:
+        dict: cases, reference, engines (engine -> total_sec, speedup, mismatches),
+              mismatches (engine, case, pairs, minimized, reference_layers, candidate_layers),
+              recorded_mismatches (記録された layers と基準エンジンの結果が違うケース)
+    """
+    engines = [name for name in (engines or PK_ENGINES) if name != reference]
+    totals = {name: 0.0 for name in [reference] + engines}
+    mismatches, recorded_mismatches = [], []
+    n_cases = 0
+    for name, BPL, recorded in cases:
+        n_cases += 1
+        ref_sec, ref_layers = run_engine(PK_ENGINES[reference], BPL, repeat)
+        totals[reference] += ref_sec
+        if recorded is not None and ref_layers != recorded:
+            recorded_mismatches.append({"case": name, "pairs": len(BPL)})
+            print(f"[diff] {name}: {reference} differs from the recorded layers")
+        for engine in engines:
+            sec, layers = run_engine(PK_ENGINES[engine], BPL, repeat)
+            totals[engine] += sec
+            if layers == ref_layers:
+                continue
+            minimized = minimize(BPL, PK_ENGINES[reference], PK_ENGINES[engine]) if minimize_mismatches else BPL
+            mismatches.append({
+                "engine": engine, "case": name, "pairs": len(BPL), "minimized": [list(bp) for bp in minimized],
+                "reference_layers": run_engine(PK_ENGINES[reference], minimized)[1],
+                "candidate_layers": run_engine(PK_ENGINES[engine], minimized)[1],
+            })
+            print(f"[diff] MISMATCH {engine} on {name} ({len(BPL)} pairs); minimized to {len(minimized)} pairs: "
+                  f"{[tuple(bp) for bp in minimized]}")
+    return {
+        "cases": n_cases,
+        "reference": reference,
+        "engines": {
+            name: {
+                "total_sec": round(totals[name], 6),
+                "speedup": round(totals[reference] / totals[name], 3) if totals[name] else None,
+                "mismatches": sum(m["engine"] == name for m in mismatches),
+            } for name in [reference] + engines
+        },
+        "mismatches": mismatches,
+        "recorded_mismatches": recorded_mismatches,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Differential testing of the pseudoknot layer decomposition engines")
+    parser.add_argument("--reference", choices=sorted(PK_ENGINES), default=REFERENCE,
+                        help=f"Reference engine (default: {REFERENCE})")
+    parser.add_argument("--engines", nargs="+", choices=sorted(PK_ENGINES), default=None,
+                        help="Candidate engines (default: all others in rna.PK_ENGINES)")
+    parser.add_argument("--results", type=Path, nargs="*", default=[],
+                        help="Recorded analysis results (.jsonl / .npz / .parquet / .json) to take pair lists from")
+    parser.add_argument("--corpus", type=Path, default=DEFAULT_CORPUS,
+                        help="Replay corpus to take pair lists from (default: benchmarks/corpus)")
+    parser.add_argument("--sizes", nargs="*", choices=list(SIZE_CLASSES), default=list(DEFAULT_SIZES),
+                        help=f"Size classes of the synthetic motifs (default: {' '.join(DEFAULT_SIZES)})")
+    parser.add_argument("--random", type=int, default=200, help="Number of randomized pair lists (default: 200)")
+    parser.add_argument("--max-pairs", type=int, default=64, help="Largest randomized pair list (default: 64)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the randomized pair lists (default: 0)")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per engine and case for timing (default: 1)")
+    parser.add_argument("--no-minimize", action="store_true", help="Report mismatches without minimizing them")
+    parser.add_argument("--output", "-o", type=Path, default=None, help="Write the report as JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    def cases():
+        for path in args.results:
+            yield from recorded_cases(path)
+        yield from corpus_cases(args.corpus)
+        yield from synthetic_cases(args.sizes, args.random, args.seed, args.max_pairs)
+
+    report = differential(cases(), args.reference, args.engines, args.repeat, not args.no_minimize)
+    for name, entry in report["engines"].items():
+        speedup = f"x{entry['speedup']:.2f}" if entry["speedup"] else "-"
+        print(f"[diff] {name:<18}{entry['total_sec'] * 1000:>10.1f} ms  speedup {speedup:>7}  "
+              f"mismatches {entry['mismatches']}")
+    print(f"[diff] {report['cases']} cases, {len(report['mismatches'])} mismatches, "
+          f"{len(report['recorded_mismatches'])} differ from the recorded layers")
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2) + "\n")
+    return 1 if report["mismatches"] or report["recorded_mismatches"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,299 @@
+"""
+End-to-end benchmark with replayed annotator outputs
+
+記録したアノテーター出力（corpus）を benchmarks/replay_annotator.py に返させ、本物の DSSR / RNAView 無しで
+パイプライン全体（チェーンの書き出し・アノテーターの起動・出力の読み込み・共通フォーマットへの変換・
+layer 分解・色付けスクリプト）を実行し、段階ごとの時間 (instrumentation) を報告する。
+
+$ cd PseudoknotVisualizer
+$ python benchmarks/replay.py run benchmarks/corpus                          # cli / core / batch を実行
+$ python benchmarks/replay.py run benchmarks/corpus --targets cli --repeat 5 -o replay.json
+$ python benchmarks/replay.py record benchmarks/corpus test/1KPD.pdb -c A -a DSSR --output test/1KPD.dssr.json
+$ python benchmarks/replay.py record benchmarks/corpus 1EHZ.cif -c A -a RNAView   # 本物のアノテーターで記録
+
+対象 (--targets):
+    cli   : CLI_PseudoknotVisualizer.analyze_chain + coloring_script（1 プロセス、チェーンを順に）
+    core  : pkv_core（PyMOL の pkv コマンドから PyMOL を除いた部分: AtomTable -> アノテーター -> layer 分解）
+    batch : batch.run_batch（一時的な manifest と構造ディレクトリを作り、ワーカープールで実行）
+
+corpus のディレクトリ:
+    corpus.json        entries: structure, chain, annotator, key, output, annotator_sec, layers
+                       （パスは corpus のディレクトリからの相対パス。layers は canonical-only の期待値）
+    outputs/           record で本物のアノテーターを実行した時の出力 (<key>.dssr.json / <key>.rnaview.out)
+
+--latency を付けると、記録した時のアノテーターの実行時間だけ代役が待つ（本物に近い wall-clock になる）。
+付けない場合はアノテーター以外の段階だけのオーバーヘッドを測れる。
+"""
+
+import argparse
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+script_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(script_dir))
+
+from benchmarks.replay_annotator import CORPUS_INDEX, input_key
+
+TARGETS = ("cli", "core", "batch")
+OUTPUT_SUFFIXES = {"DSSR": ".dssr.json", "RNAVIEW": ".rnaview.out"}
+ENV_VARS = {"DSSR": "PKV_DSSR_EXEC", "RNAVIEW": "PKV_RNAVIEW_EXEC"}
+
+
+def read_corpus(corpus_dir):
+    path = Path(corpus_dir) / CORPUS_INDEX
+    return json.loads(path.read_text()) if path.exists() else {"entries": []}
+
+
+def install_replay(corpus_dir, bin_dir, latency=False):
+    """
+    代役を起動する sh のラッパーを bin_dir に書き、PKV_DSSR_EXEC / PKV_RNAVIEW_EXEC をそこに向ける。
+    config を import する前に呼ぶこと（batch のワーカーにも環境変数で引き継がれる）。
+    RNAView は PATH の無い環境で起動されるので、python とスクリプトは絶対パスで埋め込む。
+    """
+    bin_dir = Path(bin_dir)
+    for annotator in ("DSSR", "RNAView"):
+        wrapper = bin_dir / f"replay-{annotator.lower()}"
+        command = [sys.executable, str(Path(__file__).resolve().parent / "replay_annotator.py"),
+                   "--corpus", str(Path(corpus_dir).resolve()), "--annotator", annotator]
+        if latency:
+            command.append("--latency")
+        wrapper.write_text("#!/bin/sh\nexec " + " ".join(shlex.quote(c) for c in command) + ' "$@"\n')
+        wrapper.chmod(0o755)
+        os.environ[ENV_VARS[annotator.upper()]] = str(wrapper)
+
+
+def export_key(structure, chain, annotator):
+    """パイプラインがアノテーターに渡すチェーン限定ファイルを書き出し、そのキーとファイルを返す"""
+    from CLI_PseudoknotVisualizer import _export_for, read_chain_table
+
+    tmp = Path(tempfile.mkdtemp(prefix="pkv-replay-"))
+    export = _export_for(structure, chain, tmp / f"chain_{chain}", annotator, read_chain_table(structure, chain))
+    return input_key(export.path), export, tmp
+
+
+def expected_layers(output, export, chain, annotator):
+    """記録した出力から canonical-only の layer を求める（run での比較用）"""
+    from addressDSSROutput import load_dssr_data
+    from addressRNAviewOutput import load_rnaview_data
+    from pkv_core import decompose_annotation
+    from structure_io import restore_chain_id
+
+    loader = load_dssr_data if annotator.upper() == "DSSR" else load_rnaview_data
+    PKlayers, _ = decompose_annotation(restore_chain_id(loader(str(output)), export, chain), annotator)
+    return [[[int(i), int(j)] for i, j in PKlayer] for PKlayer in PKlayers]
+
+
+def run_annotator(export, annotator, dest):
+    """本物のアノテーターをチェーン限定ファイルに対して実行し、出力を dest にコピーして実行時間を返す"""
+    import CLI_PseudoknotVisualizer as cli
+    from config import RNAVIEW_DIR
+
+    workdir = export.path.parent
+    start = time.perf_counter()
+    if annotator.upper() == "DSSR":
+        output = workdir / "replay.dssr.json"
+        subprocess.run(cli.dssr_command(export.path, output), cwd=workdir, check=True, capture_output=True)
+    else:
+        output = workdir / (export.path.name + ".out")
+        subprocess.run(cli.rnaview_command(export.path), env={"RNAVIEW": RNAVIEW_DIR}, cwd=workdir, check=True)
+    elapsed = time.perf_counter() - start
+    shutil.copyfile(output, dest)
+    return round(elapsed, 4)
+
+
+def record(corpus_dir, structure, chain, annotator, output=None):
+    """
+    1 本のチェーンのアノテーター出力を corpus に追加する（同じ annotator と key の entry は置き換える）。
+    output を渡すとその既存の出力を参照し、省略すると本物のアノテーターを実行して outputs/ に保存する。
+    """
+    corpus_dir = Path(corpus_dir)
+    corpus = read_corpus(corpus_dir)
+    key, export, tmp = export_key(structure, chain, annotator)
+    try:
+        if output is None:
+            dest = corpus_dir / "outputs" / f"{key}{OUTPUT_SUFFIXES[annotator.upper()]}"
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            annotator_sec = run_annotator(export, annotator, dest)
+        else:
+            dest, annotator_sec = Path(output), None
+        entry = {
+            "structure": os.path.relpath(structure, corpus_dir),
+            "chain": chain,
+            "annotator": annotator,
+            "key": key,
+            "output": os.path.relpath(dest, corpus_dir),
+            "annotator_sec": annotator_sec,
+            "layers": expected_layers(dest, export, chain, annotator),
+        }
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    corpus["entries"] = [e for e in corpus["entries"]
+                         if (e["annotator"].upper(), e["key"]) != (annotator.upper(), key)] + [entry]
+    corpus_dir.mkdir(parents=True, exist_ok=True)
+    (corpus_dir / CORPUS_INDEX).write_text(json.dumps(corpus, indent=2) + "\n")
+    print(f"[replay] recorded {structure} chain {chain} ({annotator}, key {key[:12]}, "
+          f"{len(entry['layers'])} layers) -> {corpus_dir / CORPUS_INDEX}")
+    return entry
+
+
+def run_cli(entries):
+    import CLI_PseudoknotVisualizer as cli
+
+    layers = []
+    for entry in entries:
+        result = cli.analyze_chain(entry["path"], entry["chain"], entry["annotator"])
+        cli.coloring_script(result["pdb_id"], entry["chain"], result["layers"], "pymol", None)
+        layers.append(result["layers"])
+    return layers, None
+
+
+def run_core(entries):
+    from CLI_PseudoknotVisualizer import read_chain_table
+    from instrumentation import stage
+    from pkv_core import annotate_table, decompose_annotation
+
+    layers = []
+    for entry in entries:
+        # PyMOL の pkv では selection から AtomTable を作る段階（export に含める）
+        with stage("export"):
+            table = read_chain_table(entry["path"], entry["chain"])
+        raw_df = annotate_table(table, entry["chain"], entry["annotator"])
+        PKlayers, _ = decompose_annotation(raw_df, entry["annotator"])
+        layers.append([[[int(i), int(j)] for i, j in PKlayer] for PKlayer in PKlayers])
+    return layers, None
+
+
+def run_batch_target(entries, workdir, processes=None):
+    """
+    annotator ごとに一時的な manifest と構造ディレクトリ（corpus の構造へのシンボリックリンク）を作って
+    run_batch を実行する。段階ごとの時間はワーカーから集めた summary["stats"] を使う。
+    """
+    from batch import ManifestEntry, run_batch
+    from instrumentation import Stats
+
+    stats = Stats()
+    layers = {}
+    for annotator in sorted({entry["annotator"] for entry in entries}):
+        run_dir = Path(tempfile.mkdtemp(prefix=f"batch-{annotator.lower()}-", dir=workdir))
+        structures = run_dir / "structures"
+        structures.mkdir()
+        manifest = []
+        for n, entry in enumerate(e for e in entries if e["annotator"] == annotator):
+            path = Path(entry["path"]).resolve()
+            # 同じ構造が複数回現れても別の pdb_id にする
+            link = structures / f"E{n}_{path.name}"
+            link.symlink_to(path)
+            manifest.append(ManifestEntry(pdb_id=f"E{n}_{path.name.split('.')[0]}", model=1,
+                                          chains=[entry["chain"]], extra=""))
+        results = run_dir / "results.jsonl"
+        summary = run_batch(manifest, structures, annotator=annotator, processes=processes,
+                            results_path=str(results), index_path=str(run_dir / "index.json"), dedup="off")
+        stats.merge(summary.get("stats"))
+        for line in results.read_text().splitlines():
+            record = json.loads(line)
+            layers[(record.get("pdb_id"), record.get("chain_id"))] = record.get("layers")
+        for n, entry in enumerate(e for e in entries if e["annotator"] == annotator):
+            entry["_batch_key"] = (manifest[n].pdb_id, entry["chain"])
+    return [layers.get(entry.pop("_batch_key")) for entry in entries], stats.snapshot()
+
+
+def run_target(target, entries, workdir, processes=None):
+    """1 回実行して (wall 秒, 段階ごとの集計, layer のリスト) を返す"""
+    from CLI_PseudoknotVisualizer import _cached_pk_layers
+    from instrumentation import task_stats
+
+    # 繰り返しごとに同じ仕事をするよう、layer 分解のキャッシュを空にする（fork した batch のワーカーにも引き継がれる）
+    _cached_pk_layers.cache_clear()
+    start = time.perf_counter()
+    with task_stats() as stats:
+        if target == "cli":
+            layers, snapshot = run_cli(entries)
+        elif target == "core":
+            layers, snapshot = run_core(entries)
+        else:
+            layers, snapshot = run_batch_target(entries, workdir, processes)
+    return time.perf_counter() - start, snapshot or stats.snapshot(), layers
+
+
+def run(corpus_dir, targets=TARGETS, repeat=1, latency=False, processes=None):
+    """
+    corpus の全 entry について targets を repeat 回ずつ実行する。
+
+    Returns:
+        dict: corpus, entries, repeat, latency,
+              targets (target -> best_sec, mean_sec, stats（best の回の段階ごとの集計）),
+              mismatches (layer が記録と異なった target / structure / chain)
+    """
+    from instrumentation import format_summary
+
+    corpus_dir = Path(corpus_dir)
+    entries = read_corpus(corpus_dir)["entries"]
+    for entry in entries:
+        entry["path"] = str(corpus_dir / entry["structure"])
+    report = {"corpus": str(corpus_dir), "entries": len(entries), "repeat": repeat, "latency": latency,
+              "targets": {}, "mismatches": []}
+    with tempfile.TemporaryDirectory(prefix="pkv-replay-") as workdir:
+        install_replay(corpus_dir, workdir, latency)
+        for target in targets:
+            runs = [run_target(target, entries, workdir, processes) for _ in range(repeat)]
+            best_sec, snapshot, layers = min(runs, key=lambda r: r[0])
+            for entry, got in zip(entries, layers):
+                if got != entry["layers"]:
+                    report["mismatches"].append({"target": target, "structure": entry["structure"],
+                                                 "chain": entry["chain"], "annotator": entry["annotator"]})
+            report["targets"][target] = {
+                "best_sec": round(best_sec, 4),
+                "mean_sec": round(sum(r[0] for r in runs) / len(runs), 4),
+                "stats": snapshot,
+            }
+            print(f"[replay] {target}: {len(entries)} chains, best {best_sec:.3f} s of {repeat}")
+            for line in format_summary(snapshot, best_sec):
+                print(f"[replay]   {line}")
+    for mismatch in report["mismatches"]:
+        print(f"[replay] layer mismatch: {mismatch}")
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="End-to-end benchmark with replayed annotator outputs")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_run = sub.add_parser("run", help="Run the pipeline over a recorded corpus and report per-stage time")
+    p_run.add_argument("corpus", type=Path, help="Corpus directory (contains corpus.json)")
+    p_run.add_argument("--targets", nargs="+", choices=TARGETS, default=list(TARGETS),
+                       help="Entry points to drive (default: all)")
+    p_run.add_argument("--repeat", type=int, default=1, help="Runs per target; the best is reported (default: 1)")
+    p_run.add_argument("--latency", action="store_true", help="Replay the recorded annotator time as well")
+    p_run.add_argument("--processes", "-p", type=int, default=None, help="Batch worker processes (default: CPU count)")
+    p_run.add_argument("--output", "-o", type=Path, default=None, help="Write the report as JSON")
+
+    p_rec = sub.add_parser("record", help="Add a chain's annotator output to a corpus")
+    p_rec.add_argument("corpus", type=Path, help="Corpus directory (created if missing)")
+    p_rec.add_argument("structure", type=Path, help="Structure file (.pdb / .cif, optionally .gz)")
+    p_rec.add_argument("--chain", "-c", required=True, help="Chain ID")
+    p_rec.add_argument("--annotator", "-a", choices=["DSSR", "RNAView"], required=True)
+    p_rec.add_argument("--output", type=Path, default=None,
+                       help="Existing annotator output for this chain (default: run the real annotator)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "record":
+        record(args.corpus, args.structure, args.chain, args.annotator, args.output)
+        return 0
+    report = run(args.corpus, args.targets, args.repeat, args.latency, args.processes)
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2) + "\n")
+    return 1 if report["mismatches"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+"""
+Replay annotator (stand-in for x3dna-dssr / rnaview)
+
+記録済みのアノテーター出力を、入力ファイルの内容をキーにして返すだけの代役。
+benchmarks/replay.py が PKV_DSSR_EXEC / PKV_RNAVIEW_EXEC をこのスクリプトを呼ぶラッパーに向けて使う。
+本物のバイナリやライセンスが無い環境（CI など）でも、パイプラインの残り（書き出し・読み込み・
+分解・色付け）を毎回同じ入力で実行できる。
+
+    DSSR    : <wrapper> -i=<input> --json -o=<output>   -> 記録した JSON を <output> にコピー
+    RNAView : <wrapper> -p --pdb <input>                -> 記録した .out を <input>.out にコピー
+
+キーは入力ファイルの ATOM / HETATM 行の sha256（replay.input_key）。
+記録に無い入力の場合は終了コード 2 で終わる（呼び出し側ではアノテーターの失敗になる）。
+--latency を付けると記録した時の実行時間 (annotator_sec) だけ待ってから返す。
+"""
+
+import argparse
+import hashlib
+import json
+import shutil
+import sys
+import time
+from pathlib import Path
+
+CORPUS_INDEX = "corpus.json"
+MISSING_KEY_EXIT = 2
+
+
+def input_key(path):
+    """構造ファイルの ATOM / HETATM 行の sha256（ヘッダーやファイル名の違いに左右されない）"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for line in f:
+            if line.startswith((b"ATOM", b"HETATM")):
+                digest.update(line.rstrip(b"\r\n") + b"\n")
+    return digest.hexdigest()
+
+
+def load_corpus(corpus_dir):
+    """corpus.json の entries を (annotator, key) -> entry の dict で返す"""
+    corpus_dir = Path(corpus_dir)
+    entries = json.loads((corpus_dir / CORPUS_INDEX).read_text())["entries"]
+    return {(entry["annotator"].upper(), entry["key"]): entry for entry in entries}
+
+
+def parse_invocation(args):
+    """アノテーターの引数から (入力, 出力) のパスを取り出す"""
+    dssr_in = [a[len("-i="):] for a in args if a.startswith("-i=")]
+    if dssr_in:
+        dssr_out = [a[len("-o="):] for a in args if a.startswith("-o=")]
+        if not dssr_out:
+            raise ValueError("DSSR invocation without -o=<output>")
+        return Path(dssr_in[0]), Path(dssr_out[0])
+    if "--pdb" in args and args.index("--pdb") + 1 < len(args):
+        pdb = Path(args[args.index("--pdb") + 1])
+        return pdb, pdb.with_name(pdb.name + ".out")
+    raise ValueError(f"unrecognized annotator arguments: {' '.join(args)}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded annotator outputs keyed by input")
+    parser.add_argument("--corpus", type=Path, required=True, help="Corpus directory (contains corpus.json)")
+    parser.add_argument("--annotator", choices=["DSSR", "RNAView"], required=True)
+    parser.add_argument("--latency", action="store_true", help="Sleep for the recorded annotator_sec")
+    args, annotator_args = parser.parse_known_args(argv)
+
+    input_path, output_path = parse_invocation(annotator_args)
+    key = input_key(input_path)
+    entry = load_corpus(args.corpus).get((args.annotator.upper(), key))
+    if entry is None:
+        print(f"[replay] no recorded {args.annotator} output for {input_path} (key {key[:12]})", file=sys.stderr)
+        return MISSING_KEY_EXIT
+    if args.latency and entry.get("annotator_sec"):
+        time.sleep(entry["annotator_sec"])
+    shutil.copyfile(args.corpus / entry["output"], output_path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+"""
+Synthetic base-pair lists (BPL)
+
+PKextractor のベンチマーク・差分テスト用に、長さ・塩基対数・ヘリックス長・交差の密度を指定して
+塩基対リストを作る。どの塩基も高々 1 つの塩基対にしか含まれず、(i, j) は i < j（1-origin）。
+
+モチーフ:
+    h_type   : 2 本のヘリックスが交差する H 型シュードノット（2 layers）
+    kissing  : 2 つのヘアピンのループ同士が対合する kissing loop（2 layers）
+    tangle   : n 本のヘリックスが互いにすべて交差する（n layers）
+    random   : ヘリックスをランダムに置き、crossing_density の割合が既存のヘリックスと交差する
+h_type / kissing / tangle は tile() で塩基対数が n_pairs になるまで並べる。
+"""
+
+import random
+
+
+def helix(i, j, length):
+    """(i, j) から内側に length 塩基対のヘリックス"""
+    return [(i + k, j - k) for k in range(length)]
+
+
+def h_type(helix_length=5, loop=3, start=1):
+    """
+    H 型: stem1 の 5' 側 - loop - stem2 の 5' 側 - loop - stem1 の 3' 側 - loop - stem2 の 3' 側
+
+    Returns:
+        tuple: (BPL, 使った長さ)
+    """
+    h = helix_length
+    s1 = start
+    s2 = s1 + h + loop
+    e1 = s2 + h + loop + h - 1
+    e2 = e1 + loop + h
+    return helix(s1, e1, h) + helix(s2, e2, h), e2 - start + 1
+
+
+def kissing_loops(helix_length=5, loop=7, kiss_length=3, start=1):
+    """2 つのヘアピン（ステム helix_length, ループ loop）のループ同士が kiss_length 塩基対で対合する"""
+    h = helix_length
+    if kiss_length > loop:
+        raise ValueError("kiss_length must not exceed loop")
+    a = start
+    loop1 = a + h                      # 1 つ目のヘアピンのループの先頭
+    b = loop1 + loop + h - 1           # 1 つ目のステムの 3' 端
+    c = b + 2
+    loop2 = c + h
+    d = loop2 + loop + h - 1
+    kiss = [(loop1 + (loop - kiss_length) // 2 + k, loop2 + (loop + kiss_length) // 2 - 1 - k)
+            for k in range(kiss_length)]
+    return helix(a, b, h) + helix(c, d, h) + kiss, d - start + 1
+
+
+def tangle(n_layers=3, helix_length=4, start=1):
+    """n_layers 本のヘリックスがすべて互いに交差する（i_1 < i_2 < ... < j_1 < j_2 < ...）"""
+    h = helix_length
+    opening = start + n_layers * h + 2  # 最初のヘリックスの 3' 側の手前
+    pairs = []
+    for k in range(n_layers):
+        pairs += helix(start + k * h, opening + k * h + h - 1, h)
+    return pairs, opening + n_layers * h - start
+
+
+def tile(motif, n_pairs, spacer=2, **params):
+    """motif を spacer 塩基ずつ空けて並べ、n_pairs 塩基対になったところで切る"""
+    pairs, start = [], 1
+    while len(pairs) < n_pairs:
+        unit, length = motif(start=start, **params)
+        pairs += unit
+        start += length + spacer
+    return sorted(pairs[:n_pairs])
+
+
+def random_bpl(n_pairs, helix_length=4, crossing_density=0.2, length=None, min_loop=3, seed=0):
+    """
+    長さ length（既定: 塩基対数の 3 倍）の配列上にヘリックスをランダムに置く。
+    新しいヘリックスが既存のどれかと交差する割合がおよそ crossing_density になるよう、
+    交差する・しないを先に決めてから条件を満たす位置を探す。
+    """
+    rng = random.Random(seed)
+    length = length or 3 * n_pairs
+    if 2 * n_pairs > length:
+        raise ValueError(f"length {length} is too short for {n_pairs} base pairs")
+    paired = set()
+    helices = []  # 一番外側の塩基対
+    pairs = []
+    attempts = 0
+    while len(pairs) < n_pairs:
+        attempts += 1
+        if attempts > 2000 * n_pairs:
+            raise ValueError("could not place the requested base pairs; increase length or lower helix_length")
+        h = min(helix_length, n_pairs - len(pairs))
+        if attempts % 200 == 0:
+            h = 1  # 空きが細切れになったら 1 塩基対ずつ埋める
+        if length < 2 * h + min_loop:
+            continue
+        i = rng.randint(1, length - 2 * h - min_loop + 1)
+        j = rng.randint(i + 2 * h + min_loop - 1, length)
+        bases = set(range(i, i + h)) | set(range(j - h + 1, j + 1))
+        if bases & paired:
+            continue
+        crosses = any(a < i < b < j or i < a < j < b for a, b in helices)
+        want_cross = bool(helices) and rng.random() < crossing_density
+        if crosses != want_cross and attempts % 50:
+            continue
+        paired |= bases
+        helices.append((i, j))
+        pairs += helix(i, j, h)
+    return sorted(pairs)
+
+
+MOTIFS = {
+    "h_type": lambda n_pairs, seed=0: tile(h_type, n_pairs),
+    "kissing": lambda n_pairs, seed=0: tile(kissing_loops, n_pairs),
+    "tangle": lambda n_pairs, seed=0: tile(tangle, n_pairs, n_layers=4, helix_length=3),
+    "random": lambda n_pairs, seed=0: random_bpl(n_pairs, crossing_density=0.3, seed=seed),
+}
+
+# ベンチマークのサイズ区分: 名前 -> 塩基対数
+SIZE_CLASSES = {"xs": 8, "s": 16, "m": 32, "l": 64, "xl": 128}
+
+
+def make_case(motif, n_pairs, seed=0):
+    """MOTIFS の名前と塩基対数から BPL を作る"""
+    if motif not in MOTIFS:
+        raise ValueError(f"unknown motif: {motif} (choose from {', '.join(MOTIFS)})")
+    return MOTIFS[motif](n_pairs, seed=seed)
@@ -1,6 +1,9 @@
-from pymol import cmd
 import json
 
+from log_config import get_logger
+
+logger = get_logger("coloring")
+
 def load_colors_from_json(file_path):
     """
     JSONファイルから深さごとの色設定を読み込む関数。
@@ -27,6 +30,8 @@ def get_color_for_depth(depth, color_dict):
 
 def coloring_canonical(pdb_object, chain, resi_i, color):
     # pdb_object の chain に対して、resi_i と resi_j の塩基を color で色付けする関数。
+    # PyMOL はここでだけ import する（CLI・batch・ベンチマークは PyMOL 無しで動く）
+    from pymol import cmd
     cmd.color(color, f"{pdb_object} and chain {chain} and resi {resi_i}")
     return 
 
@@ -34,7 +39,7 @@ def coloring_canonical(pdb_object, chain, resi_i, color):
 
 def CLI_coloring_canonical(pdb_id, model_id, chain_id, PKlayer, color, format):
     # pdb_object の chain に対して、resi_i と resi_j の塩基を color で色付けする関数。
-    print(f"Coloring {len(PKlayer)} base pairs.")
+    logger.debug("Coloring %d base pairs.", len(PKlayer))
     script = ""
     # PKlayer = [(i, j), ...]
     all_index = [i for pair in PKlayer for i in pair] 
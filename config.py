@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 
@@ -15,7 +16,8 @@ RNAVIEW_DIR = PseudoKnotVisualizer_DIR / "RNAView"
 
 # - RNAVIEW_EXEC: Path to the RNAView binary.
 #   Example (custom path): RNAVIEW_EXEC = Path("/opt/RNAView/bin/rnaview")
-RNAVIEW_EXEC = RNAVIEW_DIR / "bin/rnaview"
+#   The environment variable PKV_RNAVIEW_EXEC, when set, takes precedence (used by benchmarks/replay.py).
+RNAVIEW_EXEC = Path(os.environ.get("PKV_RNAVIEW_EXEC", RNAVIEW_DIR / "bin/rnaview"))
 # -------------------------------------------------------
 
 
@@ -23,5 +25,36 @@ RNAVIEW_EXEC = RNAVIEW_DIR / "bin/rnaview"
 # ----------------- DSSR configuration ------------------
 # - DSSR_EXEC: Path to the x3dna-dssr binary. By default we expect it under this repo's DSSR/ folder.
 #   Example (custom path): DSSR_EXEC = Path("/usr/local/bin/x3dna-dssr")
-DSSR_EXEC = PseudoKnotVisualizer_DIR / "DSSR" / "x3dna-dssr"
-# -------------------------------------------------------
\ No newline at end of file
+#   The environment variable PKV_DSSR_EXEC, when set, takes precedence (used by benchmarks/replay.py).
+DSSR_EXEC = Path(os.environ.get("PKV_DSSR_EXEC", PseudoKnotVisualizer_DIR / "DSSR" / "x3dna-dssr"))
+# -------------------------------------------------------
+
+
+# ---------------- Scratch (work directory) configuration ----------------
+# - SCRATCH_BACKEND: Where annotator exchange files (chain-scoped input, .out/.json, .ps/.xml/.pdb_new, ...) are written.
+#     "disk"  : under SCRATCH_DIR (default: INTERMEDIATE_DIR)
+#     "tmpfs" : under SCRATCH_DIR (default: /dev/shm/pkv), i.e. kept in RAM
+#     "memfd" : like "tmpfs", and the chain-scoped input is additionally passed as an anonymous in-memory file
+#               (/proc/self/fd/N) to annotators that can read it (DSSR). Linux only; falls back to "tmpfs" elsewhere.
+SCRATCH_BACKEND = "disk"
+# - SCRATCH_DIR: Root directory for per-invocation work directories.
+#   Each annotator run gets its own private subdirectory under this root, which is removed only by its owner,
+#   so several CLI / PyMOL / batch processes can run at the same time.
+#   None means the backend default above. Example: SCRATCH_DIR = Path("/dev/shm/pkv")
+#   The environment variable PKV_SCRATCH_DIR, when set, takes precedence (used by the test scripts).
+#   Directories left behind by killed processes are removed by batch / watch (see workdir.sweep_stale_workdirs);
+#   this assumes the scratch root is not shared with other hosts.
+SCRATCH_DIR = os.environ.get("PKV_SCRATCH_DIR") or None
+# -------------------------------------------------------------------------
+
+
+# ---------------- Time limits ----------------
+# Applied by the worker pools of `batch`, `watch` and `serve` (overridable with --annotator-timeout / --dp-timeout).
+# The single-structure CLI, the PyMOL plugin and analysis/pseudoknotlayer_analysis.py run without limits.
+# - ANNOTATOR_TIMEOUT: Wall-clock limit (seconds) for one RNAView / DSSR invocation.
+#   The annotator process is killed when it is exceeded. None means no limit.
+ANNOTATOR_TIMEOUT = 600
+# - PKEXTRACTOR_TIMEOUT: Wall-clock limit (seconds) for the pseudoknot layer decomposition (DP) of one chain.
+#   Only enforced in the main thread of a worker process. None means no limit.
+PKEXTRACTOR_TIMEOUT = 600
+# ----------------------------------------------
@@ -0,0 +1,90 @@
+"""
+Chain deduplication
+
+集合体に含まれる同じ RNA のコピーや、データセット中で別エントリとして登録された同じ分子を
+fingerprint でまとめ、アノテーターと layer 分解をユニークなチェーンごとに 1 回だけ実行する。
+
+fingerprint のモード:
+    - "coords": 残基番号付きの配列 + 座標のハッシュ（剛体変換で変わらない量を 0.1 Å で丸めたもの）。
+                結果が変わらないことが確実なコピー（対称操作で重なるコピーや同じ座標の再登録）だけをまとめる
+    - "sequence": 残基番号付きの配列のみ。同じ配列なら同じ構造とみなす（NCS コピーなど座標の少し違う
+                  コピーもまとめるが、アノテーション結果が微妙に違う可能性は無視する）
+    - "off": まとめない
+
+どちらのモードでも残基番号を fingerprint に含めるので、まとめたチェーン間で layer の (i, j) をそのまま使える。
+"""
+
+import hashlib
+
+import numpy as np
+
+DEDUP_MODES = ("coords", "sequence", "off")
+FINGERPRINT_MODES = ("coords", "sequence")
+# 座標の比較に使う丸め幅 (Å)
+COORD_DECIMALS = 1
+
+
+def chain_fingerprint(chain_table, mode="coords"):
+    """
+    1 本のチェーン（1 モデル分の AtomTable）の fingerprint を返す。
+
+    Args:
+        chain_table (AtomTable): 対象チェーンのみを含むテーブル
+        mode (str): "coords" or "sequence"
+    """
+    if mode not in FINGERPRINT_MODES:
+        raise ValueError(f"Unsupported fingerprint mode: {mode} (use one of {', '.join(FINGERPRINT_MODES)})")
+    h = hashlib.sha256()
+    starts = chain_table.residue_index()
+    residues = zip(chain_table.res_seq[starts].tolist(), chain_table.ins_code[starts].tolist(),
+                   chain_table.res_name[starts].tolist())
+    h.update("|".join(f"{seq}{ins.strip()}:{name}" for seq, ins, name in residues).encode())
+    if mode == "coords" and len(chain_table):
+        # 重心からの距離と隣り合う原子間の距離は回転・並進で変わらない
+        coords = chain_table.coords.astype(np.float64)
+        to_centroid = np.linalg.norm(coords - coords.mean(axis=0), axis=1)
+        consecutive = np.linalg.norm(np.diff(coords, axis=0), axis=1)
+        h.update("|".join(chain_table.atom_name.tolist()).encode())
+        for values in (to_centroid, consecutive):
+            h.update(np.round(values, COORD_DECIMALS).astype(np.float32).tobytes())
+    return f"{mode}:{h.hexdigest()}"
+
+
+def table_fingerprints(table, modes=FINGERPRINT_MODES):
+    """
+    最初のモデルの全チェーンの fingerprint を {mode: {chain_id: fingerprint}} で返す（dataset index 用）。
+    """
+    first = table.select(model=table.first_model()) if len(table) else table
+    fingerprints = {mode: {} for mode in modes}
+    for chain_id in first.chain_ids():
+        chain_table = first.select(chain=chain_id)
+        for mode in modes:
+            fingerprints[mode][chain_id] = chain_fingerprint(chain_table, mode)
+    return fingerprints
+
+
+def group_by_fingerprint(items, fingerprint_of):
+    """
+    items を fingerprint ごとにまとめ、(代表のリスト, {代表: [重複, ...]}) を返す。
+    代表は各 fingerprint で最初に現れた item。fingerprint_of が None を返した item は常に代表になる。
+    """
+    representatives = []
+    first_seen = {}
+    duplicates = {}
+    for item in items:
+        fingerprint = fingerprint_of(item)
+        if fingerprint is None:
+            representatives.append(item)
+            continue
+        rep = first_seen.get(fingerprint)
+        if rep is None:
+            first_seen[fingerprint] = item
+            representatives.append(item)
+        else:
+            duplicates.setdefault(rep, []).append(item)
+    return representatives, duplicates
+
+
+def dedup_ratio(n_chains, n_unique):
+    """チェーン数 / ユニークなチェーン数（1.0 なら重複なし）"""
+    return round(n_chains / n_unique, 3) if n_unique else 1.0
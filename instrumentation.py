@@ -0,0 +1,177 @@
+"""
+Stage timing and counters
+
+パイプラインの各段階の所要時間とカウンターを集計する。
+
+    with stage("annotator"):
+        subprocess.run(...)
+    count("pairs", len(BPL))
+
+    @timed("raw_df_processing")
+    def raw_df_processing(...): ...
+
+集計先:
+    - PROCESS_STATS: プロセス全体の累計（PyMOL の pkv_stats、serve の /metrics）
+    - task_stats(): with ブロックの間だけ有効な 1 タスク分の集計（batch の結果レコードの "stats"）。
+      contextvars で管理するので、asyncio のタスクや copy_context() で起動したスレッドにも引き継がれる
+
+段階 (stage) の名前:
+    export, annotator, parse, raw_df_processing, filter_abnormal_pairs, dp_fill, dp_traceback, coloring
+カウンター:
+    pairs (layer 分解に渡した塩基対), layers, dp_passes (DP の反復回数), dp_compressed_L (圧縮後の長さの合計),
+    decomposition_cache_hits / decomposition_cache_misses,
+    scratch_runs / scratch_bytes_written / scratch_files / scratch_memfd_bytes (作業ディレクトリへの書き込み)
+"""
+
+import contextvars
+import functools
+import json
+import pathlib
+import threading
+import time
+from contextlib import contextmanager
+
+STAGES = ("export", "annotator", "parse", "raw_df_processing", "filter_abnormal_pairs",
+          "dp_fill", "dp_traceback", "coloring")
+
+
+class Stats:
+    """段階ごとの (呼び出し回数, 合計秒, 最大秒) とカウンター"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}
+        self.counters = {}
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            calls, total, longest = self.stages.get(name, (0, 0.0, 0.0))
+            self.stages[name] = (calls + 1, total + seconds, max(longest, seconds))
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def merge(self, snapshot):
+        """snapshot() の dict（別プロセスの集計や結果レコードの "stats"）を足し込む"""
+        if not snapshot:
+            return
+        with self._lock:
+            for name, s in snapshot.get("stages", {}).items():
+                calls, total, longest = self.stages.get(name, (0, 0.0, 0.0))
+                self.stages[name] = (calls + s["calls"], total + s["total_sec"], max(longest, s["max_sec"]))
+            for name, n in snapshot.get("counters", {}).items():
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def reset(self):
+        with self._lock:
+            self.stages.clear()
+            self.counters.clear()
+
+    def snapshot(self):
+        """JSON にできる dict: {"stages": {name: {calls, total_sec, max_sec}}, "counters": {name: n}}"""
+        with self._lock:
+            return {
+                "stages": {
+                    name: {"calls": calls, "total_sec": round(total, 6), "max_sec": round(longest, 6)}
+                    for name, (calls, total, longest) in self.stages.items()
+                },
+                "counters": dict(self.counters),
+            }
+
+
+PROCESS_STATS = Stats()
+_TASK_STATS = contextvars.ContextVar("pkv_task_stats", default=None)
+
+
+@contextmanager
+def stage(name):
+    """ブロックの所要時間を段階 name として記録する（例外で抜けた場合も記録する）"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        PROCESS_STATS.add_time(name, elapsed)
+        task = _TASK_STATS.get()
+        if task is not None:
+            task.add_time(name, elapsed)
+
+
+def timed(name):
+    """関数全体を段階 name として記録するデコレーター"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, n=1):
+    PROCESS_STATS.count(name, n)
+    task = _TASK_STATS.get()
+    if task is not None:
+        task.count(name, n)
+
+
+@contextmanager
+def task_stats():
+    """ブロック内の stage / count を PROCESS_STATS とは別に集計する Stats を yield する"""
+    stats = Stats()
+    token = _TASK_STATS.set(stats)
+    try:
+        yield stats
+    finally:
+        _TASK_STATS.reset(token)
+
+
+def format_summary(snapshot, wall_sec=None):
+    """
+    段階ごとの合計時間と割合、カウンターを表示用の行のリストにする。
+    割合は段階の合計に対するもの（wall_sec を渡すと並列実行を含めた wall-clock に対する比も出す）。
+    """
+    stages = snapshot.get("stages", {})
+    total = sum(s["total_sec"] for s in stages.values()) or 1.0
+    order = [name for name in STAGES if name in stages] + sorted(set(stages) - set(STAGES))
+    lines = [f"{'stage':<22}{'calls':>8}{'total s':>12}{'max s':>10}{'share':>8}"]
+    for name in order:
+        s = stages[name]
+        lines.append(f"{name:<22}{s['calls']:>8}{s['total_sec']:>12.3f}{s['max_sec']:>10.3f}"
+                     f"{100 * s['total_sec'] / total:>7.1f}%")
+    if wall_sec:
+        lines.append(f"(stage total {sum(s['total_sec'] for s in stages.values()):.3f} s over {wall_sec:.3f} s wall-clock)")
+    counters = snapshot.get("counters", {})
+    if counters:
+        lines.append("counters: " + ", ".join(f"{name}={n}" for name, n in sorted(counters.items())))
+    return lines
+
+
+def to_prometheus(snapshot, prefix="pkv"):
+    """snapshot を Prometheus のテキスト形式 (text/plain; version=0.0.4) にする"""
+    stages = snapshot.get("stages", {})
+    lines = []
+    for metric, key, kind, help_text in (
+        ("stage_seconds_total", "total_sec", "counter", "Time spent in each pipeline stage"),
+        ("stage_calls_total", "calls", "counter", "Number of times each pipeline stage ran"),
+        ("stage_seconds_max", "max_sec", "gauge", "Longest single run of each pipeline stage"),
+    ):
+        lines.append(f"# HELP {prefix}_{metric} {help_text}")
+        lines.append(f"# TYPE {prefix}_{metric} {kind}")
+        lines.extend(f'{prefix}_{metric}{{stage="{name}"}} {s[key]}' for name, s in sorted(stages.items()))
+    for name, n in sorted(snapshot.get("counters", {}).items()):
+        lines.append(f"# TYPE {prefix}_{name}_total counter")
+        lines.append(f"{prefix}_{name}_total {n}")
+    return "\n".join(lines) + "\n"
+
+
+def write_stats(snapshot, path):
+    """snapshot を path に書き出す（拡張子が .prom なら Prometheus のテキスト形式、それ以外は JSON）"""
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.suffix == ".prom":
+        path.write_text(to_prometheus(snapshot))
+    else:
+        path.write_text(json.dumps(snapshot, indent=2) + "\n")
+    return path
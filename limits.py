@@ -0,0 +1,87 @@
+"""
+Resource limits for long-running (batch) jobs
+
+- time_limit: 純 Python の処理 (PKextractor の DP など) に wall-clock の上限をかける
+- set_memory_limit: プロセスのアドレス空間に上限をかける（子プロセスのアノテーターにも継承される）
+- classify_failure: 例外を失敗の種類 ("timeout" / "memory" / ...) に分類する
+"""
+
+import concurrent.futures
+import multiprocessing
+import signal
+import subprocess
+import threading
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class TaskTimeout(TimeoutError):
+    """time_limit で設定した時間を超えた"""
+
+
+@contextmanager
+def time_limit(seconds, what="task"):
+    """
+    ブロック内の処理が seconds 秒を超えたら TaskTimeout を送出する。
+
+    SIGALRM を使うので、メインスレッド以外（PyMOL の GUI スレッドなど）や
+    SIGALRM の無い環境では何もしない。seconds が None / 0 の場合も無制限。
+    """
+    if (not seconds or not hasattr(signal, "setitimer")
+            or threading.current_thread() is not threading.main_thread()):
+        yield
+        return
+
+    def _handler(signum, frame):
+        raise TaskTimeout(f"{what} exceeded the time limit of {seconds} s")
+
+    previous = signal.signal(signal.SIGALRM, _handler)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def set_memory_limit(megabytes):
+    """
+    このプロセス (と以降に起動する子プロセス) のアドレス空間を megabytes MB に制限する。
+    上限を超えた確保は MemoryError になり、OOM killer にプロセスごと殺されることを防ぐ。
+
+    Returns:
+        bool: 制限を設定できたか（resource が使えない環境では False）
+    """
+    if not megabytes or resource is None:
+        return False
+    limit = int(megabytes) * 1024 * 1024
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+    return True
+
+
+def classify_failure(exc):
+    """
+    例外を失敗の種類に分類する。
+
+    Returns:
+        str: "timeout", "memory", "annotator_failed", "crashed" (ワーカープロセスごと落ちた) or "error"
+    """
+    if isinstance(exc, BrokenProcessPool):
+        return "crashed"
+    # 結果を待つ側のタイムアウト（AsyncResult.get / Future.result）も timeout とする
+    if isinstance(exc, (TaskTimeout, subprocess.TimeoutExpired, multiprocessing.TimeoutError,
+                        concurrent.futures.TimeoutError)):
+        return "timeout"
+    if isinstance(exc, MemoryError):
+        return "memory"
+    if isinstance(exc, subprocess.CalledProcessError):
+        return "annotator_failed"
+    return "error"
@@ -0,0 +1,74 @@
+"""
+Logging
+
+パイプラインの関数は print せず、"pseudoknotvisualizer.<module>" の logger に出力する。
+ライブラリとして import した場合は何も表示しない（NullHandler）。CLI / PyMOL など表示先を持つ入口だけが
+configure_logging でハンドラーとレベルを設定する。batch / watch / serve / merge の進捗の行 ("[batch] ..." など) も
+INFO で出し、それぞれの入口が show_progress でレベルによらず表示する。
+
+レベルの目安:
+    DEBUG   : 構造ごとの詳細（DataFrame、塩基対の一覧、アノテーターのコマンドなど）
+    INFO    : 1 回の実行の要約（layer 数、出力ファイル）
+    WARNING : 結果に影響しうる状況（チェーンフィルタの無効化、大きな塩基対リストなど）
+メッセージに "Warning:" などの接頭辞は付けない（WARNING 以上はハンドラーがレベル名を前に付ける）。
+DEBUG のメッセージは %-形式の引数で渡し、DataFrame の整形のように重いものは
+logger.isEnabledFor(logging.DEBUG) で囲む（既定のレベルでは整形のコストがかからない）。
+"""
+
+import logging
+import sys
+
+LOGGER_NAME = "pseudoknotvisualizer"
+LOG_LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR")
+
+logging.getLogger(LOGGER_NAME).addHandler(logging.NullHandler())
+
+
+class _MessageFormatter(logging.Formatter):
+    """メッセージだけを出す。WARNING 以上は "WARNING: " のようにレベル名を前に付ける"""
+
+    def format(self, record):
+        message = super().format(record)
+        if record.levelno >= logging.WARNING:
+            return f"{record.levelname}: {message}"
+        return message
+
+
+def get_logger(module):
+    """module 用の logger（"pseudoknotvisualizer.<module>"）"""
+    return logging.getLogger(f"{LOGGER_NAME}.{module}")
+
+
+def configure_logging(level="INFO", stream=None, force=False):
+    """
+    "pseudoknotvisualizer" 以下の logger に、メッセージだけ（WARNING 以上はレベル名付き）を出すハンドラーを設定する。
+    すでに設定済みの場合は force=True でない限りレベルも変えない（PyMOL で再読み込みした場合など）。
+
+    Args:
+        level (str | int): "DEBUG", "INFO", "WARNING" or "ERROR"
+        stream: 出力先（既定: sys.stdout。以前の print と同じ）
+    """
+    logger = logging.getLogger(LOGGER_NAME)
+    handlers = [h for h in logger.handlers if getattr(h, "_pkv_handler", False)]
+    if handlers and not force:
+        return logger
+    for handler in handlers:
+        logger.removeHandler(handler)
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(_MessageFormatter("%(message)s"))
+    handler._pkv_handler = True
+    logger.addHandler(handler)
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+    logger.propagate = False
+    return logger
+
+
+def show_progress(*modules):
+    """
+    modules の logger（"batch", "watch" など）の INFO を、全体のレベルが WARNING 以上でも表示する。
+    configure_logging の後に、進捗の行を出す CLI の入口から呼ぶ（DEBUG / INFO の場合は何も変えない）。
+    """
+    for module in modules:
+        logger = get_logger(module)
+        if logger.getEffectiveLevel() > logging.INFO:
+            logger.setLevel(logging.INFO)
@@ -0,0 +1,189 @@
+"""
+PyMOL-free core of the pkv command
+
+PseudoknotVisualizer.py (PyMOL の pkv コマンド) のうち、PyMOL に依存しない部分:
+AtomTable からアノテーターを実行して塩基対を得る部分と、塩基対を pseudoknot layer に分解する部分。
+PyMOL 側は selection を AtomTable にして渡し、結果の layer で色付けするだけにする
+（ベンチマークやテストから PyMOL 無しで同じ処理を実行できる）。
+
+cancel (threading.Event) を渡すと、セットされた時点で実行中のアノテーターを kill して AnnotationCancelled を送出する
+（pkv_async のワーカースレッドから使う）。
+"""
+
+import os
+import pathlib
+import signal
+import subprocess
+
+from addressDSSROutput import load_dssr_data
+from addressRNAviewOutput import load_rnaview_data
+from CLI_PseudoknotVisualizer import decompose_pairs
+from config import DSSR_EXEC, RNAVIEW_DIR, RNAVIEW_EXEC
+from instrumentation import stage, task_stats
+from log_config import get_logger
+from structure_io import export_table, restore_chain_id
+from workdir import annotator_input, annotator_workdir
+
+logger = get_logger("pymol")
+
+CANCEL_POLL_SEC = 0.2
+
+
+class AnnotationCancelled(Exception):
+    """cancel がセットされたためアノテーターを止めた"""
+
+
+def run_annotator(argv, cancel=None, **kwargs):
+    """
+    subprocess.run(argv, check=True, capture_output=True, text=True, **kwargs) と同じ。
+    cancel がセットされると CANCEL_POLL_SEC 以内にプロセスを kill して AnnotationCancelled を送出する。
+    アノテーターがラッパースクリプトの場合もあるので、新しいセッションで起動してプロセスグループごと kill する。
+    """
+    if cancel is None:
+        return subprocess.run(argv, check=True, capture_output=True, text=True, **kwargs)
+    with subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                          start_new_session=True, **kwargs) as proc:
+        while True:
+            try:
+                stdout, stderr = proc.communicate(timeout=CANCEL_POLL_SEC)
+                break
+            except subprocess.TimeoutExpired:
+                if cancel.is_set():
+                    try:
+                        os.killpg(proc.pid, signal.SIGKILL)
+                    except (AttributeError, OSError):
+                        proc.kill()
+                    proc.communicate()
+                    raise AnnotationCancelled(f"{pathlib.Path(argv[0]).name} was cancelled")
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, argv, stdout, stderr)
+    return subprocess.CompletedProcess(argv, proc.returncode, stdout, stderr)
+
+
+def rnaview_table(table, chain, cancel=None):
+    """AtomTable (1 チェーン) に RNAView を実行し、塩基対の raw_df を返す"""
+    try:
+        # Check RNAView binary existence and guide user
+        if not pathlib.Path(RNAVIEW_EXEC).exists():
+            raise FileNotFoundError(
+                "RNAView binary not found. Expected at:\n"
+                f"  - {RNAVIEW_EXEC}\n\n"
+                "How to fix:\n"
+                "  1) Place the built 'rnaview' binary under 'RNAView/bin/rnaview' in this repository, or\n"
+                "  2) Edit 'config.py' and set RNAVIEW_EXEC to your installation (e.g., '/opt/RNAView/bin/rnaview').\n"
+                f"Also verify RNAVIEW_DIR points to: {RNAVIEW_DIR}"
+            )
+        # 呼び出しごとの専用作業ディレクトリ（同時実行される他のプロセスと干渉しない）
+        with annotator_workdir("rnaview") as workdir:
+            # RNAView は PDB のみ受け付ける（複数文字チェーンIDは 1 文字に置き換えて書き出す）
+            with stage("export"):
+                export = export_table(table, chain, workdir / f"chain_{chain}", annotator="RNAView")
+
+            with stage("annotator"):
+                if cancel is None:
+                    subprocess.run(
+                        [RNAVIEW_EXEC, "-p", "--pdb", str(export.path)],
+                        env={"RNAVIEW": RNAVIEW_DIR},
+                        cwd=workdir,
+                        check=True
+                    )
+                else:
+                    run_annotator([str(RNAVIEW_EXEC), "-p", "--pdb", str(export.path)], cancel,
+                                  env={"RNAVIEW": RNAVIEW_DIR}, cwd=workdir)
+            result_file = workdir / (export.path.name + ".out")
+            raw_df = load_rnaview_data(str(result_file))
+    except AnnotationCancelled:
+        raise
+    except Exception as e:
+        raise Exception("RNAVIEW failed or Exporting PDB failed: " + str(e))
+    return restore_chain_id(raw_df, export, chain)
+
+
+def dssr_table(table, chain, cancel=None):
+    """AtomTable (1 チェーン) に DSSR を実行し、塩基対の raw_df を返す"""
+    try:
+        # Check DSSR binary existence and guide user
+        if not pathlib.Path(DSSR_EXEC).exists():
+            raise FileNotFoundError(
+                "DSSR binary not found. Expected at:\n"
+                f"  - {DSSR_EXEC}\n\n"
+                "How to fix:\n"
+                "  1) Download 'x3dna-dssr' and place it under 'DSSR/x3dna-dssr' in this repository, or\n"
+                "  2) Edit 'config.py' and set DSSR_EXEC to your installation (e.g., '/usr/local/bin/x3dna-dssr').\n"
+                "On macOS, you may need: 'chmod +x x3dna-dssr' and allow it in System Settings > Privacy & Security."
+            )
+        # 呼び出しごとの専用作業ディレクトリ（同時実行される他のプロセスと干渉しない）
+        with annotator_workdir("dssr") as workdir:
+            # DSSR には mmCIF で渡す（巨大な複合体や複数文字チェーンIDでも PDB の上限に縛られない）
+            # SCRATCH_BACKEND="memfd" の場合は入力を匿名メモリファイルに書いて渡す
+            with annotator_input(workdir, "DSSR") as (input_path, pass_fds):
+                with stage("export"):
+                    export = export_table(table, chain, workdir / f"chain_{chain}", annotator="DSSR",
+                                          out_path=input_path)
+
+                # DSSR実行（JSONフォーマットで出力）
+                json_output_path = workdir / f"chain_{chain}.cif.dssr.json"
+                with stage("annotator"):
+                    run_annotator(
+                        [str(DSSR_EXEC), f"-i={export.path}", "--json", f"-o={json_output_path}"],
+                        cancel,
+                        cwd=workdir,
+                        pass_fds=pass_fds
+                    )
+            raw_df = load_dssr_data(str(json_output_path))
+    except AnnotationCancelled:
+        raise
+    except Exception as e:
+        raise Exception("DSSR failed or Exporting structure failed: " + str(e))
+    return restore_chain_id(raw_df, export, chain)
+
+
+def annotate_table(table, chain, annotator="RNAView", cancel=None):
+    """annotator ("DSSR" / "RNAView") で AtomTable の塩基対を得る"""
+    if annotator.upper() == "DSSR":
+        return dssr_table(table, chain, cancel)
+    elif annotator.upper() == "RNAVIEW":
+        return rnaview_table(table, chain, cancel)
+    raise ValueError(f"Unsupported annotator: {annotator}. Use 'DSSR' or 'RNAView'.")
+
+
+def decompose_annotation(raw_df, annotator="RNAView", include_all=False):
+    """
+    アノテーターの出力 raw_df を CLI と同じ decompose_pairs で pseudoknot layer に分解する
+    （layer 分解のキャッシュとその hit / miss の計数も CLI と共通）。
+
+    Returns:
+        tuple: (PKlayers, layer_notes) layer_notes は layer ごとの塩基対数の説明（表示用）
+    """
+    selected, PKlayers, _, dup_canonical_pairs = decompose_pairs(raw_df, annotator, include_all)
+    # 重複する canonical pairs がある場合は警告
+    if include_all and dup_canonical_pairs:
+        logger.warning("%d duplicate canonical pairs found and recorded.", len(dup_canonical_pairs))
+
+    # Layer statistics (when using non-canonical pairs)
+    is_canonical = {}
+    for position, canonical in zip(selected["position"], selected["is_canonical"]):
+        i, j = position
+        is_canonical[(i, j) if i < j else (j, i)] = bool(canonical)
+    layer_notes = []
+    for depth, PKlayer in enumerate(PKlayers):
+        if include_all:
+            canon_count = sum(1 for bp in PKlayer if is_canonical[bp])
+            noncanon_count = len(PKlayer) - canon_count
+            layer_notes.append(f"Layer {depth + 1}: {len(PKlayer)} pairs ({canon_count} canonical, {noncanon_count} non-canonical)")
+        else:
+            layer_notes.append(f"Layer {depth + 1}: {len(PKlayer)} canonical pairs")
+    return PKlayers, layer_notes
+
+
+def decompose_annotation_task(raw_df, annotator="RNAView", include_all=False):
+    """
+    layer 分解のプロセスで実行する decompose_annotation。
+    子プロセスの段階の時間とカウンターは親の PROCESS_STATS に届かないので、その snapshot も返す。
+
+    Returns:
+        tuple: (PKlayers, layer_notes, stats) stats は Stats.snapshot() の dict
+    """
+    with task_stats() as stats:
+        PKlayers, layer_notes = decompose_annotation(raw_df, annotator, include_all)
+    return PKlayers, layer_notes, stats.snapshot()
@@ -0,0 +1,122 @@
+"""
+Profiling capture
+
+batch --profile-top K で、チェーンごとに cProfile と tracemalloc を動かし、
+最も遅い K 件と最もメモリを使った K 件のプロファイルだけを残す（実行が急に遅くなった時に、
+手で cProfile を付けて再現しなくて済むように）。
+
+    ワーカー: TaskProfiler.profile(name) の中で解析し、<name>.pstats と <name>.tracemalloc を書く
+    メイン  : ProfileKeeper.add(info) で上位 K 件に入らなくなったファイルを消し、最後に profiles.json を書く
+
+残るファイル:
+    <name>.pstats      cProfile の結果（python -m pstats <file>、snakeviz などで読む）
+    <name>.tracemalloc tracemalloc.Snapshot.dump（tracemalloc.Snapshot.load(path).statistics("lineno")）
+                       ピーク (peak_bytes) は正確な値、スナップショットはタスクの終了時点でまだ確保されているメモリ
+    profiles.json      残したプロファイルと入力 (pdb_id, model, chain, input) の一覧
+
+アノテーターは別プロセスなので、cProfile ではその待ち時間、tracemalloc では Python 側の確保だけが見える。
+--profile-top を付けない場合はワーカーで何もしない（計測のオーバーヘッドは無い）。
+"""
+
+import cProfile
+import heapq
+import itertools
+import json
+import os
+import pathlib
+import re
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+TRACEMALLOC_FRAMES = 10
+
+
+def profile_name(pdb_id, model, chain, attempt=1):
+    """プロファイルのファイル名（拡張子なし）"""
+    name = f"{pdb_id}_{model}_{chain}_attempt{attempt}"
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", name)
+
+
+class TaskProfiler:
+    """ワーカー側: 1 タスク分の cProfile と tracemalloc を取り、out_dir に書き出す"""
+
+    def __init__(self, out_dir, frames=TRACEMALLOC_FRAMES):
+        self.out_dir = pathlib.Path(out_dir)
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        self.frames = frames
+        self._seq = itertools.count(1)
+
+    @contextmanager
+    def profile(self, name, **identity):
+        """
+        ブロックの間 cProfile と tracemalloc を動かす。yield する dict に、ブロックを抜けた後
+        elapsed_sec, peak_bytes, pstats, snapshot（ファイルのパス）が入る（identity もそのまま入る）。
+        """
+        # manifest に同じチェーンが複数回現れても上書きしないよう、ワーカーの pid と通し番号を付ける
+        name = f"{name}.{os.getpid()}-{next(self._seq)}"
+        info = dict(identity, name=name)
+        profiler = cProfile.Profile()
+        tracemalloc.start(self.frames)
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            yield info
+        finally:
+            profiler.disable()
+            elapsed = time.perf_counter() - start
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            pstats_path = self.out_dir / f"{name}.pstats"
+            snapshot_path = self.out_dir / f"{name}.tracemalloc"
+            profiler.dump_stats(pstats_path)
+            snapshot.dump(str(snapshot_path))
+            info.update(elapsed_sec=round(elapsed, 4), peak_bytes=peak,
+                        pstats=str(pstats_path), snapshot=str(snapshot_path))
+
+
+class ProfileKeeper:
+    """
+    メイン側: 完了したタスクのプロファイルのうち、所要時間の上位 top_k 件と
+    ピークメモリの上位 top_k 件だけを残し、それ以外のファイルは消す。
+    """
+
+    def __init__(self, out_dir, top_k):
+        self.out_dir = pathlib.Path(out_dir)
+        self.top_k = top_k
+        self._slowest = []  # (elapsed_sec, seq, info) の最小ヒープ
+        self._largest = []  # (peak_bytes, seq, info) の最小ヒープ
+        self._seq = 0
+
+    def _kept(self):
+        return {id(info) for heap in (self._slowest, self._largest) for _, _, info in heap}
+
+    def add(self, info):
+        self._seq += 1
+        dropped = []
+        for heap, value in ((self._slowest, info["elapsed_sec"]), (self._largest, info["peak_bytes"])):
+            item = (value, self._seq, info)
+            if len(heap) < self.top_k:
+                heapq.heappush(heap, item)
+            else:
+                dropped.append(heapq.heappushpop(heap, item)[2])
+        kept = self._kept()
+        for old in dropped:
+            if id(old) not in kept:
+                for key in ("pstats", "snapshot"):
+                    pathlib.Path(old[key]).unlink(missing_ok=True)
+
+    def summary(self):
+        """{"slowest": [...], "largest_peak_memory": [...]}（それぞれ大きい順）"""
+        return {
+            "slowest": [info for _, _, info in sorted(self._slowest, reverse=True)],
+            "largest_peak_memory": [info for _, _, info in sorted(self._largest, reverse=True)],
+        }
+
+    def write_index(self):
+        """profiles.json を書き、そのパスを返す"""
+        path = self.out_dir / "profiles.json"
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.summary(), indent=2, ensure_ascii=False) + "\n")
+        return path
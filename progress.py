@@ -0,0 +1,304 @@
+"""
+Progress reporting
+
+batch / analysis の進捗を、ワーカーから送られるイベントで集計して端末とステータスファイルに出す。
+
+    tracker = ProgressTracker(costs={key: 推定秒数}, workers=4, status_path="run.status.json", live=True)
+    with tracker, Pool(initializer=init_worker_events, initargs=(tracker.events,)) as pool:
+        ...
+    # ワーカー側
+    emit("start", key)
+    emit("done", key, ok=1, failed=0, pairs=120, annotator_sec={"DSSR": [0.4]})
+
+- ワーカーは multiprocessing.Queue にイベントを入れるだけで、集計と表示はメインプロセスのスレッドが行う
+  （ワーカーの標準出力に頼らないので、並列実行でも表示が崩れない）
+- 表示: 完了・失敗・実行中の件数、構造/秒と塩基対/秒、アノテーターごとの所要時間の p50 / p95、ETA、
+  ワーカーごとに処理中の構造
+- ETA は dataset index の推定コスト（前回の実行時間、無ければ原子数から推定）の残りを、
+  ここまでに完了した分の「推定コストあたりの実時間」で換算する（並列度は自動的に反映される）
+- status_path は interval 秒ごとに書き直す（一時ファイルから置き換えるので、読む側が途中の状態を見ない）
+"""
+
+import json
+import math
+import multiprocessing
+import os
+import pathlib
+import queue
+import sys
+import threading
+import time
+
+_EVENTS = None  # ワーカー側: イベントの送り先
+
+
+def init_worker_events(events):
+    """Pool の initializer: このプロセスの emit() の送り先を設定する"""
+    global _EVENTS
+    _EVENTS = events
+
+
+def emit(kind, key, **fields):
+    """イベントを送る（送り先が設定されていなければ何もしない）"""
+    if _EVENTS is not None:
+        _EVENTS.put(dict(fields, type=kind, key=key, pid=os.getpid(), time=time.time()))
+
+
+def record_fields(records, annotator):
+    """
+    batch の結果レコードのリストから "done" イベントの内容を作る。
+    塩基対数は layer 分解に渡した数（instrumentation の "pairs"）、アノテーターの所要時間は
+    "stats" の annotator 段階（--annotator both の場合は annotator_elapsed_sec）を使う。
+    """
+    fields = {"ok": 0, "failed": 0, "pairs": 0, "annotator_sec": {}}
+    for record in records:
+        fields["ok" if record["status"] == "ok" else "failed"] += 1
+        stats = record.get("stats") or {}
+        fields["pairs"] += stats.get("counters", {}).get("pairs", 0)
+        if "annotator_elapsed_sec" in record:
+            per_annotator = {name: sec for name, sec in record["annotator_elapsed_sec"].items() if name != "wall"}
+        elif "annotator" in stats.get("stages", {}):
+            per_annotator = {annotator: stats["stages"]["annotator"]["total_sec"]}
+        else:
+            per_annotator = {}
+        for name, sec in per_annotator.items():
+            fields["annotator_sec"].setdefault(name, []).append(sec)
+    return fields
+
+
+def percentile(values, q):
+    """nearest-rank の百分位数（values は昇順に並べておく）"""
+    if not values:
+        return None
+    return values[min(len(values), max(1, math.ceil(q / 100 * len(values)))) - 1]
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return "--:--:--"
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+class ProgressTracker:
+    """
+    ワーカーからのイベントを集計し、interval 秒ごとに端末 (stream) と status_path に出す。
+
+    Args:
+        costs (dict): 処理単位のキー -> 推定コスト（秒）。キーの数が全体の件数になる
+        workers (int): ワーカー数（何も完了していない間の ETA に使う）
+        status_path (str | Path): 状態を JSON で書き直すファイル（headless 実行の監視用）
+        live (bool): 端末に状態の行を出す（端末なら同じ行を書き直し、それ以外は interval ごとに 1 行）
+        interval (float): 表示とステータスファイルの更新間隔（秒）
+        label (str): 表示の接頭辞（"[batch]" など）
+        mp_context: events の Queue を作る multiprocessing のコンテキスト（ワーカーと同じ start method にする）
+    """
+
+    def __init__(self, costs, workers=1, status_path=None, live=False, interval=2.0, stream=None, label="progress",
+                 mp_context=None):
+        self.costs = dict(costs)
+        self.workers = max(1, workers)
+        self.status_path = pathlib.Path(status_path) if status_path else None
+        self.live = live
+        self.interval = interval
+        self.stream = stream or sys.stderr
+        self.label = label
+        self.events = (mp_context or multiprocessing).Queue()
+        self._tty = live and self.stream.isatty()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._line_shown = False
+
+        self.started = None
+        self.status = {}          # key -> "ok" / "failed"（再試行に回したものは消す）
+        self.running = {}         # pid -> (key, 開始時刻)
+        self.chains_ok = 0
+        self.chains_failed = {}   # key -> 最後の試行で失敗したチェーン数
+        self.pairs = 0
+        self.latency = {}         # annotator -> 所要時間のリスト（昇順に保つ）
+        self.done_cost = 0.0      # 完了した分の推定コスト（再試行した分も含む）
+        self.remaining_cost = sum(self.costs.values())
+
+    # ---- 集計 ----
+
+    def _handle(self, event):
+        key = event["key"]
+        if event["type"] == "start":
+            self.running[event["pid"]] = (key, event["time"])
+            return
+        if event["type"] != "done":
+            return
+        running = self.running.get(event["pid"])
+        if running is not None and running[0] == key:
+            del self.running[event["pid"]]
+        cost = self.costs.get(key, 0.0)
+        self.done_cost += cost
+        self.remaining_cost = max(0.0, self.remaining_cost - cost)
+        self.status[key] = "failed" if event.get("failed") else "ok"
+        self.chains_ok += event.get("ok", 0)
+        self.chains_failed[key] = event.get("failed", 0)
+        self.pairs += event.get("pairs", 0)
+        for name, secs in event.get("annotator_sec", {}).items():
+            values = self.latency.setdefault(name, [])
+            values.extend(secs)
+            values.sort()
+
+    def lost(self, key, failed=1):
+        """
+        ワーカープロセスごと失われた処理単位 key を失敗として数える
+        （"done" のイベントが届かないので、メインプロセスから呼ぶ）。
+        """
+        with self._lock:
+            for pid, (running_key, _) in list(self.running.items()):
+                if running_key == key:
+                    del self.running[pid]
+            self._handle({"type": "done", "key": key, "pid": None, "failed": failed})
+
+    def retry(self, key, new_key=None):
+        """
+        key を再試行に回す（失敗の件数から外し、残りのコストに戻す）。
+        再試行では処理単位のキーが変わる場合（失敗したチェーンだけをやり直すなど）は new_key に付け替える。
+        """
+        with self._lock:
+            self.status.pop(key, None)
+            self.chains_failed.pop(key, None)
+            if new_key is not None and new_key != key:
+                self.costs[new_key] = self.costs.pop(key, 0.0)
+                key = new_key
+            self.remaining_cost += self.costs.get(key, 0.0)
+
+    def snapshot(self):
+        """ステータスファイルに書く dict"""
+        with self._lock:
+            now = time.time()
+            elapsed = now - self.started if self.started else 0.0
+            completed = sum(1 for s in self.status.values() if s == "ok")
+            failed = len(self.status) - completed
+            finished = len(self.status)
+            if self.remaining_cost <= 0 and finished >= len(self.costs):
+                eta = 0.0
+            elif self.done_cost > 0:
+                eta = self.remaining_cost * elapsed / self.done_cost
+            else:
+                eta = self.remaining_cost / self.workers if self.remaining_cost else None
+            return {
+                "label": self.label,
+                "updated": now,
+                "elapsed_sec": round(elapsed, 1),
+                "total": len(self.costs),
+                "completed": completed,
+                "failed": failed,
+                "in_flight": len(self.running),
+                "pending": max(0, len(self.costs) - finished - len(self.running)),
+                "chains_ok": self.chains_ok,
+                "chains_failed": sum(self.chains_failed.values()),
+                "pairs": self.pairs,
+                "structures_per_sec": round(finished / elapsed, 3) if elapsed else 0.0,
+                "pairs_per_sec": round(self.pairs / elapsed, 1) if elapsed else 0.0,
+                "eta_sec": round(eta, 1) if eta is not None else None,
+                "annotator_latency_sec": {
+                    name: {"n": len(values), "p50": percentile(values, 50), "p95": percentile(values, 95),
+                           "max": values[-1]}
+                    for name, values in sorted(self.latency.items()) if values
+                },
+                "workers": {
+                    str(pid): {"key": key, "running_sec": round(now - since, 1)}
+                    for pid, (key, since) in sorted(self.running.items())
+                },
+            }
+
+    # ---- 表示 ----
+
+    def format_line(self, snap):
+        latency = " ".join(
+            f"{name} p50 {s['p50']:.2f}s p95 {s['p95']:.2f}s" for name, s in snap["annotator_latency_sec"].items()
+        )
+        slowest = max(snap["workers"].values(), key=lambda w: w["running_sec"], default=None)
+        parts = [
+            f"{snap['completed'] + snap['failed']}/{snap['total']} structures "
+            f"({snap['failed']} failed, {snap['in_flight']} running)",
+            f"{snap['structures_per_sec']:.2f} structures/s, {snap['pairs_per_sec']:.0f} pairs/s",
+        ]
+        if latency:
+            parts.append(latency)
+        if slowest is not None:
+            parts.append(f"oldest {slowest['key']} {slowest['running_sec']:.0f}s")
+        parts.append(f"ETA {format_duration(snap['eta_sec'])}")
+        return f"[{self.label}] " + " | ".join(parts)
+
+    def clear_line(self):
+        """進捗の行を消す（他の出力の前に呼び、端末で進捗の行と混ざらないようにする）"""
+        with self._lock:
+            if self._tty and self._line_shown:
+                self.stream.write("\r\033[K")
+                self.stream.flush()
+                self._line_shown = False
+
+    def report(self):
+        snap = self.snapshot()
+        if self.status_path is not None:
+            self.status_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.status_path.with_name(f"{self.status_path.name}.{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(snap, indent=2) + "\n")
+            os.replace(tmp, self.status_path)
+        if self.live:
+            line = self.format_line(snap)
+            with self._lock:
+                if self._tty:
+                    sys.stdout.flush()
+                    self.stream.write("\r\033[K" + line)
+                    self._line_shown = True
+                else:
+                    self.stream.write(line + "\n")
+                self.stream.flush()
+        return snap
+
+    # ---- イベントを受け取るスレッド ----
+
+    def _run(self):
+        next_report = time.time() + self.interval
+        while True:
+            try:
+                event = self.events.get(timeout=max(0.05, min(0.5, next_report - time.time())))
+            except queue.Empty:
+                event = None
+            if event == "stop":
+                # ワーカーの送信スレッドに残っているイベントを少し待って取り込む
+                try:
+                    while True:
+                        event = self.events.get(timeout=0.1)
+                        with self._lock:
+                            self._handle(event)
+                except queue.Empty:
+                    return
+            if event is not None:
+                with self._lock:
+                    self._handle(event)
+            if time.time() >= next_report:
+                self.report()
+                next_report = time.time() + self.interval
+
+    def start(self):
+        self.started = time.time()
+        self._thread = threading.Thread(target=self._run, name="pkv-progress", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """残りのイベントを集計し、最後の状態を出す"""
+        if self._thread is not None:
+            self.events.put("stop")
+            self._thread.join()
+            self._thread = None
+        snap = self.report()
+        if self._tty and self._line_shown:
+            self.stream.write("\n")
+            self.stream.flush()
+            self._line_shown = False
+        return snap
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -1,3 +1,9 @@
+from instrumentation import count, stage
+from log_config import get_logger
+
+logger = get_logger("rna")
+
+
 
 def BasePairList_compression(BPL):
     # initialization:
@@ -77,7 +83,7 @@ def PKextractor(BPL, compression=True):
         raise ValueError("BPL contains self-pairs (i, i). Please remove them before extracting pseudoknot layers.")
     
     PK_layers = []
-    if len(BPL) > 300: print(f"Warning: BPL is too large {len(BPL)}. This may take a long time to process.")
+    if len(BPL) > 300: logger.warning("BPL is too large %d. This may take a long time to process.", len(BPL))
     counter = 0
     while BPL:
         # initialization:
@@ -90,24 +96,41 @@ def PKextractor(BPL, compression=True):
             BPL, inv_hash, L = BasePairList_compression(BPL)
         else:
             L = max(BPL, key=lambda x: x[1])[1] + 1
-        gamma = [[-1 for j in range(L)] for i in range(L)]
-        for i in range(L):
-            gamma[i][i] = 0
-        for i in range(1, L):
-            gamma[i][i-1] = 0
-
-        # recursion:
-        for d in range(1, L):  # k: diagonal index
-            j = L
-            for i in range(L-d-1, -1, -1):
-                j -= 1
-                max_candidate = [gamma[i+1][j], gamma[i][j-1],
-                                 (gamma[i+1][j-1] + int((i, j) in BPL))]
-                max_candidate.append(
-                    max([(gamma[i][k] + gamma[k+1][j]) for k in range(i, j)]))
-                gamma[i][j] = max(max_candidate)
-        PK_layer, BPL = PK_traceback(gamma, BPL, L)
-        if compression:
-            PK_layer, BPL = decompress_PKlayer_BPL(PK_layer, BPL, inv_hash)
+        count("dp_passes")
+        count("dp_compressed_L", L)
+        with stage("dp_fill"):
+            gamma = [[-1 for j in range(L)] for i in range(L)]
+            for i in range(L):
+                gamma[i][i] = 0
+            for i in range(1, L):
+                gamma[i][i-1] = 0
+
+            # recursion:
+            for d in range(1, L):  # k: diagonal index
+                j = L
+                for i in range(L-d-1, -1, -1):
+                    j -= 1
+                    max_candidate = [gamma[i+1][j], gamma[i][j-1],
+                                     (gamma[i+1][j-1] + int((i, j) in BPL))]
+                    max_candidate.append(
+                        max([(gamma[i][k] + gamma[k+1][j]) for k in range(i, j)]))
+                    gamma[i][j] = max(max_candidate)
+        with stage("dp_traceback"):
+            PK_layer, BPL = PK_traceback(gamma, BPL, L)
+            if compression:
+                PK_layer, BPL = decompress_PKlayer_BPL(PK_layer, BPL, inv_hash)
         PK_layers.append(PK_layer)
     return PK_layers
+
+
+def PKextractor_uncompressed(BPL):
+    """圧縮せずに元の塩基番号のまま DP を行う PKextractor（入力のリストは変更しない）"""
+    return PKextractor(list(BPL), compression=False)
+
+
+# layer 分解のエンジン: 名前 -> BPL を受け取り layers を返す関数
+# "dp" が基準（CLI / PyMOL / analysis が使う）。他のエンジンは benchmarks/ で速度と結果を比較する
+PK_ENGINES = {
+    "dp": PKextractor,
+    "dp_uncompressed": PKextractor_uncompressed,
+}
@@ -0,0 +1,441 @@
+"""
+Local decomposition service
+
+CLI を毎回起動すると、Python の起動と pandas / Biopython / config の import が DP 本体より重くなる。
+serve は 1 つの常駐プロセスでそれらを読み込んだまま、localhost の HTTP または Unix ソケットで
+解析リクエストを受け付け、上限付きのワーカープールで処理する。
+
+    $ python CLI_PseudoknotVisualizer.py serve --port 8765 -j 4
+    $ python CLI_PseudoknotVisualizer.py serve --socket /tmp/pkv.sock
+
+API (JSON):
+    POST /analyze  {"input": "/path/to/1kpd.cif", "chain": "A", "annotator": "DSSR",
+                    "include_all": false, "format": "pymol", "model": null}
+                   "input" の代わりに {"structure": "<PDB/mmCIF の本文>", "structure_format": "pdb", "name": "1KPD"}
+                   も受け付ける
+        -> {"status": "ok", "result": <analyze_chain と同じ dict>, "script": "<format を指定した場合>",
+            "cached": bool, "elapsed_sec": float}
+        失敗時は {"status": "error", "error_type", "error"} (400: リクエストの誤り, 422: 解析の失敗, 503: 混雑)
+    GET /health    稼働状況（ワーカー数, 処理中の件数, キャッシュのヒット数など）
+    GET /metrics   段階ごとの所要時間とカウンター（Prometheus のテキスト形式）
+
+キャッシュ:
+    - 結果: (入力の SHA-256, チェーン, アノテーター, include_all) -> 結果 dict（サービスのプロセス内、LRU）
+    - アノテーション: (入力の SHA-256, チェーン, アノテーター) -> アノテーターの出力（各ワーカー内、LRU）。
+      同じ構造を include_all だけ変えて再度要求された場合にアノテーターを実行し直さない
+    - layer 分解: 塩基対リスト -> layers（各ワーカー内、CLI_PseudoknotVisualizer.pk_layers）
+"""
+
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import signal
+import socketserver
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import cpu_count
+
+from instrumentation import PROCESS_STATS, Stats, task_stats, to_prometheus
+from batch import WorkerPool
+from limits import classify_failure
+from log_config import get_logger
+
+logger = get_logger("serve")
+
+DEFAULT_PORT = 8765
+DEFAULT_RESULT_CACHE_SIZE = 256
+ANNOTATION_CACHE_SIZE = 64
+STRUCTURE_FORMATS = {"pdb": ".pdb", "cif": ".cif", "mmcif": ".cif"}
+
+# ワーカープロセスごとに一度だけ初期化される状態（_init_service_worker を参照）
+_WORKER = {}
+
+
+class ServiceError(Exception):
+    """リクエストの誤り（HTTP 400 で返す）"""
+
+
+class LRUCache:
+    """スレッドセーフな LRU キャッシュ（ヒット数・ミス数を数える）"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def stats(self):
+        return {"size": len(self._items), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+def _init_service_worker(limits=None):
+    """
+    ワーカー初期化: パイプライン本体と colors.json をプロセスごとに一度だけ読み込む。
+    """
+    import CLI_PseudoknotVisualizer as cli
+    from config import ANNOTATOR_TIMEOUT, PKEXTRACTOR_TIMEOUT
+    from limits import set_memory_limit
+
+    # 端末の Ctrl-C はサービス本体だけが受け取り、ワーカーはプールの shutdown で止める
+    # （ワーカーが先に死ぬとプールが壊れ、処理中の他のリクエストまで失敗するため）。
+    # serve の SIGTERM ハンドラーも引き継がない
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    limits = limits or {}
+    set_memory_limit(limits.get("memory_mb"))
+    _WORKER.update(
+        cli=cli,
+        annotations=LRUCache(ANNOTATION_CACHE_SIZE),
+        annotator_timeout=limits.get("annotator_timeout") or ANNOTATOR_TIMEOUT,
+        dp_timeout=limits.get("dp_timeout") or PKEXTRACTOR_TIMEOUT,
+    )
+
+
+def _analyze_task(task):
+    """
+    ワーカーで 1 リクエストを解析する。
+    CLI の analyze_chain と同じ dict を返し、例外は失敗の dict にして返す（"stats" にこのリクエストの段階ごとの集計）。
+    """
+    path, input_hash, chain_id, annotator, include_all = task
+    cli = _WORKER["cli"]
+    start = time.perf_counter()
+    with task_stats() as stats:
+        try:
+            if annotator.lower() == "both":
+                result = cli.analyze_chain(path, chain_id, annotator, include_all,
+                                           annotator_timeout=_WORKER["annotator_timeout"],
+                                           dp_timeout=_WORKER["dp_timeout"])
+            else:
+                key = (input_hash, chain_id, annotator.upper())
+                raw_df = _WORKER["annotations"].get(key)
+                if raw_df is None:
+                    raw_df = cli.annotate_chain(path, chain_id, annotator, timeout=_WORKER["annotator_timeout"])
+                    _WORKER["annotations"].put(key, raw_df)
+                decomposed = cli.decompose_variants(raw_df, annotator, (include_all,), timeout=_WORKER["dp_timeout"])
+                result = cli.chain_result(path, chain_id, annotator, include_all, *decomposed[include_all])
+            reply = {"status": "ok", "result": result, "worker_sec": round(time.perf_counter() - start, 4)}
+        except Exception as e:
+            reply = {"status": "error", "error_type": classify_failure(e), "error": f"{type(e).__name__}: {e}"}
+    reply["stats"] = stats.snapshot()
+    return reply
+
+
+def _file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class DecompositionService:
+    """
+    リクエストの検証・結果キャッシュ・ワーカープールへの投入を行う（HTTP 部分とは独立）。
+    処理中と待ち行列の合計が max_pending を超えるリクエストは断る（混雑時にメモリと待ち時間を増やさない）。
+    """
+
+    def __init__(self, processes=None, max_pending=None, cache_size=DEFAULT_RESULT_CACHE_SIZE,
+                 annotator_timeout=None, dp_timeout=None, memory_mb=None, max_tasks_per_child=1000):
+        import CLI_PseudoknotVisualizer as cli  # スクリプト生成用（サービスのプロセスでも温めておく）
+        from config import ANNOTATOR_TIMEOUT, PKEXTRACTOR_TIMEOUT
+
+        self.cli = cli
+        self.processes = max(1, processes or cpu_count())
+        self.max_pending = max_pending or 4 * self.processes
+        self.results = LRUCache(cache_size)
+        annotator_timeout, dp_timeout = annotator_timeout or ANNOTATOR_TIMEOUT, dp_timeout or PKEXTRACTOR_TIMEOUT
+        # どちらかが無制限 (None) なら応答も待ち続ける
+        self.request_timeout = (None if annotator_timeout is None or dp_timeout is None
+                                else annotator_timeout * 2 + dp_timeout + 30)
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self.counters = {"requests": 0, "ok": 0, "errors": 0, "rejected": 0, "in_flight": 0}
+        self.started = time.time()
+        self.stats = Stats()  # ワーカーから返された段階ごとの集計
+        limits = {"annotator_timeout": annotator_timeout, "dp_timeout": dp_timeout, "memory_mb": memory_mb}
+        # ワーカーが kill されても（OOM killer, segfault など）その future は BrokenProcessPool で終わり、
+        # プールは次の submit で作り直される
+        self.pool = WorkerPool(self.processes, initializer=_init_service_worker, initargs=(limits,),
+                               max_tasks_per_child=max_tasks_per_child)
+
+    def close(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+    def _count(self, key, delta=1):
+        with self._lock:
+            self.counters[key] += delta
+
+    def health(self):
+        return {
+            "status": "ok",
+            "workers": self.processes,
+            "max_pending": self.max_pending,
+            "uptime_sec": round(time.time() - self.started, 1),
+            **self.counters,
+            "result_cache": self.results.stats(),
+        }
+
+    def metrics(self):
+        """ワーカーの段階ごとの集計に、このプロセスの集計（スクリプト生成）とリクエスト数を足したもの"""
+        stats = Stats()
+        stats.merge(self.stats.snapshot())
+        stats.merge(PROCESS_STATS.snapshot())
+        cache = self.results.stats()
+        for name in ("requests", "ok", "errors", "rejected"):
+            stats.count(name, self.counters[name])
+        stats.count("result_cache_hits", cache["hits"])
+        stats.count("result_cache_misses", cache["misses"])
+        return to_prometheus(stats.snapshot())
+
+    def _materialize(self, request, tmpdir):
+        """リクエストの構造をファイルのパスにする（本文で送られた場合は一時ファイルに書く）"""
+        if request.get("input"):
+            path = pathlib.Path(request["input"])
+            if not path.is_file():
+                raise ServiceError(f"input not found: {path}")
+            return path
+        if request.get("structure"):
+            fmt = str(request.get("structure_format", "pdb")).lower()
+            if fmt not in STRUCTURE_FORMATS:
+                raise ServiceError(f"unsupported structure_format: {fmt} (use pdb or cif)")
+            name = pathlib.Path(str(request.get("name") or "structure")).name
+            path = pathlib.Path(tmpdir) / (name + STRUCTURE_FORMATS[fmt])
+            path.write_text(request["structure"])
+            return path
+        raise ServiceError('request needs "input" (a path) or "structure" (file contents)')
+
+    def analyze(self, request):
+        """
+        1 リクエストを処理して (HTTP ステータス, 応答の dict) を返す。
+        """
+        start = time.perf_counter()
+        self._count("requests")
+        if not self._slots.acquire(blocking=False):
+            self._count("rejected")
+            return 503, {"status": "error", "error_type": "busy",
+                         "error": f"too many pending requests (max {self.max_pending})"}
+        self._count("in_flight")
+        tmpdir = None
+        pending = None
+        state = {"abandoned": False}
+        state_lock = threading.Lock()
+
+        def release():
+            if tmpdir is not None:
+                shutil.rmtree(tmpdir, ignore_errors=True)
+            self._count("in_flight", -1)
+            self._slots.release()
+
+        def on_task_done(_):
+            # 応答がタイムアウトした後にタスクが終わった場合だけ、ここで枠と一時ディレクトリを返す
+            with state_lock:
+                abandoned = state["abandoned"]
+            if abandoned:
+                release()
+
+        try:
+            chain_id = request.get("chain")
+            annotator = request.get("annotator", "RNAView")
+            include_all = bool(request.get("include_all", False))
+            fmt = request.get("format")
+            if not chain_id:
+                raise ServiceError('"chain" is required')
+            if annotator.upper() not in ("DSSR", "RNAVIEW", "BOTH"):
+                raise ServiceError("annotator must be 'DSSR', 'RNAView' or 'both'")
+            if fmt is not None and fmt not in ("pymol", "chimera"):
+                raise ServiceError("format must be 'pymol' or 'chimera'")
+            if request.get("structure"):
+                tmpdir = tempfile.mkdtemp(prefix="pkv_serve_")
+            path = self._materialize(request, tmpdir)
+            input_hash = _file_sha256(path)
+
+            key = (input_hash, chain_id, annotator.upper(), include_all)
+            result = self.results.get(key)
+            cached = result is not None
+            if cached:
+                # 同じ内容の別ファイルでも、入力のパスと名前はこのリクエストのものにする
+                result = dict(result, input=str(path), pdb_id=self.cli.structure_stem(path))
+            else:
+                pending = self.pool.submit(_analyze_task, (path, input_hash, chain_id, annotator, include_all))
+                # ワーカーが kill された場合も future は（BrokenProcessPool で）終わるので、枠は必ず返る
+                pending.add_done_callback(on_task_done)
+                try:
+                    reply = pending.result(self.request_timeout)
+                except TimeoutError as e:
+                    raise TimeoutError(f"no result within {self.request_timeout} s") from e
+                self.stats.merge(reply.pop("stats", None))
+                if reply["status"] != "ok":
+                    self._count("errors")
+                    return 422, reply
+                result = reply["result"]
+                self.results.put(key, result)
+
+            response = {"status": "ok", "result": result, "cached": cached}
+            if fmt is not None:
+                layers = result["layers"] if "layers" in result else None
+                if layers is None:
+                    response["scripts"] = {
+                        name: self.cli.coloring_script(sub["pdb_id"], chain_id, sub["layers"], fmt, request.get("model"))
+                        for name, sub in result["annotators"].items()
+                    }
+                else:
+                    response["script"] = self.cli.coloring_script(result["pdb_id"], chain_id, layers, fmt,
+                                                                  request.get("model"))
+            response["elapsed_sec"] = round(time.perf_counter() - start, 4)
+            self._count("ok")
+            return 200, response
+        except ServiceError as e:
+            self._count("errors")
+            return 400, {"status": "error", "error_type": "bad_request", "error": str(e)}
+        except Exception as e:
+            self._count("errors")
+            return 500, {"status": "error", "error_type": classify_failure(e), "error": f"{type(e).__name__}: {e}"}
+        finally:
+            # 枠と一時ディレクトリは、プールに渡したタスクが終わるまで（応答がタイムアウトした後も）持ち続ける
+            with state_lock:
+                finished = pending is None or pending.done()
+                state["abandoned"] = not finished
+            if finished:
+                release()
+
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+    server_version = "PseudoknotVisualizer"
+    protocol_version = "HTTP/1.1"  # keep-alive（負荷試験やフロントエンドが接続を使い回せる）
+
+    def _reply(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/health":
+            self._reply(200, self.server.service.health())
+        elif self.path.rstrip("/") == "/metrics":
+            data = self.server.service.metrics().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        else:
+            self._reply(404, {"status": "error", "error_type": "not_found", "error": f"unknown path: {self.path}"})
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/analyze":
+            self._reply(404, {"status": "error", "error_type": "not_found", "error": f"unknown path: {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(request, dict):
+                raise ValueError("request body must be a JSON object")
+        except ValueError as e:
+            self._reply(400, {"status": "error", "error_type": "bad_request", "error": f"invalid JSON: {e}"})
+            return
+        self._reply(*self.server.service.analyze(request))
+
+    def address_string(self):
+        # Unix ソケットでは client_address が空になる
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            logger.info("[serve] %s %s", self.address_string(), format % args)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name, self.server_port = "localhost", 0
+
+
+def make_server(service, host="127.0.0.1", port=DEFAULT_PORT, socket_path=None, verbose=False):
+    """localhost の HTTP サーバー、または socket_path を指定した場合は Unix ソケットの HTTP サーバーを作る"""
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = UnixHTTPServer(socket_path, ServiceRequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), ServiceRequestHandler)
+        server.daemon_threads = True
+    server.service = service
+    server.verbose = verbose
+    return server
+
+
+def _raise_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def serve(host="127.0.0.1", port=DEFAULT_PORT, socket_path=None, processes=None, max_pending=None,
+          cache_size=DEFAULT_RESULT_CACHE_SIZE, annotator_timeout=None, dp_timeout=None, memory_mb=None,
+          verbose=False):
+    """サービスを起動し、Ctrl-C / SIGTERM まで要求を処理する"""
+    service = DecompositionService(processes=processes, max_pending=max_pending, cache_size=cache_size,
+                                   annotator_timeout=annotator_timeout, dp_timeout=dp_timeout, memory_mb=memory_mb)
+    server = make_server(service, host, port, socket_path, verbose)
+    where = f"unix:{socket_path}" if socket_path else f"http://{host}:{server.server_address[1]}"
+    logger.info(f"[serve] listening on {where} with {service.processes} worker processes "
+          f"(max {service.max_pending} pending requests)")
+    # SIGTERM（サービス本体のプロセスに送る）でもワーカーとソケットを片付けて終了する
+    signal.signal(signal.SIGTERM, _raise_interrupt)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("[serve] stopping")
+    finally:
+        server.server_close()
+        if socket_path and os.path.exists(socket_path):
+            os.unlink(socket_path)
+        service.close()
+
+
+def serve_main(argv=None):
+    from argparser import serve_argparser
+    from log_config import configure_logging, show_progress
+
+    args = serve_argparser(argv)
+    configure_logging(args.log_level)
+    show_progress("serve")
+    serve(
+        host=args.host,
+        port=args.port,
+        socket_path=args.socket,
+        processes=args.processes,
+        max_pending=args.max_pending,
+        cache_size=args.cache_size,
+        annotator_timeout=args.annotator_timeout,
+        dp_timeout=args.dp_timeout,
+        memory_mb=args.memory_limit,
+        verbose=args.verbose,
+    )
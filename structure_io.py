@@ -0,0 +1,190 @@
+"""
+Structure file I/O helpers
+
+.pdb / .cif (.mmcif) と、その gzip 圧縮版 (.pdb.gz / .cif.gz) を透過的に扱うためのヘルパー。
+圧縮ファイルはディスクに展開せず、ストリームのままパーサーへ渡す。
+"""
+
+import gzip
+import pathlib
+from collections import namedtuple
+
+import numpy as np
+
+from Bio.PDB import PDBParser
+from Bio.PDB.MMCIFParser import MMCIFParser
+
+PDB_EXTS = (".pdb",)
+CIF_EXTS = (".cif", ".mmcif")
+COMPRESSED_EXTS = (".gz",)
+STRUCTURE_GLOBS = ("*.pdb", "*.pdb.gz")
+
+# アノテーターが受け付ける入力形式（先頭ほど優先）
+ANNOTATOR_INPUT_FORMATS = {
+    "DSSR": ("cif", "pdb"),
+    "RNAVIEW": ("pdb",),
+}
+PDB_MAX_ATOMS = 99999
+EXPORT_SUFFIXES = {"pdb": ".pdb", "cif": ".cif"}
+
+# path: 書き出したファイル, fmt: "pdb" or "cif",
+# chain_id: ファイル中でのチェーンID（PDB の 1 文字制限で置き換えた場合は元のIDと異なる）
+ChainExport = namedtuple("ChainExport", ["path", "fmt", "chain_id"])
+
+
+def split_structure_name(struct_file):
+    """
+    ファイル名を (stem, 構造拡張子, 圧縮されているか) に分解する。
+
+    Examples:
+        1EHZ_1_A.pdb    -> ("1EHZ_1_A", ".pdb", False)
+        1EHZ_1_A.pdb.gz -> ("1EHZ_1_A", ".pdb", True)
+    """
+    name = pathlib.Path(struct_file).name
+    compressed = False
+    lower = name.lower()
+    for ext in COMPRESSED_EXTS:
+        if lower.endswith(ext):
+            name = name[: -len(ext)]
+            lower = lower[: -len(ext)]
+            compressed = True
+            break
+    suffix = pathlib.PurePath(name).suffix
+    stem = name[: -len(suffix)] if suffix else name
+    return stem, suffix.lower(), compressed
+
+
+def structure_stem(struct_file):
+    """圧縮拡張子と構造拡張子を除いたファイル名 (例: 1EHZ_1_A.pdb.gz -> 1EHZ_1_A)"""
+    return split_structure_name(struct_file)[0]
+
+
+def structure_format(struct_file):
+    """
+    入力ファイルの形式を "pdb" または "cif" で返す。
+    未対応の拡張子の場合は ValueError。
+    """
+    _, ext, _ = split_structure_name(struct_file)
+    if ext in CIF_EXTS:
+        return "cif"
+    if ext in PDB_EXTS:
+        return "pdb"
+    raise ValueError("Input file should be .cif or .pdb (optionally gzip-compressed as .gz)")
+
+
+def is_compressed(struct_file):
+    return split_structure_name(struct_file)[2]
+
+
+def open_structure(struct_file):
+    """
+    構造ファイルをテキストモードで開く。.gz の場合は gzip をストリーム展開する。
+    """
+    if is_compressed(struct_file):
+        return gzip.open(struct_file, "rt")
+    return open(struct_file, "r")
+
+
+def load_structure(struct_file, structure_id="structure"):
+    """
+    Biopython で構造を読み込む。.gz 入力は展開ファイルを作らずにハンドル経由で渡す。
+    """
+    if structure_format(struct_file) == "cif":
+        parser = MMCIFParser(QUIET=True)
+    else:
+        parser = PDBParser(QUIET=True)
+    with open_structure(struct_file) as handle:
+        return parser.get_structure(structure_id, handle)
+
+
+def choose_export_format(annotator="RNAView", fmt="auto"):
+    """
+    アノテーターに渡すチェーン限定ファイルの形式を決める。
+    fmt="auto" の場合、アノテーターが mmCIF を受け付けるなら mmCIF、そうでなければ PDB。
+    """
+    formats = ANNOTATOR_INPUT_FORMATS.get(annotator.upper())
+    if formats is None:
+        raise ValueError(f"Unsupported annotator: {annotator}. Use 'DSSR' or 'RNAView'.")
+    if fmt == "auto":
+        return formats[0]
+    if fmt not in formats:
+        raise ValueError(f"{annotator} does not accept {fmt} input (supported: {', '.join(formats)})")
+    return fmt
+
+
+def export_table(table, chain_id, out_stem, annotator="RNAView", fmt="auto", out_path=None):
+    """
+    チェーン限定の AtomTable をアノテーター用に書き出す。
+
+    Args:
+        table (AtomTable): 対象チェーンのみを含むテーブル
+        chain_id (str): 元のチェーンID
+        out_stem (str | Path): 拡張子なしの出力パス（形式に応じて .pdb / .cif を付ける）
+        annotator (str): "RNAView" or "DSSR"
+        fmt (str): "auto", "pdb" or "cif"
+        out_path (str | Path | None): 拡張子を付けずにこのパスへ書き出す（例: memfd の /proc/self/fd/N）
+
+    Returns:
+        ChainExport: (path, fmt, ファイル中のチェーンID)
+
+    table は 1 つのモデルだけを含む想定（export_chain は最初のモデルだけを切り出す）。MODEL / ENDMDL は書かないので、
+    複数のモデルを含む table を渡すとモデルが区別されずに 1 つの構造として書き出される。
+    以前の Biopython (PDBIO) による書き出しは全モデルを書いていたが、アノテーターに渡すのは最初のモデルだけにした
+    （チェーンの一覧も最初のモデルから作る）。別のモデルを解析する場合は、そのモデルを別のファイルに切り出して渡す。
+
+    PDB しか受け付けないアノテーター (RNAView) で複数文字のチェーンIDの場合は、
+    1 文字のIDに置き換えて書き出す（呼び出し側で ChainExport.chain_id を元に戻す）。
+    原子数が PDB の上限を超える場合は、黙って切り詰めずに ValueError を送出する。
+    """
+    from atom_table import write_cif, write_pdb
+
+    fmt = choose_export_format(annotator, fmt)
+    out_path = pathlib.Path(out_path) if out_path is not None else pathlib.Path(str(out_stem) + EXPORT_SUFFIXES[fmt])
+    if fmt == "cif":
+        write_cif(table, out_path, data_name=pathlib.Path(out_stem).name)
+        return ChainExport(out_path, fmt, chain_id)
+
+    if len(table) > PDB_MAX_ATOMS:
+        raise ValueError(
+            f"Chain {chain_id} has {len(table)} atoms, which exceeds the PDB format limit ({PDB_MAX_ATOMS}). "
+            f"{annotator} only accepts PDB input; use annotator=DSSR (mmCIF) for this structure."
+        )
+    written_chain = chain_id
+    if len(chain_id) > 1:
+        written_chain = "A"
+        table = table.select(chain=chain_id)
+        table.chain_id = np.full(len(table), written_chain)
+        table.records = None
+    write_pdb(table, out_path)
+    return ChainExport(out_path, fmt, written_chain)
+
+
+def export_chain(struct_file, chain_id, out_stem, annotator="RNAView", fmt="auto", out_path=None):
+    """
+    入力構造 (圧縮可) の最初のモデルから chain_id だけを切り出し、アノテーターに合った形式で書き出す。
+    アノテーターに渡すのはこの小さなチェーン限定ファイルだけになる。
+    切り出しは AtomTable の boolean mask で行い、Biopython のオブジェクトモデルは構築しない。
+
+    Returns:
+        ChainExport: export_table を参照
+    """
+    from atom_table import read_atom_table
+
+    table = read_atom_table(struct_file)
+    chain_table = table.select(chain=chain_id, model=table.first_model())
+    if len(chain_table) == 0:
+        raise ValueError(f"Chain ID {chain_id} not found in {struct_file}")
+    return export_table(chain_table, chain_id, out_stem, annotator=annotator, fmt=fmt, out_path=out_path)
+
+
+def restore_chain_id(raw_df, export, chain_id):
+    """
+    export_table で 1 文字に置き換えたチェーンIDを、アノテーター出力 (chain1 / chain2 列) 上で元に戻す。
+    """
+    if export.chain_id == chain_id or raw_df.empty:
+        return raw_df
+    raw_df = raw_df.copy()
+    for col in ("chain1", "chain2"):
+        if col in raw_df.columns:
+            raw_df.loc[raw_df[col] == export.chain_id, col] = chain_id
+    return raw_df
@@ -0,0 +1,99 @@
+"""
+batch のワーカーが kill された場合の振る舞いを、記録済みの DSSR 出力（benchmarks/corpus）で確かめる。
+
+    $ python test/batch_crash_test.py
+    $ python test/batch_crash_test.py -j 4 --copies 6
+
+test/1KPD.pdb を何本かコピーした構造ディレクトリを作り、そのうち CRASH.pdb を処理したワーカーだけを
+代役の DSSR が SIGKILL する。作業ディレクトリは一時的な SCRATCH_DIR (PKV_SCRATCH_DIR) に作る。
+
+- 同時に実行されていた他のエントリは単独で実行し直されて ok になる
+- CRASH は "crashed" の失敗として再試行された後に quarantine され、2 回目の実行では読み飛ばされる
+- kill されたワーカーの作業ディレクトリは残らない
+
+どれか 1 つでも満たされなければ AssertionError で終了する（終了コード 1）。
+"""
+
+import argparse
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+script_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(script_dir))
+
+from benchmarks.replay import install_replay
+
+CORPUS_DIR = script_dir / "benchmarks" / "corpus"
+STRUCTURE = script_dir / "test" / "1KPD.pdb"
+
+
+def write_crash_wrapper(bin_dir):
+    """入力が CRASH のチェーンなら親（batch のワーカー）を SIGKILL し、それ以外は代役の DSSR を実行する"""
+    install_replay(CORPUS_DIR, bin_dir)
+    wrapper = Path(bin_dir) / "crash-dssr"
+    wrapper.write_text(
+        "#!/bin/sh\n"
+        'case "$*" in *CRASH*) kill -9 $PPID; exit 1;; esac\n'
+        f'exec {shlex.quote(os.environ["PKV_DSSR_EXEC"])} "$@"\n'
+    )
+    wrapper.chmod(0o755)
+    return wrapper
+
+
+def run_batch_cli(tmpdir, env, processes):
+    command = [sys.executable, str(script_dir / "CLI_PseudoknotVisualizer.py"), "batch", str(tmpdir / "manifest.csv"),
+               "-d", str(tmpdir / "structures"), "-a", "DSSR", "-j", str(processes),
+               "-r", str(tmpdir / "results.jsonl"), "--dedup", "off"]
+    proc = subprocess.run(command, env=env, capture_output=True, text=True, timeout=600)
+    assert proc.returncode == 0, proc.stdout + proc.stderr
+    return proc.stdout
+
+
+def run(processes, copies):
+    with tempfile.TemporaryDirectory(prefix="pkv_crash_test_") as tmpdir:
+        tmpdir = Path(tmpdir)
+        structures = tmpdir / "structures"
+        scratch = tmpdir / "scratch"
+        structures.mkdir()
+        bin_dir = tmpdir / "bin"
+        bin_dir.mkdir()
+        names = [f"OK{n}" for n in range(copies)]
+        names.insert(len(names) // 2, "CRASH")
+        for name in names:
+            shutil.copyfile(STRUCTURE, structures / f"{name}.pdb")
+        (tmpdir / "manifest.csv").write_text("".join(f"{name},1,A,\n" for name in names))
+        env = dict(os.environ, PKV_DSSR_EXEC=str(write_crash_wrapper(bin_dir)), PKV_SCRATCH_DIR=str(scratch))
+
+        run_batch_cli(tmpdir, env, processes)
+        records = [json.loads(line) for line in open(tmpdir / "results.jsonl")]
+        final = {record["pdb_id"]: record for record in records}
+        assert all(final[name]["status"] == "ok" for name in names if name != "CRASH"), records
+        assert final["CRASH"]["status"] == "error" and final["CRASH"]["error_type"] == "crashed", final["CRASH"]
+        quarantined = [json.loads(line) for line in open(tmpdir / "results.quarantine.jsonl")]
+        assert [record["pdb_id"] for record in quarantined] == ["CRASH"], quarantined
+        leftovers = sorted(path.name for path in scratch.iterdir()) if scratch.exists() else []
+        assert not leftovers, f"work directories left in the scratch root: {leftovers}"
+
+        # 2 回目は quarantine された CRASH を読み飛ばす
+        stdout = run_batch_cli(tmpdir, env, processes)
+        assert "skipping 1 quarantined" in stdout, stdout
+    print(f"[test] {len(names)} entries on {processes} workers: {copies} ok, CRASH quarantined as crashed, "
+          f"no work directories left behind")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Check that batch survives worker processes killed mid-run")
+    parser.add_argument("-j", "--processes", type=int, default=3, help="Worker processes (default: 3)")
+    parser.add_argument("--copies", type=int, default=4, help="Entries that should succeed (default: 4)")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    run(args.processes, args.copies)
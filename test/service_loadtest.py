@@ -0,0 +1,108 @@
+"""
+serve の簡単な負荷試験: 同じリクエストを並列に送り、requests/s とレイテンシを表示する。
+
+    $ python CLI_PseudoknotVisualizer.py serve --port 8765 -j 4 &
+    $ python test/service_loadtest.py test/1KPD.pdb -c A -a DSSR -n 200 --concurrency 8
+    $ python test/service_loadtest.py test/1KPD.pdb -c A --socket /tmp/pkv.sock --no-cache-hits
+
+--no-cache-hits は毎回わずかに違う内容（末尾のコメント行）を送り、サービスの結果キャッシュを外して
+アノテーター + 分解の処理能力を測る。
+"""
+
+import argparse
+import http.client
+import json
+import pathlib
+import socket
+import statistics
+import threading
+import time
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path):
+        super().__init__("localhost")
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.unix_path)
+
+
+def connect(args):
+    if args.socket:
+        return UnixHTTPConnection(args.socket)
+    return http.client.HTTPConnection(args.host, args.port, timeout=600)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test for `CLI_PseudoknotVisualizer.py serve`")
+    parser.add_argument("input", help="Structure file sent with every request")
+    parser.add_argument("-c", "--chain", required=True)
+    parser.add_argument("-a", "--annotator", default="RNAView")
+    parser.add_argument("-f", "--format", choices=["pymol", "chimera"], default=None)
+    parser.add_argument("-n", "--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--socket", default=None)
+    parser.add_argument("--no-cache-hits", action="store_true",
+                        help="Send slightly different contents each time so that every request is analyzed")
+    args = parser.parse_args()
+
+    path = pathlib.Path(args.input).resolve()
+    text = path.read_text() if args.no_cache_hits else None
+    counter = iter(range(args.requests))
+    lock = threading.Lock()
+    latencies, statuses = [], {}
+
+    def body(i):
+        request = {"chain": args.chain, "annotator": args.annotator, "format": args.format, "model": 0}
+        if text is None:
+            request["input"] = str(path)
+        else:
+            fmt = "cif" if path.suffix.lower() == ".cif" else "pdb"
+            marker = f"\n# loadtest {i}\n" if fmt == "cif" else f"REMARK 999 loadtest {i}\n"
+            request.update(structure=text + marker, structure_format=fmt, name=path.stem)
+        return json.dumps(request)
+
+    def client():
+        conn = connect(args)
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                break
+            start = time.perf_counter()
+            conn.request("POST", "/analyze", body(i), {"Content-Type": "application/json"})
+            response = conn.getresponse()
+            response.read()
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+        conn.close()
+
+    threads = [threading.Thread(target=client) for _ in range(args.concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+
+    latencies.sort()
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(f"{len(latencies)} requests in {wall:.2f} s with concurrency {args.concurrency}: "
+          f"{len(latencies) / wall:.1f} req/s")
+    print(f"latency: p50 {statistics.median(latencies) * 1000:.1f} ms, p95 {p95 * 1000:.1f} ms, "
+          f"max {latencies[-1] * 1000:.1f} ms")
+    print(f"status codes: {statuses}")
+
+    conn = connect(args)
+    conn.request("GET", "/health")
+    print(f"service: {conn.getresponse().read().decode()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+work_queue の claim / reclaim / merge を 1 台のマシン上の複数プロセスで確かめる（アノテーターは使わない）。
+
+    $ python test/work_queue_test.py
+    $ python test/work_queue_test.py --nodes 8 --entries 200 --shard-size 7
+
+- 全ノードが同時に initialize し、shard の分割が 1 回だけ行われることを確かめる
+- "dead" ノードは shard を 1 つ確保した直後に終了する（kill されたノード）。その lease は
+  lease_timeout の後に他のノードが奪い取って処理する
+- "slow" ノードは shard を確保したまま heartbeat をせずに lease_timeout を過ぎてから結果を書く。
+  complete は False になり、その結果は merge されない
+- キューは各ノードのカレントディレクトリからの相対パスで渡し、merge は別のディレクトリから行う
+- 作業ディレクトリは一時的な SCRATCH_DIR (PKV_SCRATCH_DIR) に作る
+
+どれか 1 つでも満たされなければ AssertionError で終了する（終了コード 1）。
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+script_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(script_dir))
+
+from work_queue import WorkQueue, merge_queue
+
+QUEUE_NAME = "queue"
+
+
+def _write_results(queue, shard):
+    with open(queue.results_path(shard), "w") as f:
+        for entry in queue.shard_entries(shard):
+            f.write(json.dumps({"pdb_id": entry.pdb_id, "node": queue.node_id, "shard": shard}) + "\n")
+
+
+def _node(workdir, node_id, manifest, shard_size, lease_timeout, start, claimed_first, outcomes):
+    """正常なノード: dead / slow が shard を確保した後、全 shard が完了するまで確保・処理・完了を繰り返す"""
+    os.chdir(workdir)
+    queue = WorkQueue(QUEUE_NAME, node_id, lease_timeout)
+    start.wait()
+    queue.initialize(manifest, shard_size)
+    for event in claimed_first:
+        event.wait()
+    completed = []
+    while True:
+        claimed = queue.claim()
+        if claimed is None:
+            status = queue.status()
+            if status["done"] == status["shards"]:
+                break
+            time.sleep(lease_timeout / 5)
+            continue
+        shard, token = claimed
+        with queue.heartbeat(shard, token, interval=lease_timeout / 5):
+            time.sleep(0.01)
+            _write_results(queue, shard)
+        if queue.complete(shard, token, {"entries": len(queue.shard_entries(shard))}):
+            completed.append(shard)
+    outcomes.put((node_id, completed))
+
+
+def _dead_node(workdir, manifest, shard_size, lease_timeout, start, claimed):
+    """shard を確保した直後に終了する（heartbeat も complete もしない）"""
+    os.chdir(workdir)
+    queue = WorkQueue(QUEUE_NAME, "dead", lease_timeout)
+    start.wait()
+    queue.initialize(manifest, shard_size)
+    queue.claim()
+    claimed.set()
+    os._exit(1)
+
+
+def _slow_node(workdir, manifest, shard_size, lease_timeout, start, claimed, outcomes):
+    """shard を確保したまま lease_timeout を過ぎてから結果を書き、complete を試みる"""
+    os.chdir(workdir)
+    queue = WorkQueue(QUEUE_NAME, "slow", lease_timeout)
+    start.wait()
+    queue.initialize(manifest, shard_size)
+    shard, token = queue.claim()
+    claimed.set()
+    time.sleep(lease_timeout * 3)
+    _write_results(queue, shard)
+    outcomes.put(("slow", shard, queue.complete(shard, token)))
+
+
+def run(n_nodes, n_entries, shard_size, lease_timeout):
+    ctx = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory(prefix="pkv_queue_test_") as tmpdir:
+        tmpdir = Path(tmpdir)
+        workdir = tmpdir / "nodes"
+        workdir.mkdir()
+        # ノードのプロセスが作業ディレクトリを作る場合も、一時ディレクトリの中に作らせる
+        os.environ["PKV_SCRATCH_DIR"] = str(tmpdir / "scratch")
+        manifest = tmpdir / "manifest.csv"
+        pdb_ids = [f"T{n:04d}" for n in range(n_entries)]
+        manifest.write_text("".join(f"{pdb_id},1,A,\n" for pdb_id in pdb_ids))
+
+        start = ctx.Event()
+        dead_claimed, slow_claimed = ctx.Event(), ctx.Event()
+        outcomes = ctx.Queue()
+        processes = [
+            ctx.Process(target=_dead_node, args=(workdir, manifest, shard_size, lease_timeout, start, dead_claimed)),
+            ctx.Process(target=_slow_node,
+                        args=(workdir, manifest, shard_size, lease_timeout, start, slow_claimed, outcomes)),
+        ] + [
+            ctx.Process(target=_node, args=(workdir, f"node{n}", manifest, shard_size, lease_timeout, start,
+                                            (dead_claimed, slow_claimed), outcomes))
+            for n in range(n_nodes)
+        ]
+        for process in processes:
+            process.start()
+        start.set()
+        results = [outcomes.get(timeout=60 + lease_timeout * 10) for _ in range(n_nodes + 1)]
+        for process in processes:
+            process.join(timeout=60)
+
+        queue = WorkQueue(workdir / QUEUE_NAME)
+        shards = queue.shards()
+        n_shards = (n_entries + shard_size - 1) // shard_size
+        assert len(shards) == n_shards, f"expected {n_shards} shards, found {len(shards)}"
+        assert not list(workdir.glob(f"{QUEUE_NAME}/.shards-*")), "leftover temporary shard directories"
+
+        completed = [shard for result in results if result[0] != "slow" for shard in result[1]]
+        assert sorted(completed) == shards, f"shards completed more than once or never: {sorted(completed)}"
+        (_, slow_shard, slow_ok), = [result for result in results if result[0] == "slow"]
+        assert not slow_ok, "the node that lost its lease was able to complete its shard"
+        assert "slow" not in completed
+
+        done_nodes = {shard: json.loads((queue.done_dir / f"{shard}.json").read_text())["node"] for shard in shards}
+        assert set(done_nodes.values()) <= {f"node{n}" for n in range(n_nodes)}, done_nodes
+        for record in (queue.done_dir / f"{shard}.json" for shard in shards):
+            assert not Path(json.loads(record.read_text())["results"]).is_absolute(), record
+
+        # 各ノードとは違うカレントディレクトリから merge する
+        os.chdir(tmpdir)
+        summary = merge_queue(workdir / QUEUE_NAME, tmpdir / "merged.jsonl")
+        merged = [json.loads(line) for line in open(tmpdir / "merged.jsonl")]
+        assert summary["missing"] == [] and summary["records"] == n_entries, summary
+        assert [record["pdb_id"] for record in merged] == pdb_ids, "merged records are missing, duplicated or out of order"
+        assert all(record["node"] == done_nodes[record["shard"]] for record in merged), "merged a superseded result"
+        os.chdir(script_dir)
+
+    print(f"[test] {n_nodes} nodes, {n_shards} shards: each shard completed once; the dead node's shard was reclaimed; "
+          f"the slow node's late result for {slow_shard} was not merged")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Check work_queue claim / reclaim / merge with local processes")
+    parser.add_argument("--nodes", type=int, default=4, help="Healthy node processes (default: 4)")
+    parser.add_argument("--entries", type=int, default=100, help="Manifest entries (default: 100)")
+    parser.add_argument("--shard-size", type=int, default=5, help="Entries per shard (default: 5)")
+    parser.add_argument("--lease-timeout", type=float, default=1.0, help="Lease timeout in seconds (default: 1)")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    run(args.nodes, args.entries, args.shard_size, args.lease_timeout)
@@ -0,0 +1,280 @@
+"""
+Directory watch mode
+
+ディレクトリに次々と置かれる構造ファイル（予測モデルなど）をポーリングで検出し、
+annotate → filter → decompose → スクリプト書き出しをワーカープールで処理し続ける。
+
+    $ python CLI_PseudoknotVisualizer.py watch incoming/ -a DSSR -f pymol -o scripts/ -j 4
+
+- 書き込み途中のファイルを拾わないよう、サイズと mtime が settle 秒変わらなくなってから投入する
+  （"." で始まるファイルや .tmp / .part は無視する）
+- 処理済みのファイルは (サイズ, mtime) を state ファイルに 1 行ずつ追記し、再起動後も処理し直さない。
+  内容が置き換えられた（サイズか mtime が変わった）ファイルだけを処理し直す
+- ワーカーが kill された（OOM killer, segfault など）場合はプールを作り直し、その時に処理中だったファイルを
+  1 件ずつ単独で処理し直す（その間は新しいファイルを投入しない）。単独でも落ちたファイルは
+  "crashed" の失敗レコードにする
+- 結果は batch と同じ形式のレコードを results に 1 行ずつ追記する
+"""
+
+import json
+import os
+import pathlib
+import time
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import cpu_count
+
+from batch import (ManifestEntry, STRUCTURE_SUFFIXES, WorkerPool, _init_worker, _lost_entry, _run_entry, _summary,
+                   _write_record, worker_log_level)
+from log_config import get_logger
+from structure_io import structure_stem
+
+logger = get_logger("watch")
+
+IGNORED_SUFFIXES = (".tmp", ".part", ".partial", ".swp")
+DEFAULT_INTERVAL = 1.0
+DEFAULT_SETTLE = 2.0
+
+
+def is_structure_file(name):
+    lower = name.lower()
+    return (not name.startswith(".") and lower.endswith(STRUCTURE_SUFFIXES)
+            and not lower.endswith(IGNORED_SUFFIXES))
+
+
+class WatchState:
+    """
+    処理済みファイルの (サイズ, mtime) の記録（path -> [size, mtime_ns]）。
+    1 ファイル処理するごとに [path, size, mtime_ns] の 1 行を追記し、読み込む時は後の行を優先する。
+    読み込み時に行数が記録の 2 倍を超えていれば書き直して詰める。
+    以前の形式（{"version": 1, "processed": {...}} の JSON）も読め、最初の読み込みで行の形式に書き直す。
+    """
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        self.processed = {}
+        self._log = None
+        n_lines = 0
+        rewrite = False
+        if self.path.exists():
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        item = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 追記の途中で止まった最後の行（書き直して、次の追記が続きにならないようにする）
+                        rewrite = True
+                        continue
+                    n_lines += 1
+                    if isinstance(item, dict):
+                        rewrite = True
+                        self.processed.update(item.get("processed", {}))
+                    else:
+                        path, size, mtime_ns = item
+                        self.processed[path] = [size, mtime_ns]
+        if rewrite or n_lines > 2 * len(self.processed):
+            self._compact()
+
+    def is_processed(self, path, stat):
+        return self.processed.get(str(path)) == list(stat)
+
+    def mark(self, path, stat):
+        self.processed[str(path)] = list(stat)
+        if self._log is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._log = open(self.path, "a")
+        self._log.write(json.dumps([str(path), *stat]) + "\n")
+        self._log.flush()
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    def _compact(self):
+        tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            for path, stat in self.processed.items():
+                f.write(json.dumps([path, *stat]) + "\n")
+        os.replace(tmp, self.path)
+
+
+class DirectoryPoller:
+    """
+    watch_dir を走査し、サイズと mtime が settle 秒以上変わっていない新規・変更ファイルを返す。
+    走査は os.scandir の stat だけで行い、ファイルは開かない。
+    """
+
+    def __init__(self, watch_dir, state, settle=DEFAULT_SETTLE):
+        self.watch_dir = pathlib.Path(watch_dir)
+        self.state = state
+        self.settle = settle
+        self._candidates = {}  # path -> ((size, mtime_ns), 最初にその stat を観測した時刻)
+
+    def poll(self, in_flight=()):
+        """
+        Returns:
+            list[tuple]: 投入できる (path, (size, mtime_ns)) のリスト
+        """
+        now = time.monotonic()
+        ready = []
+        seen = set()
+        with os.scandir(self.watch_dir) as it:
+            for item in it:
+                if not item.is_file() or not is_structure_file(item.name):
+                    continue
+                path = pathlib.Path(item.path)
+                st = item.stat()
+                stat = (st.st_size, st.st_mtime_ns)
+                seen.add(path)
+                if path in in_flight or self.state.is_processed(path, stat):
+                    self._candidates.pop(path, None)
+                    continue
+                previous = self._candidates.get(path)
+                if previous is None or previous[0] != stat:
+                    # 新しく現れた / まだ書き込み中: 変化が止まるまで待つ
+                    self._candidates[path] = (stat, now)
+                    continue
+                if st.st_size > 0 and now - previous[1] >= self.settle:
+                    ready.append((path, stat))
+                    del self._candidates[path]
+        for path in set(self._candidates) - seen:
+            # 消えたファイル
+            del self._candidates[path]
+        return sorted(ready)
+
+    def waiting(self):
+        """書き込みが終わるのを待っているファイルの数"""
+        return len(self._candidates)
+
+
+def watch_directory(watch_dir, annotator="RNAView", include_all=False, chain=None, processes=None,
+                    results_path=None, fmt=None, output_dir=None, model_id=None, state_path=None,
+                    interval=DEFAULT_INTERVAL, settle=DEFAULT_SETTLE, once=False,
+                    annotator_timeout=None, dp_timeout=None, memory_mb=None, max_tasks_per_child=100):
+    """
+    watch_dir を監視し、新しく置かれた構造ファイルをワーカープールで処理し続ける（Ctrl-C で終了）。
+
+    Args:
+        chain (str | None): 処理するチェーン（None なら各ファイルの全チェーン）
+        results_path: 結果の追記先（既定: <output_dir or watch_dir>/pkv_watch_results.jsonl）
+        state_path: 処理済みファイルの記録（既定: <watch_dir>/.pkv_watch_state.json）
+        interval (float): 走査の間隔（秒）
+        settle (float): サイズと mtime がこの秒数変わらなければ書き込み完了とみなす
+        once (bool): その時点のファイルをすべて処理したら終了する
+
+    Returns:
+        dict: 集計 (files, chains_ok, chains_failed)
+    """
+    watch_dir = pathlib.Path(watch_dir)
+    results_path = results_path or str(pathlib.Path(output_dir or watch_dir) / "pkv_watch_results.jsonl")
+    state = WatchState(state_path or watch_dir / ".pkv_watch_state.json")
+    poller = DirectoryPoller(watch_dir, state, settle)
+    if output_dir:
+        pathlib.Path(output_dir).mkdir(parents=True, exist_ok=True)
+
+    n_procs = max(1, processes or cpu_count())
+    limits = {"annotator_timeout": annotator_timeout, "dp_timeout": dp_timeout, "memory_mb": memory_mb}
+    summary = {"files": 0, "chains_ok": 0, "chains_failed": 0}
+    in_flight = {}  # path -> (stat, 投入した時刻)
+    logger.info(f"[watch] watching {watch_dir} every {interval} s with {n_procs} worker processes "
+          f"(annotator={annotator}, {len(state.processed)} files already processed)")
+
+    with open(results_path, "a") as out, WorkerPool(
+        n_procs,
+        initializer=_init_worker,
+        initargs=(annotator, include_all, fmt, output_dir, model_id, limits, None, None, worker_log_level()),
+        max_tasks_per_child=max_tasks_per_child,
+    ) as pool:
+        finished = []
+        suspects = []  # ワーカーごと落ちた時に処理中だったファイル（1 件ずつ単独で処理し直す）
+        running = 0
+
+        def submit(path, stat, attempt=1):
+            entry = ManifestEntry(structure_stem(path), 1, [chain] if chain else [], "")
+            task = (entry, path, attempt)
+            # コールバックはプールの管理スレッドで呼ばれるので、結果はここで受け取るだけにする
+            pool.submit(_run_entry, task).add_done_callback(
+                lambda future, task=task, stat=stat: finished.append((task, stat, future)))
+
+        try:
+            while True:
+                if not suspects:
+                    for path, stat in poller.poll(in_flight):
+                        in_flight[path] = (stat, time.monotonic())
+                        submit(path, stat)
+                        running += 1
+                        logger.info(f"[watch] queued {path.name}")
+
+                while finished:
+                    task, stat, future = finished.pop(0)
+                    running -= 1
+                    _, path, attempt = task
+                    try:
+                        records = future.result()[1]
+                    except Exception as exc:
+                        # ワーカーごと落ちた場合など（_run_entry 内の例外は失敗レコードになっている）。
+                        # 同時に処理中だったファイルも巻き込まれるので、単独の実行でも落ちるまでは失敗にしない
+                        if isinstance(exc, BrokenProcessPool) and attempt == 1:
+                            suspects.append((path, stat))
+                            continue
+                        records = _lost_entry(task, exc)[1]
+                    latency = time.monotonic() - in_flight.pop(path)[1]
+                    for record in records:
+                        _write_record(out, record)
+                        if record["status"] == "ok":
+                            summary["chains_ok"] += 1
+                            logger.info(f"[watch] {path.name} {record['chain_id']}: {_summary(record)} "
+                                  f"({latency:.2f} s after queueing)")
+                        else:
+                            summary["chains_failed"] += 1
+                            logger.info(f"[watch] {path.name} {record['chain_id'] or '-'}: "
+                                  f"ERROR {record['error_type']} ({record['error']})")
+                    out.flush()
+                    summary["files"] += 1
+                    state.mark(path, stat)
+
+                if suspects and running == 0:
+                    path, stat = suspects.pop(0)
+                    logger.info(f"[watch] {path.name}: a worker process died while it was running, running it alone")
+                    submit(path, stat, attempt=2)
+                    running += 1
+
+                if once and not in_flight and not poller.waiting():
+                    break
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            logger.info("[watch] stopping")
+            pool.shutdown(wait=False, cancel_futures=True)
+        finally:
+            state.close()
+    logger.info(f"[watch] processed {summary['files']} files: {summary['chains_ok']} chains ok, "
+          f"{summary['chains_failed']} failed -> {results_path}")
+    return summary
+
+
+def watch_main(argv=None):
+    from argparser import watch_argparser
+    from log_config import configure_logging, show_progress
+
+    args = watch_argparser(argv)
+    configure_logging(args.log_level)
+    show_progress("watch")
+    watch_directory(
+        args.directory,
+        annotator=args.annotator,
+        include_all=args.include_all,
+        chain=args.chain,
+        processes=args.processes,
+        results_path=args.results,
+        fmt=args.format,
+        output_dir=args.output_dir,
+        model_id=args.model,
+        state_path=args.state,
+        interval=args.interval,
+        settle=args.settle,
+        once=args.once,
+        annotator_timeout=args.annotator_timeout,
+        dp_timeout=args.dp_timeout,
+        memory_mb=args.memory_limit,
+        max_tasks_per_child=args.max_tasks_per_child,
+    )
@@ -0,0 +1,394 @@
+"""
+Shared-filesystem work queue for multi-node batch runs
+
+ブローカーやデータベースを使わず、共有ファイルシステム上のファイルだけで manifest を複数ノードに分配する。
+
+    <queue>/
+        shards/queue.json             分割の設定（shard 数, shard サイズ, アノテーター等）
+        shards/shard-00000.csv        manifest の一部（batch と同じレイアウト）
+        leases/shard-00000.lease      処理中のノード（O_EXCL で作成、mtime が heartbeat）
+        done/shard-00000.json         完了したノードと結果ファイル（O_EXCL で作成、最初の 1 つだけ有効）
+        results/<node>/shard-00000.jsonl              ノードごとの結果
+        results/<node>/shard-00000.quarantine.jsonl   ノードごとの quarantine
+        results/<node>/dataset.index.json             ノードごとの dataset index（実行時間の記録）
+
+- 最初のノードが shard を一時ディレクトリに書いてから rename し、後から来たノードはそれを使う
+- lease の mtime が lease_timeout 秒より古ければ、持ち主が止まったとみなして rename で奪い取る
+- merge は done の記録に従って shard ごとに 1 つの結果ファイルだけを採用する
+  （奪われた lease のノードが遅れて書き終えた結果は使われない）
+- done に記録するパスはキューのルートからの相対パスなので、ノードごとにマウント位置や
+  カレントディレクトリが違っても merge できる
+
+heartbeat の判定はファイルの mtime とローカルの時計を比べるので、lease_timeout は
+heartbeat の間隔とノード間の時計のずれより十分大きくする。
+"""
+
+import json
+import os
+import pathlib
+import shutil
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from batch import read_manifest
+from log_config import get_logger
+
+logger = get_logger("queue")
+
+SHARD_PREFIX = "shard-"
+DEFAULT_SHARD_SIZE = 16
+DEFAULT_LEASE_TIMEOUT = 300
+DEFAULT_HEARTBEAT = 30
+
+
+def default_node_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def _write_json_exclusive(path, data):
+    """path が無ければ作成して data を書き込み True、既にあれば False（ノード間の排他に使う）"""
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, "w") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    return True
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        # 作成直後でまだ書き込まれていない / 既に消された
+        return None
+
+
+def _write_manifest(entries, path):
+    with open(path, "w") as f:
+        for entry in entries:
+            f.write(f"{entry.pdb_id},{entry.model},{'-'.join(entry.chains)},{entry.extra}\n")
+
+
+class WorkQueue:
+    """
+    共有ファイルシステム上の shard キュー。1 ノード（プロセス）につき 1 インスタンス。
+    """
+
+    def __init__(self, queue_dir, node_id=None, lease_timeout=DEFAULT_LEASE_TIMEOUT):
+        self.root = pathlib.Path(queue_dir)
+        self.node_id = node_id or default_node_id()
+        self.lease_timeout = lease_timeout
+        self.shards_dir = self.root / "shards"
+        self.leases_dir = self.root / "leases"
+        self.done_dir = self.root / "done"
+        self.results_dir = self.root / "results"
+
+    def initialize(self, manifest, shard_size=DEFAULT_SHARD_SIZE, options=None):
+        """
+        manifest を shard に分割する。既に他のノードが分割していればそれを使う（options が違えば ValueError）。
+
+        Returns:
+            int: shard 数
+        """
+        options = options or {}
+        self.root.mkdir(parents=True, exist_ok=True)
+        if not self.shards_dir.exists():
+            tmp = self.root / f".shards-{self.node_id}-{uuid.uuid4().hex[:8]}"
+            tmp.mkdir()
+            entries = read_manifest(manifest)
+            n_shards = (len(entries) + shard_size - 1) // shard_size
+            for n in range(n_shards):
+                _write_manifest(entries[n * shard_size:(n + 1) * shard_size], tmp / f"{SHARD_PREFIX}{n:05d}.csv")
+            with open(tmp / "queue.json", "w") as f:
+                json.dump({"manifest": str(manifest), "entries": len(entries), "shard_size": shard_size,
+                           "shards": n_shards, "options": options, "created_by": self.node_id}, f)
+            try:
+                # ディレクトリの rename は不可分なので、同時に分割したノードのうち 1 つだけが成功する
+                os.rename(tmp, self.shards_dir)
+            except OSError:
+                shutil.rmtree(tmp, ignore_errors=True)
+        for directory in (self.leases_dir, self.done_dir, self.results_dir / self.node_id):
+            directory.mkdir(parents=True, exist_ok=True)
+
+        config = _read_json(self.shards_dir / "queue.json")
+        if config["options"] != options:
+            raise ValueError(f"Queue {self.root} was created with different options: {config['options']} "
+                             f"(this node: {options})")
+        return config["shards"]
+
+    def shards(self):
+        return sorted(path.stem for path in self.shards_dir.glob(f"{SHARD_PREFIX}*.csv"))
+
+    def shard_entries(self, shard):
+        return read_manifest(self.shards_dir / f"{shard}.csv")
+
+    def _lease_path(self, shard):
+        return self.leases_dir / f"{shard}.lease"
+
+    def _done_path(self, shard):
+        return self.done_dir / f"{shard}.json"
+
+    def is_done(self, shard):
+        return self._done_path(shard).exists()
+
+    def pending(self):
+        return [shard for shard in self.shards() if not self.is_done(shard)]
+
+    def results_path(self, shard, node_id=None):
+        return self.results_dir / (node_id or self.node_id) / f"{shard}.jsonl"
+
+    def quarantine_path(self, shard, node_id=None):
+        return self.results_dir / (node_id or self.node_id) / f"{shard}.quarantine.jsonl"
+
+    def _is_stale(self, lease_path):
+        try:
+            return time.time() - lease_path.stat().st_mtime > self.lease_timeout
+        except FileNotFoundError:
+            return False
+
+    def _reclaim(self, shard):
+        """
+        heartbeat の止まった lease を取り除く。rename は不可分なので、奪い取れるのは 1 ノードだけ。
+        rename の直前に持ち主が heartbeat を再開していた場合は元に戻す。
+        """
+        lease_path = self._lease_path(shard)
+        stale = self.leases_dir / f"{shard}.stale-{self.node_id}-{time.time_ns()}"
+        try:
+            os.rename(lease_path, stale)
+        except FileNotFoundError:
+            return
+        if not self._is_stale(stale):
+            try:
+                os.link(stale, lease_path)
+            except FileExistsError:
+                pass
+            os.unlink(stale)
+            return
+        owner = _read_json(stale) or {}
+        logger.info(f"[queue] {self.node_id}: reclaimed {shard} from {owner.get('node', '?')} "
+              f"(no heartbeat for more than {self.lease_timeout} s)")
+        os.unlink(stale)
+
+    def claim(self):
+        """
+        未完了で lease の無い（または期限切れの）shard を 1 つ確保する。
+
+        Returns:
+            tuple | None: (shard, lease token)、確保できる shard が無ければ None
+        """
+        for shard in self.pending():
+            lease_path = self._lease_path(shard)
+            if lease_path.exists():
+                if not self._is_stale(lease_path):
+                    continue
+                self._reclaim(shard)
+            token = uuid.uuid4().hex
+            lease = {"node": self.node_id, "host": socket.gethostname(), "pid": os.getpid(),
+                     "token": token, "claimed_at": time.time()}
+            if _write_json_exclusive(lease_path, lease):
+                # lease を取った直後に他のノードが完了させていないか確認する
+                if self.is_done(shard):
+                    self.release(shard, token)
+                    continue
+                return shard, token
+        return None
+
+    def owns(self, shard, token):
+        lease = _read_json(self._lease_path(shard))
+        return lease is not None and lease.get("token") == token
+
+    def release(self, shard, token):
+        if self.owns(shard, token):
+            try:
+                self._lease_path(shard).unlink()
+            except FileNotFoundError:
+                pass
+
+    @contextmanager
+    def heartbeat(self, shard, token, interval=DEFAULT_HEARTBEAT):
+        """
+        ブロックの実行中、interval 秒ごとに lease の mtime を更新する。
+        lease が他のノードに奪われたことに気付いたら更新をやめ、yield した dict の "lost" を True にする。
+        """
+        state = {"lost": False}
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(interval):
+                if not self.owns(shard, token):
+                    state["lost"] = True
+                    return
+                try:
+                    os.utime(self._lease_path(shard))
+                except FileNotFoundError:
+                    state["lost"] = True
+                    return
+
+        thread = threading.Thread(target=beat, name=f"heartbeat-{shard}", daemon=True)
+        thread.start()
+        try:
+            yield state
+        finally:
+            stop.set()
+            thread.join()
+        if not self.owns(shard, token):
+            state["lost"] = True
+
+    def complete(self, shard, token, summary=None):
+        """
+        shard の完了を記録して lease を外す。lease を失っていた場合や、他のノードが先に完了させた場合は False。
+        """
+        if not self.owns(shard, token):
+            logger.info(f"[queue] {self.node_id}: lost the lease on {shard}; its results will not be merged")
+            return False
+        record = {"node": self.node_id, "results": str(self.results_path(shard).relative_to(self.root)),
+                  "quarantine": str(self.quarantine_path(shard).relative_to(self.root)),
+                  "finished_at": time.time(), "summary": summary}
+        ok = _write_json_exclusive(self._done_path(shard), record)
+        self.release(shard, token)
+        return ok
+
+    def resolve(self, path):
+        """done の記録のパスをキューのルート基準で解決する（絶対パスはそのまま）"""
+        return self.root / path
+
+    def node_index_path(self):
+        return self.results_dir / self.node_id / "dataset.index.json"
+
+    def status(self):
+        """shard 数・完了数・処理中（有効な lease）の数"""
+        shards = self.shards()
+        done = sum(self.is_done(shard) for shard in shards)
+        leased = sum(self._lease_path(shard).exists() and not self._is_stale(self._lease_path(shard))
+                     for shard in shards if not self.is_done(shard))
+        return {"shards": len(shards), "done": done, "leased": leased, "waiting": len(shards) - done - leased}
+
+
+def run_node(queue_dir, manifest, structures_dir, node_id=None, shard_size=DEFAULT_SHARD_SIZE,
+             lease_timeout=DEFAULT_LEASE_TIMEOUT, heartbeat=DEFAULT_HEARTBEAT, wait=True, **batch_options):
+    """
+    1 ノード分のワーカー: shard を確保しては run_batch で処理し、全 shard が完了するまで繰り返す。
+    他のノードが処理中の shard しか残っていない場合、wait=True ならその lease が完了するか
+    期限切れになる（奪い取る）まで待つ。
+
+    structures_dir の走査はノードの開始時に 1 回だけ行う。dataset index はノードごとのファイル
+    （results/<node>/dataset.index.json）に書き、ノード間で同じファイルを上書きし合わないようにする。
+    最初は batch_options の index_path（既定は <structures_dir>.index.json）があればその内容から始める。
+    batch_options の stats_path にはこのノードが完了させた shard の集計を、名前にノード ID を入れて
+    （stats.json -> stats.<node>.json）最後に書き出す。profile_dir のプロファイルは shard ごとのサブディレクトリに残す。
+
+    Args:
+        batch_options: run_batch にそのまま渡す（annotator, include_all, processes, retries, dedup, ...）
+
+    Returns:
+        dict: このノードが完了させた shard 数とチェーン数
+    """
+    from analysis.dataset_index import DatasetIndex, default_index_path
+    from batch import index_structure_dir, run_batch
+    from instrumentation import Stats, write_stats
+
+    queue = WorkQueue(queue_dir, node_id, lease_timeout)
+    options = {"annotator": batch_options.get("annotator", "RNAView"),
+               "include_all": batch_options.get("include_all", False)}
+    n_shards = queue.initialize(manifest, shard_size, options)
+    logger.info(f"[queue] node {queue.node_id}: {n_shards} shards in {queue.root}")
+
+    structure_index = index_structure_dir(structures_dir)
+    shared_index_path = pathlib.Path(batch_options.pop("index_path", None) or default_index_path(structures_dir))
+    node_index_path = queue.node_index_path()
+    if not node_index_path.exists() and shared_index_path.exists():
+        shutil.copyfile(shared_index_path, node_index_path)
+    dataset_index = DatasetIndex(node_index_path)
+    # shard ごとの run_batch が同じファイルを上書きし合わないよう、集計とプロファイルはここで振り分ける
+    stats_path = batch_options.pop("stats_path", None)
+    profile_dir = batch_options.pop("profile_dir", None)
+    node_stats = Stats()
+
+    totals = {"shards": 0, "chains_ok": 0, "chains_failed": 0}
+    while True:
+        claimed = queue.claim()
+        if claimed is None:
+            status = queue.status()
+            if status["done"] == status["shards"] or not wait:
+                break
+            time.sleep(min(heartbeat, lease_timeout / 2))
+            continue
+        shard, token = claimed
+        logger.info(f"[queue] node {queue.node_id}: processing {shard}")
+        results_path = queue.results_path(shard)
+        quarantine_path = queue.quarantine_path(shard)
+        # 同じノード ID で再開した場合、前回の途中までの結果は捨てて shard をやり直す
+        for path in (results_path, quarantine_path):
+            if path.exists():
+                path.unlink()
+        with queue.heartbeat(shard, token, heartbeat) as state:
+            summary = run_batch(queue.shard_entries(shard), structures_dir, results_path=str(results_path),
+                                quarantine_path=str(quarantine_path), structure_index=structure_index,
+                                dataset_index=dataset_index,
+                                profile_dir=str(pathlib.Path(profile_dir) / shard) if profile_dir else None,
+                                **batch_options)
+        if not state["lost"] and queue.complete(shard, token, summary):
+            totals["shards"] += 1
+            totals["chains_ok"] += summary["chains_ok"]
+            totals["chains_failed"] += summary["chains_failed"]
+            node_stats.merge(summary["stats"])
+    logger.info(f"[queue] node {queue.node_id} finished: {totals['shards']} shards, "
+          f"{totals['chains_ok']} chains ok, {totals['chains_failed']} failed")
+    if stats_path:
+        stats_path = pathlib.Path(stats_path)
+        node_stats_path = stats_path.with_name(f"{stats_path.stem}.{queue.node_id}{stats_path.suffix}")
+        logger.info(f"[queue] node {queue.node_id}: stage timings -> "
+                    f"{write_stats(node_stats.snapshot(), node_stats_path)}")
+    return totals
+
+
+def merge_queue(queue_dir, results_path, quarantine_path=None, allow_partial=False):
+    """
+    完了した shard の結果を shard 順に 1 つの結果ファイル（と quarantine ファイル）にまとめる。
+    未完了の shard があれば allow_partial=False の場合は RuntimeError。
+
+    Returns:
+        dict: shards, merged, missing, records
+    """
+    queue = WorkQueue(queue_dir)
+    shards = queue.shards()
+    missing = [shard for shard in shards if not queue.is_done(shard)]
+    if missing and not allow_partial:
+        raise RuntimeError(f"{len(missing)} of {len(shards)} shards are not finished (e.g. {missing[0]}); "
+                           f"run more nodes or pass --partial")
+    if quarantine_path is None:
+        quarantine_path = str(pathlib.Path(results_path).with_suffix("")) + ".quarantine.jsonl"
+
+    n_records = 0
+    with open(results_path, "w") as out, open(quarantine_path, "w") as quarantine:
+        for shard in shards:
+            done = _read_json(queue._done_path(shard))
+            if done is None:
+                continue
+            with open(queue.resolve(done["results"])) as f:
+                for line in f:
+                    out.write(line)
+                    n_records += 1
+            if queue.resolve(done["quarantine"]).exists():
+                with open(queue.resolve(done["quarantine"])) as f:
+                    shutil.copyfileobj(f, quarantine)
+    summary = {"shards": len(shards), "merged": len(shards) - len(missing), "missing": missing, "records": n_records}
+    logger.info(f"[queue] merged {summary['merged']}/{summary['shards']} shards ({n_records} records) -> {results_path}")
+    return summary
+
+
+def merge_main(argv=None):
+    from argparser import merge_argparser
+    from log_config import configure_logging, show_progress
+
+    args = merge_argparser(argv)
+    configure_logging(args.log_level)
+    show_progress("queue")
+    merge_queue(args.queue, args.results, quarantine_path=args.quarantine, allow_partial=args.partial)
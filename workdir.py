@@ -0,0 +1,178 @@
+"""
+Per-invocation work directories
+
+アノテーターの実行ごとに専用の作業ディレクトリを scratch root の下に作る。
+RNAView / DSSR は入力ファイルの隣や cwd に固定名のファイル（*.out, dssr-* など）を書き出すため、
+共有ディレクトリを使うと同時実行された別プロセスの結果を上書き・削除してしまう。
+作業ディレクトリは作成したプロセスだけが削除する。kill されたプロセス（OOM killer, SIGKILL）が残した
+ディレクトリは、名前の pid のプロセスがもう無いことを確かめてから sweep_stale_workdirs で削除する。
+
+scratch root は config.SCRATCH_BACKEND で選ぶ:
+    "disk"  : SCRATCH_DIR（既定: intermediate/）
+    "tmpfs" : SCRATCH_DIR（既定: /dev/shm/pkv）
+    "memfd" : tmpfs に加えて、対応するアノテーター (DSSR) への入力を memfd で渡す
+各実行で書き出したバイト数を instrumentation のカウンター (scratch_runs, scratch_bytes_written, scratch_files,
+scratch_memfd_bytes) に足す（batch の結果レコードの "stats" と集計、serve の /metrics に出る）。
+"""
+
+import os
+import pathlib
+import re
+import shutil
+import sys
+import tempfile
+from contextlib import contextmanager
+
+from config import INTERMEDIATE_DIR, SCRATCH_BACKEND, SCRATCH_DIR
+from instrumentation import count
+from log_config import get_logger
+
+logger = get_logger("workdir")
+
+SCRATCH_BACKENDS = ("disk", "tmpfs", "memfd")
+TMPFS_DEFAULT_DIR = pathlib.Path("/dev/shm/pkv")
+# /proc/self/fd/N のようなパスから入力を読めるアノテーター
+# （RNAView は入力ファイルの隣に出力を書くため対象外）
+MEMFD_INPUT_ANNOTATORS = ("DSSR",)
+
+# annotator_workdir の名前: <prefix>_<pid>_<mkdtemp の 8 文字>
+WORKDIR_NAME = re.compile(r"^[A-Za-z0-9-]+_(\d+)_[a-z0-9_]{8}$")
+
+# 実行中の作業ディレクトリごとの集計
+_RUN_USAGE = {}
+
+
+def scratch_backend():
+    """有効な scratch backend 名（memfd が使えない環境では tmpfs に落とす）"""
+    backend = (SCRATCH_BACKEND or "disk").lower()
+    if backend not in SCRATCH_BACKENDS:
+        raise ValueError(f"SCRATCH_BACKEND must be one of {', '.join(SCRATCH_BACKENDS)} (got {SCRATCH_BACKEND!r})")
+    if backend == "memfd" and not (hasattr(os, "memfd_create") and sys.platform.startswith("linux")):
+        return "tmpfs"
+    return backend
+
+
+def scratch_root():
+    """作業ディレクトリを作る親ディレクトリ（存在しなければ作成する）"""
+    backend = scratch_backend()
+    if SCRATCH_DIR is not None:
+        root = pathlib.Path(SCRATCH_DIR)
+    elif backend == "disk":
+        root = pathlib.Path(INTERMEDIATE_DIR)
+    elif TMPFS_DEFAULT_DIR.parent.is_dir():
+        root = TMPFS_DEFAULT_DIR
+    else:
+        logger.warning("[scratch] %s is not available; falling back to %s", TMPFS_DEFAULT_DIR.parent, tempfile.gettempdir())
+        root = pathlib.Path(tempfile.gettempdir()) / "pkv"
+    root.mkdir(parents=True, exist_ok=True)
+    return root
+
+
+def _directory_usage(path):
+    files = 0
+    size = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                size += os.path.getsize(os.path.join(dirpath, name))
+                files += 1
+            except OSError:
+                continue
+    return files, size
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def sweep_stale_workdirs(root=None):
+    """
+    作成したプロセスが kill されて残った作業ディレクトリ（名前の pid のプロセスがもう無いもの）を削除する。
+    scratch root はこのホストのプロセスだけが使っている前提（pid の生存はこのホストでしか確かめられない）。
+
+    Returns:
+        int: 削除したディレクトリの数
+    """
+    if os.name != "posix":
+        return 0
+    root = pathlib.Path(root) if root is not None else scratch_root()
+    removed = 0
+    try:
+        items = list(os.scandir(root))
+    except FileNotFoundError:
+        return 0
+    for item in items:
+        match = WORKDIR_NAME.match(item.name)
+        if not match or not item.is_dir(follow_symlinks=False):
+            continue
+        pid = int(match.group(1))
+        if pid == os.getpid() or _pid_alive(pid):
+            continue
+        shutil.rmtree(item.path, ignore_errors=True)
+        removed += 1
+    if removed:
+        logger.info("[scratch] removed %d work directories left by killed processes in %s", removed, root)
+    return removed
+
+
+@contextmanager
+def annotator_workdir(prefix="pkv", keep=False):
+    """
+    専用の作業ディレクトリを作成して yield し、ブロックを抜けたら削除する。
+    削除前に書き出されたファイルのバイト数を scratch_* のカウンターに足す。
+
+    Args:
+        prefix (str): ディレクトリ名の接頭辞（pid と乱数が後ろに付く）
+        keep (bool): True の場合は削除しない（デバッグ用）
+
+    Yields:
+        pathlib.Path: 作業ディレクトリ
+    """
+    path = pathlib.Path(tempfile.mkdtemp(prefix=f"{prefix}_{os.getpid()}_", dir=scratch_root()))
+    usage = _RUN_USAGE[str(path)] = {"bytes_written": 0, "files": 0, "memfd_bytes": 0}
+    try:
+        yield path
+    finally:
+        _RUN_USAGE.pop(str(path), None)
+        files, size = _directory_usage(path)
+        usage["files"] += files
+        usage["bytes_written"] += size + usage["memfd_bytes"]
+        count("scratch_runs")
+        for key in ("bytes_written", "files", "memfd_bytes"):
+            count(f"scratch_{key}", usage[key])
+        logger.debug(
+            "[scratch] %s: wrote %d bytes (%d files, %d bytes via memfd) in %s", scratch_backend(),
+            usage["bytes_written"], usage["files"], usage["memfd_bytes"], path.name,
+        )
+        if not keep:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+@contextmanager
+def annotator_input(workdir, annotator):
+    """
+    memfd backend かつアノテーターが対応している場合、チェーン限定の入力を書き込む
+    匿名メモリファイルを用意する。
+
+    Yields:
+        tuple: (入力の書き出し先パス or None, subprocess に渡す pass_fds)
+               None の場合は通常どおり作業ディレクトリに書き出す。
+    """
+    if scratch_backend() != "memfd" or annotator.upper() not in MEMFD_INPUT_ANNOTATORS:
+        yield None, ()
+        return
+    fd = os.memfd_create(f"pkv_{annotator.lower()}_input")
+    try:
+        # 子プロセスでも同じ fd 番号で参照できるよう pass_fds で引き継ぐ
+        yield pathlib.Path(f"/proc/self/fd/{fd}"), (fd,)
+    finally:
+        usage = _RUN_USAGE.get(str(workdir))
+        if usage is not None:
+            usage["memfd_bytes"] += os.fstat(fd).st_size
+        os.close(fd)